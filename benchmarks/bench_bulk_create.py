@@ -0,0 +1,101 @@
+"""
+Ride creation throughput: POST /rides/ one at a time vs POST /rides/bulk.
+
+    MYSQL_USER=... MYSQL_PASSWORD=... MYSQL_HOST=... MYSQL_DB=... \
+        REDIS_HOST=localhost REDIS_PORT=6379 python benchmarks/bench_bulk_create.py
+
+Needs the MySQL database and the Redis the gateway uses. Calls the route
+functions directly (no HTTP) so the numbers are the database and Redis cost
+of each path: RIDES single creations, each with its own INSERT, commit,
+refresh, XADD and publish, against the same number of rides sent through
+the bulk endpoint in batches of each BATCH_SIZES entry. Queued entries and
+rides are removed afterwards.
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+from app import database, models, ride_queue  # noqa: E402
+from app.auth import Principal  # noqa: E402
+from app.routes import rides  # noqa: E402
+from app.schemas import RideCreate  # noqa: E402
+
+RIDES = 2000
+BATCH_SIZES = [10, 50, 200]
+BENCH_EMAIL = "bulk-create@bench.local"
+
+
+def ride(i):
+    return RideCreate(pickup=f"pickup {i}", dropoff=f"dropoff {i}",
+                      pickup_lat=12.9 + i * 1e-5, pickup_lng=77.5 + i * 1e-5)
+
+
+def run_single(principal):
+    start = time.perf_counter()
+    for i in range(RIDES):
+        with database.session_scope() as db:
+            rides.create_ride(ride(i), db, principal)
+    return time.perf_counter() - start
+
+
+def run_bulk(principal, batch_size):
+    start = time.perf_counter()
+    for offset in range(0, RIDES, batch_size):
+        with database.session_scope() as db:
+            rides.create_rides_bulk([ride(i) for i in range(offset, min(offset + batch_size, RIDES))], db, principal)
+    return time.perf_counter() - start
+
+
+def report(name, elapsed, baseline=None):
+    speedup = f"  {baseline / elapsed:5.1f}x" if baseline else ""
+    print(f"{name:<16} rides={RIDES} in {elapsed:6.2f}s  {RIDES / elapsed:8,.0f} rides/s{speedup}")
+
+
+def bench_user():
+    models.Base.metadata.create_all(bind=database.engine)
+    with database.session_scope() as db:
+        user = db.query(models.User).filter(models.User.email == BENCH_EMAIL).first()
+        if not user:
+            user = models.User(name="bench", email=BENCH_EMAIL, password_hash="-")
+            db.add(user)
+            db.commit()
+        return user.id
+
+
+def last_entry_id():
+    last = rides.redis_client.xrevrange(ride_queue.STREAM_KEY, count=1)
+    if not last:
+        return "0-0"
+    entry_id = last[0][0]
+    return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+
+def cleanup(user_id, last_id):
+    with database.session_scope() as db:
+        db.query(models.Ride).filter(models.Ride.user_id == user_id).delete()
+        db.commit()
+    # Delete only the entries added by the run; the stream and its group stay
+    added = [entry_id for entry_id, _ in rides.redis_client.xrange(ride_queue.STREAM_KEY, min=f"({last_id}")]
+    if added:
+        rides.redis_client.xdel(ride_queue.STREAM_KEY, *added)
+
+
+def main():
+    user_id = bench_user()
+    principal = Principal(user_id, False)
+    last_id = last_entry_id()
+    try:
+        baseline = run_single(principal)
+        report("single", baseline)
+        for batch_size in BATCH_SIZES:
+            report(f"bulk x{batch_size}", run_bulk(principal, batch_size), baseline)
+    finally:
+        cleanup(user_id, last_id)
+
+
+if __name__ == "__main__":
+    main()
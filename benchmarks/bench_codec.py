@@ -0,0 +1,75 @@
+"""
+Encode/decode cost per event type: stdlib json vs the app codec.
+
+    python benchmarks/bench_codec.py
+
+Needs nothing running. Each event type the gateway sends or receives is
+encoded and decoded ROUNDS times with the standard library (the old
+json.dumps / send_json path) and with app.codec, which uses orjson when it
+is installed. Reports microseconds per operation and the speedup.
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+
+from app import codec  # noqa: E402
+
+ROUNDS = 20_000
+
+NOW = datetime(2026, 10, 18, 9, 30, 15, 123456)
+
+EVENTS = {
+    "new_ride": {
+        "type": "ride_created", "event": "new_ride", "ride_id": 184467, "user_id": 90211,
+        "pickup": "Terminal 2, Kempegowda International Airport", "dropoff": "MG Road Metro Station",
+        "pickup_lat": 13.1989, "pickup_lng": 77.7068, "status": "requested",
+        "created_at": NOW.isoformat(), "broadcast_to_drivers": True,
+    },
+    "ride_assigned": {
+        "type": "ride_assigned", "ride_id": 184467, "user_id": 90211, "driver_id": 5521,
+        "status": "assigned", "_to": [90211, 5521],
+    },
+    "ride_completed": {"event": "ride_completed", "ride_id": 184467},
+    "ride_accept (recv)": {"action": "ride_accept", "ride_id": 184467},
+    "new_rides x50": {
+        "type": "rides_created", "event": "new_rides", "user_id": 90211, "status": "requested",
+        "created_at": NOW.isoformat(), "broadcast_to_drivers": True,
+        "rides": [{"ride_id": 200000 + i, "pickup": f"Gate {i}, Palace Grounds", "dropoff": "Whitefield",
+                   "pickup_lat": 12.998 + i * 1e-4, "pickup_lng": 77.592} for i in range(50)],
+    },
+    "ride list x100": [
+        {"id": 300000 + i, "user_id": 90211, "driver_id": 5521 if i % 2 else None, "pickup": "Indiranagar",
+         "dropoff": "Koramangala", "pickup_lat": 12.97, "pickup_lng": 77.64, "dropoff_lat": 12.93,
+         "dropoff_lng": 77.62, "status": "completed", "created_at": NOW.isoformat()} for i in range(100)
+    ],
+}
+
+
+def per_op_us(fn, arg):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn(arg)
+    return (time.perf_counter() - start) / ROUNDS * 1e6
+
+
+def main():
+    print(f"codec backend: {codec.BACKEND}, rounds={ROUNDS}")
+    print(f"{'event':<20} {'bytes':>6} {'json enc':>9} {'codec enc':>10} {'x':>5} "
+          f"{'json dec':>9} {'codec dec':>10} {'x':>5}")
+    for name, event in EVENTS.items():
+        text = json.dumps(event)
+        encoded = codec.dumps(event)
+        json_enc = per_op_us(json.dumps, event)
+        codec_enc = per_op_us(codec.dumps_str, event)
+        json_dec = per_op_us(json.loads, text)
+        codec_dec = per_op_us(codec.loads, encoded)
+        print(f"{name:<20} {len(encoded):>6} {json_enc:8.2f}us {codec_enc:9.2f}us {json_enc / codec_enc:4.1f}x "
+              f"{json_dec:8.2f}us {codec_dec:9.2f}us {json_dec / codec_dec:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Driver claims from concurrent workers: no double booking, flat cost in fleet size.
+
+    REDIS_HOST=localhost REDIS_PORT=6379 python benchmarks/bench_driver_claim.py
+
+Needs a Redis server. For each fleet size (1k, 10k, 100k drivers online),
+WORKERS processes each claim CLAIMS rides through app.driver_availability.claim,
+every ride trying the same handful of drivers around a random spot so the
+workers keep racing for them. Checks that no driver ends up booked for two
+rides, and reports the mean claim latency, which should not grow with the
+fleet. Every driver is held by one fake live gateway. The benchmark's keys
+are deleted afterwards.
+"""
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+from app import driver_availability  # noqa: E402
+from app.redis_pool import redis_client  # noqa: E402
+from app.ws_routing import NODE_ALIVE_PREFIX, user_nodes_key  # noqa: E402
+
+driver_availability.ONLINE_KEY = "bench:drivers:online"
+driver_availability.STATE_KEY = "bench:drivers:state"
+
+FLEETS = [1_000, 10_000, 100_000]
+WORKERS = 4
+CLAIMS = 2000
+CANDIDATES = 10
+# Drivers only count as online while a live gateway holds them
+BENCH_NODE = "bench-claim"
+
+
+def claimer(worker: int, fleet: int, results):
+    """One worker: claim CLAIMS rides, each from CANDIDATES neighbouring drivers"""
+    rng = random.Random(worker)
+    booked = []
+    start = time.perf_counter()
+    for n in range(CLAIMS):
+        ride_id = worker * CLAIMS + n + 1
+        spot = rng.randrange(fleet - CANDIDATES)
+        booked += [(driver_id, ride_id) for driver_id in
+                   driver_availability.claim(redis_client, ride_id, range(spot, spot + CANDIDATES))]
+    results.put(((time.perf_counter() - start) / CLAIMS, booked))
+
+
+def connect_fleet(fleet: int):
+    redis_client.set(NODE_ALIVE_PREFIX + BENCH_NODE, 1)
+    for first in range(0, fleet, 10_000):
+        drivers = range(first, min(first + 10_000, fleet))
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sadd(driver_availability.ONLINE_KEY, *drivers)
+        for driver_id in drivers:
+            pipe.sadd(user_nodes_key(driver_id), BENCH_NODE)
+        pipe.execute()
+
+
+def cleanup(fleet: int):
+    redis_client.delete(driver_availability.ONLINE_KEY, driver_availability.STATE_KEY, NODE_ALIVE_PREFIX + BENCH_NODE)
+    for first in range(0, fleet, 10_000):
+        pipe = redis_client.pipeline(transaction=False)
+        for driver_id in range(first, min(first + 10_000, fleet)):
+            pipe.srem(user_nodes_key(driver_id), BENCH_NODE)
+        pipe.execute()
+
+
+def run(fleet: int):
+    cleanup(fleet)
+    connect_fleet(fleet)
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=claimer, args=(i, fleet, results)) for i in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    booked = [pair for _, pairs in outcomes for pair in pairs]
+    drivers = {driver_id for driver_id, _ in booked}
+    assert len(drivers) == len(booked), f"{len(booked) - len(drivers)} drivers double booked"
+    latency = sum(per_claim for per_claim, _ in outcomes) / len(outcomes)
+    print(f"fleet={fleet:>7,}  {latency * 1e6:7.1f} us/claim  booked={len(booked):,} "
+          f"of {WORKERS * CLAIMS:,} rides, no double booking")
+
+
+def main():
+    try:
+        redis_client.ping()
+    except Exception as e:
+        sys.exit(f"Redis not reachable: {e}")
+    print(f"workers={WORKERS} claims/worker={CLAIMS} candidates/claim={CANDIDATES}")
+    try:
+        for fleet in FLEETS:
+            run(fleet)
+    finally:
+        cleanup(max(FLEETS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Driver fan-out cost with 10k connected drivers and 10k riders.
+
+    python benchmarks/bench_driver_fanout.py
+
+Sockets are stubs: most return immediately, SLOW_CLIENTS of them sleep on
+every send to stand in for clients on bad cellular links. The broadcaster
+only encodes and enqueues, so its cost must not depend on the slow ones.
+No database is touched.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+from app import metrics, ws_manager  # noqa: E402
+
+DRIVERS = 10_000
+RIDERS = 10_000
+SLOW_CLIENTS = 100
+ROUNDS = 20
+
+
+class StubSocket:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    async def send_text(self, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+
+async def main():
+    with contextlib.redirect_stdout(io.StringIO()):
+        for user_id in range(DRIVERS):
+            delay = 0.05 if user_id < SLOW_CLIENTS else 0.0
+            ws_manager.add_connection(user_id, StubSocket(delay), is_driver=True)
+        for user_id in range(DRIVERS, DRIVERS + RIDERS):
+            ws_manager.add_connection(user_id, StubSocket(), is_driver=False)
+
+    message = {"event": "new_ride", "ride_id": 1, "pickup": "A", "dropoff": "B", "user_id": DRIVERS}
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            queued = await ws_manager.broadcast_to_drivers(message)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert queued == DRIVERS
+        # Let the fast writers drain before the next round
+        await asyncio.sleep(0.01)
+
+    await asyncio.sleep(ROUNDS * 0.05 + 0.5)
+    snap = metrics.snapshot()
+    print(f"drivers={DRIVERS} riders={RIDERS} slow={SLOW_CLIENTS} db_queries=0")
+    print(f"broadcast_to_drivers (encode + enqueue) p50={statistics.median(samples):.2f} ms max={max(samples):.2f} ms")
+    print(f"fan-out completion incl. slow clients: {snap['histograms']['ws.fanout.drivers_ms']}")
+    print(f"send queue depth after drain: {snap['gauges']['ws.send_queue_depth']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+"""
+Nearest-driver lookup latency against fleet size.
+
+    python benchmarks/bench_driver_matching.py
+
+Drivers and pickups are scattered uniformly over a 40 km x 40 km city box.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+
+from app.geo import DriverGrid  # noqa: E402
+
+CITY_LAT, CITY_LNG = 28.61, 77.21
+SPAN_DEG = 0.36
+QUERIES = 5000
+
+
+def random_point(rng):
+    return (CITY_LAT + rng.uniform(-SPAN_DEG / 2, SPAN_DEG / 2),
+            CITY_LNG + rng.uniform(-SPAN_DEG / 2, SPAN_DEG / 2))
+
+
+def run(fleet_size, rng):
+    grid = DriverGrid()
+    grid.load((driver_id, *random_point(rng)) for driver_id in range(fleet_size))
+
+    samples = []
+    for _ in range(QUERIES):
+        lat, lng = random_point(rng)
+        start = time.perf_counter()
+        grid.nearest(lat, lng, k=1)
+        samples.append((time.perf_counter() - start) * 1e6)
+
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+
+if __name__ == "__main__":
+    rng = random.Random(42)
+    print(f"{'drivers':>8} {'p50 us':>10} {'p99 us':>10}")
+    for fleet_size in (1_000, 10_000, 100_000):
+        p50, p99 = run(fleet_size, rng)
+        print(f"{fleet_size:>8} {p50:>10.1f} {p99:>10.1f}")
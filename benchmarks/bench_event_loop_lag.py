@@ -0,0 +1,100 @@
+"""
+Event-loop responsiveness while rides are created concurrently.
+
+    MYSQL_USER=... MYSQL_PASSWORD=... MYSQL_HOST=... MYSQL_DB=... \
+        python benchmarks/bench_event_loop_lag.py
+
+Needs the MySQL database the gateway uses (tables are created if missing).
+A probe task sleeps 1 ms in a loop and records how late it wakes up, which
+is the delay every other socket on the gateway would see. The same burst of
+ride inserts runs once through the sync session, called from coroutines the
+way the WebSocket handler used to, and once through AsyncSessionLocal.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+
+from app import database, models  # noqa: E402
+
+CONCURRENCY = 50
+RIDES_PER_TASK = 20
+
+
+async def probe(samples, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        samples.append((time.perf_counter() - start - 0.001) * 1000)
+
+
+async def create_sync(user_id):
+    for _ in range(RIDES_PER_TASK):
+        db = database.SessionLocal()
+        try:
+            db.add(models.Ride(user_id=user_id, pickup="bench", dropoff="bench", status="requested"))
+            db.commit()
+        finally:
+            db.close()
+        await asyncio.sleep(0)
+
+
+async def create_async(user_id):
+    for _ in range(RIDES_PER_TASK):
+        async with database.AsyncSessionLocal() as db:
+            db.add(models.Ride(user_id=user_id, pickup="bench", dropoff="bench", status="requested"))
+            await db.commit()
+
+
+async def run(name, worker, user_id):
+    samples, stop = [], asyncio.Event()
+    probe_task = asyncio.create_task(probe(samples, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(user_id) for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    samples.sort()
+    print(f"{name:<14} rides={CONCURRENCY * RIDES_PER_TASK} in {elapsed:.2f}s  "
+          f"probe wakeups={len(samples):>5}  lag p50={statistics.median(samples):7.2f} ms  "
+          f"p99={samples[int(len(samples) * 0.99) - 1]:7.2f} ms  max={samples[-1]:7.2f} ms")
+
+
+def bench_user():
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.email == "loop-lag@bench.local").first()
+        if not user:
+            user = models.User(name="bench", email="loop-lag@bench.local", password_hash="-")
+            db.add(user)
+            db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def cleanup(user_id):
+    db = database.SessionLocal()
+    try:
+        db.query(models.Ride).filter(models.Ride.user_id == user_id).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+async def main():
+    user_id = bench_user()
+    try:
+        await run("sync session", create_sync, user_id)
+        await run("async session", create_async, user_id)
+    finally:
+        cleanup(user_id)
+        await database.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
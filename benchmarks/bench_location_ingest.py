@@ -0,0 +1,105 @@
+"""
+Driver GPS ingestion: pings/sec per gateway core, memory per online driver, flush cost.
+
+    python benchmarks/bench_location_ingest.py [drivers]
+    REDIS_HOST=localhost REDIS_PORT=6379 python benchmarks/bench_location_ingest.py [drivers]
+
+The ingest and memory parts need nothing running. PINGS_PER_DRIVER rounds of
+location_update frames from every driver go through the same path as the
+/ws loop (frame decode + handle_location_update) on one core. Memory is what
+the pending buffer holds with every driver online and unflushed. If Redis is
+reachable, one full buffer is also flushed to the GEO set and timed; the
+benchmark's keys are removed afterwards.
+"""
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+from app import driver_locations, ws_protocol, ws_routes  # noqa: E402
+from app.redis_pool import async_redis_client  # noqa: E402
+
+PINGS_PER_DRIVER = 5
+
+
+class Driver:
+    def __init__(self, driver_id):
+        self.id = driver_id
+        self.is_driver = True
+
+
+class NullSocket:
+    async def send_text(self, frame):
+        raise AssertionError("location pings should not be answered")
+
+
+def frames(drivers, rng):
+    """Pre-encoded text frames, as they would arrive from clients"""
+    return [
+        (Driver(driver_id), ws_protocol.encode(ws_protocol.JSON, {
+            "action": "location_update", "lat": 12.9 + rng.random() * 0.2, "lng": 77.5 + rng.random() * 0.2,
+        }))
+        for _ in range(PINGS_PER_DRIVER) for driver_id in range(1, drivers + 1)
+    ]
+
+
+async def ingest(batch):
+    socket = NullSocket()
+    start = time.perf_counter()
+    for user, frame in batch:
+        data = ws_protocol.decode(ws_protocol.JSON, frame)
+        await ws_routes.handle_location_update(socket, user, data)
+    return time.perf_counter() - start
+
+
+def buffer_bytes(drivers, rng):
+    driver_locations._take()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for driver_id in range(1, drivers + 1):
+        driver_locations.record(driver_id, 12.9 + rng.random() * 0.2, 77.5 + rng.random() * 0.2)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+
+async def timed_flush():
+    try:
+        await async_redis_client.ping()
+    except Exception as e:
+        print(f"flush: skipped, Redis not reachable ({e})")
+        return
+    pending = driver_locations.pending_count()
+    start = time.perf_counter()
+    await driver_locations.flush(async_redis_client)
+    elapsed = time.perf_counter() - start
+    print(f"flush: {pending:,} positions in {elapsed * 1000:.1f} ms "
+          f"({pending / elapsed:,.0f} positions/s, {driver_locations.FLUSH_CHUNK} per GEOADD)")
+    await async_redis_client.delete(driver_locations.GEO_KEY, driver_locations.SEEN_KEY)
+
+
+async def main(drivers: int):
+    rng = random.Random(3)
+    batch = frames(drivers, rng)
+    elapsed = await ingest(batch)
+    print(f"ingest: {len(batch):,} pings from {drivers:,} drivers in {elapsed:.2f}s "
+          f"= {len(batch) / elapsed:,.0f} pings/s on one core; "
+          f"buffered {driver_locations.pending_count():,} (latest per driver)")
+
+    total = buffer_bytes(drivers, rng)
+    print(f"memory: {total / 1024 / 1024:.2f} MiB buffered for {drivers:,} drivers = {total / drivers:.0f} B per online driver")
+
+    await timed_flush()
+    await async_redis_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
@@ -0,0 +1,85 @@
+"""
+New-ride fan-out as the fleet grows: drivers near the pickup vs every driver.
+
+    python benchmarks/bench_nearby_fanout.py [drivers ...]
+
+Sockets are stubs and no database or Redis is needed. Connected drivers are
+spread over a ~30 km city; for each fleet size RIDES new_ride events with a
+random pickup go through dispatch_update, once with coordinates (proximity
+scoped) and once without (the old broadcast to every driver). Reports frames
+queued per ride and dispatch time per ride.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+from app import ws_manager  # noqa: E402
+
+RIDES = 200
+CITY = (12.85, 77.45, 0.27)  # south-west corner and side in degrees (~30 km)
+
+
+class StubSocket:
+    scope = {}
+
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+
+def city_point(rng):
+    lat, lng, side = CITY
+    return lat + rng.random() * side, lng + rng.random() * side
+
+
+def reset():
+    for user_id, conns in list(ws_manager.connections.items()):
+        for conn in list(conns):
+            ws_manager.remove_connection(user_id, conn.websocket)
+
+
+async def run(drivers: int, rng) -> None:
+    with contextlib.redirect_stdout(io.StringIO()):
+        reset()
+        for user_id in range(1, drivers + 1):
+            ws_manager.add_connection(user_id, StubSocket(), is_driver=True, position=city_point(rng))
+
+    for label, with_position in (("nearby", True), ("all drivers", False)):
+        queued = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for ride_id in range(RIDES):
+                message = {"event": "new_ride", "ride_id": ride_id, "broadcast_to_drivers": True}
+                if with_position:
+                    message["pickup_lat"], message["pickup_lng"] = city_point(rng)
+                    queued += await ws_manager.broadcast_nearby(message)
+                else:
+                    queued += await ws_manager.broadcast_to_drivers(message)
+        elapsed = time.perf_counter() - start
+        print(f"drivers={drivers:>6,} {label:<12} frames/ride={queued / RIDES:8.1f} "
+              f"dispatch={elapsed / RIDES * 1000:7.3f} ms/ride")
+        # Let the writers drain before the next round
+        await asyncio.sleep(0.05)
+
+
+async def main(sizes):
+    rng = random.Random(11)
+    print(f"radius={ws_manager.NEW_RIDE_RADIUS_KM} km max_drivers={ws_manager.NEW_RIDE_MAX_DRIVERS} rides={RIDES}")
+    for drivers in sizes:
+        await run(drivers, rng)
+    with contextlib.redirect_stdout(io.StringIO()):
+        reset()
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 50_000]))
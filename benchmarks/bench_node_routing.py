@@ -0,0 +1,113 @@
+"""
+Per-gateway pub/sub traffic with node-targeted routing.
+
+    REDIS_HOST=localhost REDIS_PORT=6379 python benchmarks/bench_node_routing.py [gateways]
+
+Needs a running Redis. Starts one process per gateway; each registers its
+share of USERS under its own node id and counts what arrives on its node
+channel. The parent publishes EVENTS targeted ride updates through
+ws_routing.publish_event. With routing each gateway should see about
+EVENTS / gateways messages, and only messages for users it holds; on the
+old single channel every gateway saw all EVENTS.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+import redis  # noqa: E402
+
+USERS = 10_000
+EVENTS = 20_000
+
+
+def client():
+    return redis.Redis(host=os.environ["REDIS_HOST"], port=int(os.environ["REDIS_PORT"]),
+                       password=os.getenv("REDIS_PASSWORD"))
+
+
+def run_gateway(index: int, gateways: int):
+    from app import ws_routing
+
+    r = client()
+    mine = [u for u in range(USERS) if u % gateways == index]
+    r.set(ws_routing.NODE_ALIVE_PREFIX + ws_routing.NODE_ID, 1, ex=60)
+    pipe = r.pipeline(transaction=False)
+    for user_id in mine:
+        pipe.sadd(ws_routing.user_nodes_key(user_id), ws_routing.NODE_ID)
+    pipe.execute()
+
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(ws_routing.node_channel(), ws_routing.BROADCAST_CHANNEL)
+    print("ready", flush=True)
+
+    received = foreign = 0
+    idle_since = time.monotonic()
+    while time.monotonic() - idle_since < 2.0:
+        message = pubsub.get_message(timeout=0.5)
+        if not message:
+            continue
+        idle_since = time.monotonic()
+        received += 1
+        if json.loads(message["data"])["user_id"] % gateways != index:
+            foreign += 1
+
+    withdraw(r, ws_routing, mine)
+    print(json.dumps({"node": ws_routing.NODE_ID, "received": received, "foreign": foreign}), flush=True)
+
+
+def withdraw(r, ws_routing, user_ids):
+    pipe = r.pipeline(transaction=False)
+    pipe.delete(ws_routing.NODE_ALIVE_PREFIX + ws_routing.NODE_ID)
+    for user_id in user_ids:
+        pipe.srem(ws_routing.user_nodes_key(user_id), ws_routing.NODE_ID)
+    pipe.execute()
+
+
+def main(gateways: int):
+    from app import ws_routing
+
+    procs = []
+    for index in range(gateways):
+        env = {**os.environ, "GATEWAY_NODE_ID": f"bench-gw-{index}"}
+        proc = subprocess.Popen([sys.executable, __file__, "--gateway", str(index), str(gateways)],
+                                env=env, stdout=subprocess.PIPE, text=True)
+        procs.append(proc)
+    for proc in procs:
+        assert proc.stdout.readline().strip() == "ready"
+
+    r = client()
+    rng = random.Random(7)
+    start = time.perf_counter()
+    for offset in range(0, EVENTS, 500):
+        pipe = r.pipeline(transaction=False)
+        for i in range(offset, min(offset + 500, EVENTS)):
+            ws_routing.publish_event(pipe, {"type": "ride_assigned", "ride_id": i, "user_id": rng.randrange(USERS)})
+        pipe.execute()
+    elapsed = time.perf_counter() - start
+
+    results = [json.loads(proc.stdout.readline()) for proc in procs]
+    for proc in procs:
+        proc.wait()
+
+    print(f"gateways={gateways} users={USERS} events={EVENTS} publish_rate={EVENTS / elapsed:,.0f}/s")
+    for res in results:
+        share = res["received"] / EVENTS * 100
+        print(f"  {res['node']:<12} received={res['received']:>6} ({share:5.1f}% of events) foreign={res['foreign']}")
+    total = sum(res["received"] for res in results)
+    assert total == EVENTS, f"expected {EVENTS} deliveries, got {total}"
+    assert all(res["foreign"] == 0 for res in results), "a gateway received events for users it does not hold"
+    print(f"  single-channel equivalent: every gateway receives {EVENTS} (100%)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--gateway":
+        run_gateway(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
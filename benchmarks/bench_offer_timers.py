@@ -0,0 +1,76 @@
+"""
+Cost of tracking offer timeouts: hierarchical timing wheel vs scanning every deadline.
+
+    python benchmarks/bench_offer_timers.py [offers]
+
+Needs nothing running. OFFERS timers (default 100k) with random timeouts
+between 10 and 20 s are scheduled on app.timing_wheel.TimingWheel, then the
+clock is advanced tick by tick for 30 simulated seconds, the way the worker's
+loop does. The baseline keeps a dict of deadlines and scans it every tick.
+Reports schedule cost, per-tick cost and the memory held per outstanding offer.
+"""
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+
+from app.timing_wheel import TimingWheel  # noqa: E402
+
+TICK = 0.1
+SIMULATED = 30.0
+
+
+def timeouts(offers, rng):
+    return [(ride_id, 10 + rng.random() * 10) for ride_id in range(offers)]
+
+
+def wheel(pending):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    timers = TimingWheel(tick=TICK, now=0.0)
+    for ride_id, delay in pending:
+        timers.schedule(ride_id, delay)
+    scheduled = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    fired = 0
+    ticks = int(SIMULATED / TICK)
+    start = time.perf_counter()
+    for step in range(1, ticks + 1):
+        fired += len(timers.advance(step * TICK))
+    advanced = time.perf_counter() - start
+    return scheduled, memory, advanced / ticks, fired
+
+
+def scan(pending):
+    deadlines = {ride_id: delay for ride_id, delay in pending}
+    fired = 0
+    ticks = int(SIMULATED / TICK)
+    start = time.perf_counter()
+    for step in range(1, ticks + 1):
+        now = step * TICK
+        expired = [ride_id for ride_id, deadline in deadlines.items() if deadline <= now]
+        for ride_id in expired:
+            del deadlines[ride_id]
+        fired += len(expired)
+    return (time.perf_counter() - start) / ticks, fired
+
+
+def main(offers: int):
+    pending = timeouts(offers, random.Random(5))
+    scheduled, memory, per_tick, fired = wheel(pending)
+    print(f"offers={offers:,} tick={TICK}s simulated={SIMULATED:.0f}s")
+    print(f"timing wheel: schedule {scheduled / offers * 1e6:.2f} us/offer, "
+          f"{memory / offers:.0f} B/offer, advance {per_tick * 1000:.3f} ms/tick, fired={fired:,}")
+    per_tick, fired = scan(pending)
+    print(f"deadline scan: {per_tick * 1000:.3f} ms/tick, fired={fired:,}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,113 @@
+"""
+Publish-to-dispatch latency: asyncio pub/sub listener vs the old polling thread.
+
+    REDIS_HOST=localhost REDIS_PORT=6379 python benchmarks/bench_redis_listener.py
+
+Needs a running Redis. Each run publishes MESSAGES events on a private
+channel, in small bursts, and records how long each one takes to reach the
+dispatch function on the event loop.
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+import redis  # noqa: E402
+
+from app import ws_manager  # noqa: E402
+
+MESSAGES = 2000
+BURST = 20
+CHANNEL = "bench:ride_updates"
+
+
+def sync_client():
+    return redis.Redis(host=os.environ["REDIS_HOST"], port=int(os.environ["REDIS_PORT"]),
+                       password=os.getenv("REDIS_PASSWORD"))
+
+
+async def publish_all(client):
+    for i in range(0, MESSAGES, BURST):
+        pipe = client.pipeline(transaction=False)
+        for _ in range(BURST):
+            pipe.publish(CHANNEL, json.dumps({"sent": time.perf_counter()}))
+        pipe.execute()
+        await asyncio.sleep(0.002)
+
+
+def report(name, samples):
+    samples.sort()
+    print(f"{name:<22} n={len(samples):>5} p50={statistics.median(samples):7.3f} ms "
+          f"p99={samples[int(len(samples) * 0.99) - 1]:7.3f} ms max={samples[-1]:7.3f} ms")
+
+
+async def run_thread_listener():
+    """The pre-asyncio design: blocking get_message in a thread, call_soon_threadsafe per message"""
+    loop = asyncio.get_running_loop()
+    samples = []
+    done = asyncio.Event()
+    stop = threading.Event()
+
+    async def record(data):
+        samples.append((time.perf_counter() - data["sent"]) * 1000)
+        if len(samples) == MESSAGES:
+            done.set()
+
+    def listener():
+        pubsub = sync_client().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CHANNEL)
+        ready.set()
+        while not stop.is_set():
+            message = pubsub.get_message(timeout=1.0)
+            if message and message.get("type") == "message":
+                data = json.loads(message["data"])
+                loop.call_soon_threadsafe(lambda d=data: asyncio.create_task(record(d)))
+        pubsub.close()
+
+    ready = threading.Event()
+    thread = threading.Thread(target=listener, daemon=True)
+    thread.start()
+    ready.wait()
+    await publish_all(sync_client())
+    await asyncio.wait_for(done.wait(), timeout=30)
+    stop.set()
+    report("thread + polling", samples)
+
+
+async def run_async_listener():
+    samples = []
+    done = asyncio.Event()
+
+    async def record(data):
+        samples.append((time.perf_counter() - data["sent"]) * 1000)
+        if len(samples) == MESSAGES:
+            done.set()
+
+    ws_manager.CHANNEL = CHANNEL
+    ws_manager.dispatch_update = record
+    task = asyncio.create_task(ws_manager.redis_listener())
+    await asyncio.sleep(0.2)
+    await publish_all(sync_client())
+    await asyncio.wait_for(done.wait(), timeout=30)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    report("asyncio listener", samples)
+
+
+async def main():
+    await run_thread_listener()
+    await run_async_listener()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+Many drivers accepting the same ride at once: read-check-write vs conditional UPDATE.
+
+    MYSQL_USER=... MYSQL_PASSWORD=... MYSQL_HOST=... MYSQL_DB=... \
+        python benchmarks/bench_ride_contention.py [drivers]
+
+Needs the MySQL database the gateway uses (tables are created if missing).
+Each round creates one requested ride and releases DRIVERS threads at it
+through a barrier. The old handlers SELECT the ride, check its status in
+Python, UPDATE and refresh; ride_state issues one UPDATE ... WHERE id AND
+status and reads the row count. Reports how many drivers "won" each ride
+(anything above 1 is a double assignment) and per-attempt latency.
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+DRIVERS = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+# Every racing driver needs its own connection, or the pool queue serialises them
+os.environ.setdefault("DB_POOL_SIZE", str(DRIVERS))
+
+from app import database, models, ride_state  # noqa: E402
+
+ROUNDS = 50
+BENCH_EMAIL = "contention@bench.local"
+
+
+def read_check_write(db, ride_id, driver_id):
+    ride = db.query(models.Ride).filter(models.Ride.id == ride_id).first()
+    if ride is None or ride.status != "requested":
+        return False
+    ride.driver_id = driver_id
+    ride.status = "assigned"
+    db.commit()
+    db.refresh(ride)
+    return True
+
+
+def conditional_update(db, ride_id, driver_id):
+    try:
+        ride_state.assign(db, ride_id, driver_id)
+        return True
+    except ride_state.TransitionFailed:
+        return False
+
+
+def contend(accept, ride_id, drivers):
+    barrier = threading.Barrier(drivers)
+    winners, latencies = [], []
+    lock = threading.Lock()
+
+    def driver(driver_id):
+        db = database.SessionLocal()
+        try:
+            db.connection()  # check out before the barrier so only the race is timed
+            barrier.wait()
+            start = time.perf_counter()
+            won = accept(db, ride_id, driver_id)
+            elapsed = (time.perf_counter() - start) * 1000
+        finally:
+            db.close()
+        with lock:
+            latencies.append(elapsed)
+            if won:
+                winners.append(driver_id)
+
+    threads = [threading.Thread(target=driver, args=(i + 1,)) for i in range(drivers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return winners, latencies
+
+
+def run(name, accept, user_id, drivers):
+    win_counts, latencies = [], []
+    for _ in range(ROUNDS):
+        with database.session_scope() as db:
+            ride = models.Ride(user_id=user_id, pickup="bench", dropoff="bench", status="requested")
+            db.add(ride)
+            db.commit()
+            ride_id = ride.id
+        winners, samples = contend(accept, ride_id, drivers)
+        win_counts.append(len(winners))
+        latencies.extend(samples)
+    latencies.sort()
+    doubles = sum(1 for n in win_counts if n > 1)
+    print(f"{name:<20} drivers={drivers} rounds={ROUNDS} rides with >1 winner={doubles:>3} "
+          f"max winners={max(win_counts)}  p50={statistics.median(latencies):6.2f} ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1]:6.2f} ms")
+
+
+def bench_user():
+    models.Base.metadata.create_all(bind=database.engine)
+    with database.session_scope() as db:
+        user = db.query(models.User).filter(models.User.email == BENCH_EMAIL).first()
+        if not user:
+            user = models.User(name="bench", email=BENCH_EMAIL, password_hash="-")
+            db.add(user)
+            db.commit()
+        return user.id
+
+
+def cleanup(user_id):
+    with database.session_scope() as db:
+        db.query(models.Ride).filter(models.Ride.user_id == user_id).delete()
+        db.commit()
+
+
+def main(drivers: int):
+    user_id = bench_user()
+    try:
+        run("read-check-write", read_check_write, user_id, drivers)
+        run("conditional UPDATE", conditional_update, user_id, drivers)
+    finally:
+        cleanup(user_id)
+
+
+if __name__ == "__main__":
+    main(DRIVERS)
@@ -0,0 +1,119 @@
+"""
+Polling GET /rides/my: query and serialize every time vs the ride_cache read-through.
+
+    MYSQL_USER=... MYSQL_PASSWORD=... MYSQL_HOST=... MYSQL_DB=... \
+        REDIS_HOST=localhost REDIS_PORT=6379 python benchmarks/bench_ride_list_cache.py
+
+Needs the MySQL database and the Redis the gateway uses. A bench rider with
+RIDES rides polls the first page POLLS times through the route function (no
+HTTP). The baseline runs the old path: keyset query plus pydantic
+serialization on every poll. The cached runs go through rides.get_my_rides
+with the listing invalidated every INVALIDATE_EVERY polls, as a ride
+transition would. Reports latency per poll, the SQL statements issued and
+the hit ratio. The rides and cache keys are removed afterwards.
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+from sqlalchemy import event  # noqa: E402
+
+from app import database, metrics, models, ride_cache  # noqa: E402
+from app.auth import Principal  # noqa: E402
+from app.routes import rides  # noqa: E402
+
+RIDES = 200
+POLLS = 2000
+INVALIDATE_EVERY = [0, 100, 10]
+BENCH_EMAIL = "ride-list-cache@bench.local"
+
+statements = 0
+
+
+def count_statement(*_):
+    global statements
+    statements += 1
+
+
+def bench_user():
+    models.Base.metadata.create_all(bind=database.engine)
+    with database.session_scope() as db:
+        user = db.query(models.User).filter(models.User.email == BENCH_EMAIL).first()
+        if not user:
+            user = models.User(name="bench", email=BENCH_EMAIL, password_hash="-")
+            db.add(user)
+            db.commit()
+        db.query(models.Ride).filter(models.Ride.user_id == user.id).delete()
+        db.add_all([models.Ride(user_id=user.id, pickup=f"pickup {i}", dropoff=f"dropoff {i}", status="requested")
+                    for i in range(RIDES)])
+        db.commit()
+        return user.id
+
+
+def run_uncached(user_id):
+    filters = rides.RideFilters(None, None, None)
+    start = time.perf_counter()
+    for _ in range(POLLS):
+        with database.session_scope() as db:
+            query = db.query(models.Ride).filter(models.Ride.user_id == user_id)
+            page, _ = rides.fetch_page(query, filters, None, rides.PAGE_SIZE)
+            rides.rides_adapter.dump_json(rides.rides_adapter.validate_python(page, from_attributes=True))
+    return time.perf_counter() - start
+
+
+def run_cached(principal, invalidate_every):
+    filters = rides.RideFilters(None, None, None)
+    start = time.perf_counter()
+    for poll in range(POLLS):
+        if invalidate_every and poll % invalidate_every == 0:
+            pipe = rides.redis_client.pipeline(transaction=False)
+            ride_cache.invalidate(pipe, user_id=principal.id)
+            pipe.execute()
+        with database.session_scope() as db:
+            rides.get_my_rides(None, rides.PAGE_SIZE, filters, db, principal)
+    return time.perf_counter() - start
+
+
+def report(name, elapsed, queries, baseline=None):
+    speedup = f"  {baseline / elapsed:5.1f}x" if baseline else ""
+    print(f"{name:<28} {elapsed / POLLS * 1000:7.3f} ms/poll  sql={queries:<5}{speedup}")
+
+
+def cleanup(user_id):
+    with database.session_scope() as db:
+        db.query(models.Ride).filter(models.Ride.user_id == user_id).delete()
+        db.commit()
+    pipe = rides.redis_client.pipeline(transaction=False)
+    ride_cache.invalidate(pipe, user_id=user_id)
+    pipe.execute()
+
+
+def main():
+    global statements
+    user_id = bench_user()
+    principal = Principal(user_id, False)
+    event.listen(database.engine, "before_cursor_execute", count_statement)
+    print(f"rides={RIDES} page={rides.PAGE_SIZE} polls={POLLS}")
+    try:
+        statements = 0
+        baseline = run_uncached(user_id)
+        report("query + serialize", baseline, statements)
+        for invalidate_every in INVALIDATE_EVERY:
+            hits, misses = metrics.counter("rides.cache.hits"), metrics.counter("rides.cache.misses")
+            statements = 0
+            elapsed = run_cached(principal, invalidate_every)
+            hits = metrics.counter("rides.cache.hits") - hits
+            misses = metrics.counter("rides.cache.misses") - misses
+            name = f"cached, invalidate/{invalidate_every}" if invalidate_every else "cached, steady state"
+            report(name, elapsed, statements, baseline)
+            print(f"{'':<28} hit ratio {hits / (hits + misses):.3f}")
+    finally:
+        cleanup(user_id)
+
+
+if __name__ == "__main__":
+    main()
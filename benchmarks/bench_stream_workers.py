@@ -0,0 +1,104 @@
+"""
+Ride queue throughput with 1 to 8 worker processes on one Redis Stream consumer group.
+
+    REDIS_HOST=localhost REDIS_PORT=6379 python benchmarks/bench_stream_workers.py [work_ms]
+
+Needs a Redis server (5.0+, 6.2+ for XAUTOCLAIM). RIDES entries are queued on
+a throwaway stream, then drained by N consumer processes through app.ride_queue:
+XREADGROUP COUNT READ_COUNT, WORK_MS of simulated assignment work per ride
+(the database round trips of process_ride), and one XACK per read. The
+baseline is the old single worker popping one ride per BLPOP round trip.
+With work_ms=0 the numbers are the raw queue cost. The benchmark's keys are
+deleted afterwards.
+"""
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+os.environ["RIDE_STREAM"] = "bench:ride_stream"
+os.environ["RIDE_STREAM_GROUP"] = "bench_workers"
+
+from app import ride_queue  # noqa: E402
+from app.redis_pool import redis_client  # noqa: E402
+
+RIDES = 4000
+READ_COUNT = 50
+CONSUMERS = [1, 2, 4, 8]
+LIST_KEY = "bench:ride_queue"
+
+
+def consume(name: str, work_ms: float, done):
+    """One worker process: read, work, ack until the stream is drained"""
+    while True:
+        entries = ride_queue.read(redis_client, name, READ_COUNT, 200)
+        if not entries:
+            break
+        for _ in entries:
+            if work_ms:
+                time.sleep(work_ms / 1000)
+        ride_queue.ack(redis_client, [entry_id for entry_id, _ in entries])
+        with done.get_lock():
+            done.value += len(entries)
+
+
+def fill_stream():
+    redis_client.delete(ride_queue.STREAM_KEY)
+    ride_queue.ensure_group(redis_client)
+    pipe = redis_client.pipeline(transaction=False)
+    ride_queue.enqueue(pipe, *[{"ride_id": ride_id} for ride_id in range(1, RIDES + 1)])
+    pipe.execute()
+
+
+def run_stream(consumers: int, work_ms: float) -> float:
+    fill_stream()
+    done = multiprocessing.Value("i", 0)
+    workers = [
+        multiprocessing.Process(target=consume, args=(f"bench-{i}", work_ms, done))
+        for i in range(consumers)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # The last read of each worker waited out its block timeout on an empty stream
+    elapsed = time.perf_counter() - start - 0.2
+    assert done.value == RIDES, f"processed {done.value} of {RIDES}"
+    return elapsed
+
+
+def run_list(work_ms: float) -> float:
+    redis_client.delete(LIST_KEY)
+    redis_client.lpush(LIST_KEY, *[f'{{"ride_id": {ride_id}}}' for ride_id in range(1, RIDES + 1)])
+    start = time.perf_counter()
+    while redis_client.blpop(LIST_KEY, timeout=1):
+        if work_ms:
+            time.sleep(work_ms / 1000)
+    return time.perf_counter() - start - 1
+
+
+def main(work_ms: float):
+    try:
+        redis_client.ping()
+    except Exception as e:
+        sys.exit(f"Redis not reachable: {e}")
+    print(f"rides={RIDES} read_count={READ_COUNT} work_ms={work_ms}")
+    try:
+        elapsed = run_list(work_ms)
+        print(f"list BLPOP, 1 worker     {elapsed:7.2f}s {RIDES / elapsed:9,.0f} rides/s")
+        single = None
+        for consumers in CONSUMERS:
+            elapsed = run_stream(consumers, work_ms)
+            single = single or elapsed
+            print(f"stream group, {consumers} worker{'s' if consumers > 1 else ' '} {elapsed:7.2f}s "
+                  f"{RIDES / elapsed:9,.0f} rides/s  x{single / elapsed:.1f}")
+    finally:
+        redis_client.delete(ride_queue.STREAM_KEY, LIST_KEY)
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 2.0)
@@ -0,0 +1,50 @@
+"""
+Bytes on the wire and CPU per message type: JSON text frames vs the MessagePack subprotocol.
+
+    python benchmarks/bench_ws_protocol.py
+
+Needs nothing running (msgpack must be installed). Uses the same events as
+bench_codec.py. For each one reports the frame size under ridenow.json and
+ridenow.msgpack.v1, and the per-frame encode and decode time through
+ws_protocol. Fan-out encodes once per protocol, so encode cost is paid per
+event; decode cost is what each client pays per frame.
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+
+from app import ws_protocol  # noqa: E402
+from bench_codec import EVENTS  # noqa: E402
+
+ROUNDS = 20_000
+
+
+def per_op_us(fn, *args):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn(*args)
+    return (time.perf_counter() - start) / ROUNDS * 1e6
+
+
+def main():
+    assert ws_protocol.msgpack is not None, "pip install msgpack"
+    json_proto, msgpack_proto = ws_protocol.JSON, ws_protocol.MSGPACK
+    print(f"rounds={ROUNDS}")
+    print(f"{'event':<20} {'json B':>7} {'mpack B':>8} {'saved':>6} "
+          f"{'json enc':>9} {'mpack enc':>10} {'json dec':>9} {'mpack dec':>10}")
+    for name, event in EVENTS.items():
+        text = ws_protocol.encode(json_proto, event)
+        packed = ws_protocol.encode(msgpack_proto, event)
+        json_bytes = len(text.encode())
+        saved = 1 - len(packed) / json_bytes
+        print(f"{name:<20} {json_bytes:>7} {len(packed):>8} {saved:6.0%} "
+              f"{per_op_us(ws_protocol.encode, json_proto, event):8.2f}us "
+              f"{per_op_us(ws_protocol.encode, msgpack_proto, event):9.2f}us "
+              f"{per_op_us(ws_protocol.decode, json_proto, text):8.2f}us "
+              f"{per_op_us(ws_protocol.decode, msgpack_proto, packed):9.2f}us")
+
+
+if __name__ == "__main__":
+    main()
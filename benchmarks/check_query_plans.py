@@ -0,0 +1,137 @@
+"""
+EXPLAIN the hot ride and worker queries and fail on full table scans.
+
+    MYSQL_USER=... MYSQL_PASSWORD=... MYSQL_HOST=... QUERY_PLAN_DB=ridenow_plan_check \
+        python benchmarks/check_query_plans.py
+
+Needs a dedicated, existing MySQL database on the gateway's server, named by
+QUERY_PLAN_DB; it refuses to run without one, or when it names the app's own
+MYSQL_DB, since it creates tables and seeds rows. The schema is brought up to
+date there (tables, columns, indexes), SEED_USERS throwaway users and
+SEED_RIDES rides are inserted so the optimizer sees realistic table sizes, and
+every query the listings and the worker issue is EXPLAINed with the same
+builders they use. Exits non-zero if any plan row has access type ALL. The
+seeded rows are removed afterwards.
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "gateway"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "worker"))
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+# Point the app at the scratch database before app.database builds its engines
+load_dotenv()
+PLAN_DB = os.getenv("QUERY_PLAN_DB")
+if not PLAN_DB or PLAN_DB == os.getenv("MYSQL_DB"):
+    sys.exit("Set QUERY_PLAN_DB to a dedicated scratch database (not MYSQL_DB); this check writes to it")
+os.environ["MYSQL_DB"] = PLAN_DB
+
+from app import database, migrations, models  # noqa: E402
+from app.routes import rides  # noqa: E402
+import ride_worker  # noqa: E402
+
+SEED_USERS = 2_000
+SEED_RIDES = 20_000
+SEED_EMAIL = "@plan-check.bench.local"
+STATUSES = ("requested", "assigned", "completed")
+
+
+def seed(db):
+    """Insert SEED_USERS users (every tenth a driver) and SEED_RIDES rides; return (rider_id, driver_id)"""
+    db.execute(models.User.__table__.insert(), [
+        {"name": "plan-check", "email": f"{i}{SEED_EMAIL}", "password_hash": "-", "is_driver": i % 10 == 0,
+         "last_lat": 12.97 if i % 10 == 0 else None, "last_lng": 77.59 if i % 10 == 0 else None}
+        for i in range(SEED_USERS)
+    ])
+    users = db.query(models.User.id, models.User.is_driver).filter(models.User.email.like("%" + SEED_EMAIL)).all()
+    riders = [u.id for u in users if not u.is_driver]
+    drivers = [u.id for u in users if u.is_driver]
+    start = datetime.utcnow() - timedelta(days=30)
+    db.execute(models.Ride.__table__.insert(), [
+        {"user_id": riders[i % len(riders)], "driver_id": drivers[i % len(drivers)] if i % 3 else None,
+         "pickup": "p", "dropoff": "d", "status": STATUSES[i % 3], "created_at": start + timedelta(minutes=i)}
+        for i in range(SEED_RIDES)
+    ])
+    db.commit()
+    db.execute(text("ANALYZE TABLE rides, users"))
+    return riders[0], drivers[0]
+
+
+def cleanup(db):
+    ids = [u.id for u in db.query(models.User.id).filter(models.User.email.like("%" + SEED_EMAIL))]
+    db.query(models.Ride).filter(models.Ride.user_id.in_(ids)).delete(synchronize_session=False)
+    db.query(models.User).filter(models.User.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+
+
+def queries(db, rider_id, driver_id):
+    """(name, query) for every statement on the listing and worker hot paths"""
+    no_filters = rides.RideFilters(status=None, created_after=None, created_before=None)
+    requested = rides.RideFilters(status="requested", created_after=None, created_before=None)
+    last_week = rides.RideFilters(status=None, created_after=datetime.utcnow() - timedelta(days=7),
+                                   created_before=None)
+    position = (datetime.utcnow() - timedelta(days=10), 10**9)
+
+    def listing(query, filters, cursor=None):
+        query = rides.newest_first(rides.after_cursor(filters.apply(query), cursor))
+        return query.limit(rides.PAGE_SIZE + 1)
+
+    all_rides = db.query(models.Ride)
+    mine = db.query(models.Ride).filter(models.Ride.user_id == rider_id)
+    assigned = db.query(models.Ride).filter(models.Ride.driver_id == driver_id)
+    return [
+        ("rides: first page", listing(all_rides, no_filters)),
+        ("rides: next page", listing(all_rides, no_filters, position)),
+        ("rides: status=requested", listing(all_rides, requested)),
+        ("rides: created_after", listing(all_rides, last_week)),
+        ("rides/my: first page", listing(mine, no_filters)),
+        ("rides/my: next page", listing(mine, no_filters, position)),
+        ("rides/assigned", listing(assigned, no_filters)),
+        ("rides/assigned: status=assigned", listing(assigned, rides.RideFilters("assigned", None, None))),
+        ("rides/export: chunk", rides.newest_first(rides.after_cursor(all_rides, position)).limit(rides.EXPORT_CHUNK)),
+        ("worker: available drivers", ride_worker.available_drivers_query(db)),
+        ("worker: busy drivers", ride_worker.busy_drivers_query(db)),
+        ("worker: any driver", db.query(models.User.id).filter(models.User.is_driver == True).limit(1)),
+        ("worker: ride by id", db.query(models.Ride).filter(models.Ride.id == 1).limit(1)),
+        ("worker: batch rides", db.query(models.Ride).filter(
+            models.Ride.id.in_([1, 2, 3]), models.Ride.status == "requested")),
+    ]
+
+
+def explain(db, query):
+    compiled = query.statement.compile(dialect=database.engine.dialect,
+                                       compile_kwargs={"render_postcompile": True})
+    result = db.connection().exec_driver_sql("EXPLAIN " + str(compiled), compiled.params)
+    return [dict(row._mapping) for row in result]
+
+
+def main():
+    models.Base.metadata.create_all(bind=database.engine)
+    migrations.upgrade_schema(database.engine)
+    failures = 0
+    with database.session_scope() as db:
+        cleanup(db)
+        rider_id, driver_id = seed(db)
+        try:
+            for name, query in queries(db, rider_id, driver_id):
+                plan = explain(db, query)
+                scans = [row for row in plan if row["type"] == "ALL"]
+                failures += bool(scans)
+                keys = ", ".join(f"{row['table']}:{row['key'] or '-'}({row['type']})" for row in plan)
+                print(f"{'FULL SCAN' if scans else 'ok':<9} {name:<34} {keys}")
+        finally:
+            db.rollback()
+            cleanup(db)
+    if failures:
+        print(f"{failures} queries fall back to a full table scan")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
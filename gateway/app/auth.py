@@ -1,12 +1,17 @@
 import os
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
 import jwt
+import redis
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 from .database import get_db
 from .models import User
+from .cache import TTLCache
+from .hashing import hash_password, verify_password  # noqa: F401 (re-exported)
+from . import metrics, redis_pool
 from fastapi.security import OAuth2PasswordBearer
 
 
@@ -18,46 +23,23 @@ SECRET_KEY = os.getenv("SECRET_KEY", "supersecretjwtkey")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-# Initialize password context lazily to avoid import-time errors
-_pwd_context = None
+# Principals resolved from token subjects, so authenticated requests skip the users query.
+# The local tier is per process; AUTH_CACHE_REDIS=true adds a tier shared by all replicas.
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_REDIS = os.getenv("AUTH_CACHE_REDIS") == "true"
+AUTH_CACHE_REDIS_TTL = int(os.getenv("AUTH_CACHE_REDIS_TTL", 300))
+PRINCIPAL_KEY_PREFIX = "auth:principal:"
+
+
+class Principal(NamedTuple):
+    """What authorization needs to know about a user"""
+    id: int
+    is_driver: bool
+
+
+principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
 
-def get_pwd_context():
-    global _pwd_context
-    if _pwd_context is None:
-        try:
-            _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-        except Exception:
-            # If bcrypt fails, use a simple hash
-            _pwd_context = None
-    return _pwd_context
-
-def hash_password(password: str):
-    # Ensure password is not longer than 72 bytes for bcrypt
-    if len(password.encode('utf-8')) > 72:
-        password = password[:72]
-    
-    pwd_context = get_pwd_context()
-    if pwd_context is not None:
-        try:
-            return pwd_context.hash(password)
-        except Exception:
-            pass
-    
-    # Fallback to SHA256 if bcrypt fails
-    import hashlib
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(plain_password, hashed_password):
-    pwd_context = get_pwd_context()
-    if pwd_context is not None:
-        try:
-            return pwd_context.verify(plain_password, hashed_password)
-        except Exception:
-            pass
-    
-    # Fallback verification for SHA256
-    import hashlib
-    return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -68,7 +50,71 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def load_principal(user_id: int, db: Session) -> Optional[Principal]:
+    """Resolve a user id through the local cache, then Redis (if enabled), then MySQL"""
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        metrics.incr("auth.cache.local_hits")
+        return principal
+
+    if AUTH_CACHE_REDIS:
+        try:
+            cached = redis_pool.redis_client.get(PRINCIPAL_KEY_PREFIX + str(user_id))
+        except redis.RedisError:
+            cached = None
+        if cached is not None:
+            metrics.incr("auth.cache.redis_hits")
+            principal = Principal(user_id, cached == b"1")
+            principal_cache.set(user_id, principal)
+            return principal
+
+    metrics.incr("auth.cache.misses")
+    row = db.query(User.id, User.is_driver).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    principal = Principal(row.id, bool(row.is_driver))
+    principal_cache.set(user_id, principal)
+    if AUTH_CACHE_REDIS:
+        try:
+            redis_pool.redis_client.set(PRINCIPAL_KEY_PREFIX + str(user_id), int(principal.is_driver), ex=AUTH_CACHE_REDIS_TTL)
+        except redis.RedisError:
+            pass
+    return principal
+
+
+def invalidate_user(user_id: int):
+    """Drop a cached principal; other replicas' local tiers expire within AUTH_CACHE_TTL"""
+    principal_cache.pop(user_id)
+    if AUTH_CACHE_REDIS:
+        try:
+            redis_pool.redis_client.delete(PRINCIPAL_KEY_PREFIX + str(user_id))
+        except redis.RedisError as e:
+            print(f"Failed to invalidate cached principal {user_id}: {e}")
+
+
+# Changed users are collected as they flush and invalidated only once the
+# transaction commits, so no reader can re-cache the old row in between and a
+# rolled-back change evicts nothing
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _collect_changed_user(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_users", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_users", ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_users(session):
+    session.info.pop("changed_users", None)
+
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -79,13 +125,14 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-    except jwt.InvalidTokenError:
+        user_id = int(user_id)
+    except (jwt.InvalidTokenError, ValueError):
         raise credentials_exception
 
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
+    principal = load_principal(user_id, db)
+    if principal is None:
         raise credentials_exception
-    return user
+    return principal
 
 def decode_token_for_ws(token: str):
     payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -0,0 +1,47 @@
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse as _StarletteJSONResponse
+
+# orjson when it is installed, the standard library otherwise. Both produce
+# compact UTF-8 JSON and accept datetimes, so callers never see the difference.
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+BACKEND = "orjson" if orjson else "json"
+
+
+def encode_default(obj: Any):
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=encode_default, option=_OPTIONS)
+
+    def dumps_str(obj: Any) -> str:
+        return orjson.dumps(obj, default=encode_default, option=_OPTIONS).decode()
+
+    loads = orjson.loads
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=encode_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def dumps_str(obj: Any) -> str:
+        return json.dumps(obj, default=encode_default, ensure_ascii=False, separators=(",", ":"))
+
+    loads = json.loads
+
+
+class JSONResponse(_StarletteJSONResponse):
+    """Default response class; routes with a response_model are already encoded by pydantic"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
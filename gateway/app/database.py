@@ -1,8 +1,13 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from contextlib import contextmanager
 import os
+import time
 from dotenv import load_dotenv
+from . import metrics
 
 load_dotenv()
 
@@ -15,12 +20,75 @@ MYSQL_PORT = os.getenv("MYSQL_PORT", 3306)
 SQLALCHEMY_DATABASE_URL = (
     f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
 )
+# Same database through aiomysql, for code running on the event loop
+ASYNC_SQLALCHEMY_DATABASE_URL = (
+    f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+)
+
+# Connection pool settings, applied to both the sync and the async engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # below MySQL's wait_timeout
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true") == "true"
+
+
+class _TimedCheckout:
+    """Records how long each checkout waits for a pooled (or newly opened) connection"""
+
+    metric_name = "db.pool.checkout_ms"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.incr("db.pool.checkout_timeouts")
+            raise
+        finally:
+            metrics.histogram(self.metric_name).observe((time.perf_counter() - start) * 1000)
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
 
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    metric_name = "db.async_pool.checkout_ms"
+
+
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Objects stay usable after commit, so async code never lazy-loads on attribute access
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **POOL_OPTIONS)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def _pool_stats(pool) -> dict:
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+
+
+def pool_stats() -> dict:
+    return {"sync": _pool_stats(engine.pool), "async": _pool_stats(async_engine.pool)}
+
+
+metrics.register_gauge("db.pool", pool_stats)
+
 # Dependency for FastAPI
 def get_db():
     db = SessionLocal()
@@ -28,3 +96,19 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+@contextmanager
+def session_scope():
+    """Session for code outside FastAPI (the worker); always returned to the pool"""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Dependency for async routes
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,240 @@
+import os
+from typing import Dict, Iterable, List
+
+from redis.exceptions import RedisError
+
+from .ride_state import TransitionFailed
+from .ws_routing import NODE_ALIVE_PREFIX, NODE_ID, USER_NODES_PREFIX, user_nodes_key
+
+# Who can take a ride right now, kept in Redis so every worker and gateway
+# sees the same answer without touching MySQL:
+#   drivers:online  set of drivers with a socket open on some gateway; a
+#                   member only counts while one of the gateways in its
+#                   ws_routing node set is alive, so a gateway that dies
+#                   takes its drivers offline with its liveness key
+#   drivers:state   hash driver_id -> "busy:<ride_id>:<expires_ms>" while a
+#                   ride (or an offer for it) is theirs; "available" or no
+#                   field otherwise
+# A driver is available when online and not busy, busy when the state says
+# so (connected or not) and offline otherwise. Every change is one script,
+# so two workers can never book the same driver. Bookings lapse on their own:
+# an offer with the offer, an accepted ride after DRIVER_BUSY_TTL, so a worker
+# that dies mid-offer or a release lost to a Redis outage cannot strand a driver.
+ONLINE_KEY = "drivers:online"
+STATE_KEY = "drivers:state"
+AVAILABLE = "available"
+BUSY_PREFIX = "busy:"
+DRIVER_BUSY = "Driver is busy with another ride"
+# Longest a ride can keep its driver booked without being completed
+BUSY_TTL = int(os.getenv("DRIVER_BUSY_TTL", 4 * 3600))
+
+# Shared by the scripts below: the server clock in ms, and the ride a state
+# value books the driver for, nil once it is free or the booking has lapsed
+_BOOKING = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local function booked_for(state)
+  if not state then return nil end
+  local ride, expires = string.match(state, '^busy:(%d+):(%d+)$')
+  if ride and tonumber(expires) > now then return ride end
+  return nil
+end
+"""
+
+# Shared by the scripts that ask whether a driver is online (KEYS[1] is the
+# online set): a member counts while a gateway holding them is alive. Dead
+# gateways are pruned from the driver's nodes, as ws_routing.ROUTE_SCRIPT does,
+# and a driver left with none is dropped from the set. The node keys are built
+# here rather than declared, so like ROUTE_SCRIPT this needs a non-cluster Redis.
+_ONLINE = """
+local function online(driver)
+  if redis.call('SISMEMBER', KEYS[1], driver) == 0 then return false end
+  local nodes = '%s' .. driver
+  for _, node in ipairs(redis.call('SMEMBERS', nodes)) do
+    if redis.call('EXISTS', '%s' .. node) == 1 then return true end
+    redis.call('SREM', nodes, node)
+  end
+  redis.call('SREM', KEYS[1], driver)
+  return false
+end
+""" % (USER_NODES_PREFIX, NODE_ALIVE_PREFIX)
+
+# Book the first ARGV[2] online, non-busy drivers from the candidates for a
+# ride, for ARGV[3] ms. Drivers already booked for this ride count as free,
+# so an offer taken over from a dead worker can reach them again.
+# KEYS[1]: online set, KEYS[2]: state hash; ARGV: ride_id, count, ttl_ms, candidates...
+CLAIM_SCRIPT = _BOOKING + _ONLINE + """
+local busy = 'busy:' .. ARGV[1] .. ':' .. (now + tonumber(ARGV[3]))
+local claimed = {}
+for i = 4, #ARGV do
+  local driver = ARGV[i]
+  if online(driver) then
+    local ride = booked_for(redis.call('HGET', KEYS[2], driver))
+    if not ride or ride == ARGV[1] then
+      redis.call('HSET', KEYS[2], driver, busy)
+      table.insert(claimed, driver)
+      if #claimed >= tonumber(ARGV[2]) then break end
+    end
+  end
+end
+return claimed
+"""
+
+# A driver taking a ride themselves: fine unless they are busy with another
+# one. Books (or renews) them for ARGV[3] ms.
+# Returns 0 if refused, 1 if newly booked, 2 if already booked for this ride.
+# KEYS[1]: state hash; ARGV: ride_id, driver_id, ttl_ms
+TAKE_SCRIPT = _BOOKING + """
+local ride = booked_for(redis.call('HGET', KEYS[1], ARGV[2]))
+if ride and ride ~= ARGV[1] then
+  return 0
+end
+redis.call('HSET', KEYS[1], ARGV[2], 'busy:' .. ARGV[1] .. ':' .. (now + tonumber(ARGV[3])))
+if ride then
+  return 2
+end
+return 1
+"""
+
+# Free drivers booked for a ride; anyone since booked for another ride is left alone.
+# KEYS[1]: state hash; ARGV: ride_id, driver ids...
+RELEASE_SCRIPT = """
+local freed = 0
+for i = 2, #ARGV do
+  local state = redis.call('HGET', KEYS[1], ARGV[i])
+  if state and string.match(state, '^busy:(%d+):') == ARGV[1] then
+    redis.call('HSET', KEYS[1], ARGV[i], 'available')
+    freed = freed + 1
+  end
+end
+return freed
+"""
+
+# 1 for each driver that is online and not booked; KEYS[1]: online set, KEYS[2]: state hash
+AVAILABLE_SCRIPT = _BOOKING + _ONLINE + """
+local free = {}
+for i = 1, #ARGV do
+  free[i] = (online(ARGV[i]) and not booked_for(redis.call('HGET', KEYS[2], ARGV[i]))) and 1 or 0
+end
+return free
+"""
+
+# 1 for each driver that is online; KEYS[1]: online set
+ONLINE_SCRIPT = _ONLINE + """
+local result = {}
+for i = 1, #ARGV do
+  result[i] = online(ARGV[i]) and 1 or 0
+end
+return result
+"""
+
+# Register the driver on this gateway and mark them online in one step, so no
+# script sees them online with no gateway to vouch for them.
+# KEYS[1]: user nodes set, KEYS[2]: online set; ARGV: node id, driver_id
+CONNECT_SCRIPT = """
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('SADD', KEYS[2], ARGV[2])
+"""
+
+# Drop this gateway from the driver's nodes; offline once no live gateway holds them.
+# KEYS[1]: online set, KEYS[2]: user nodes set; ARGV: driver_id, node id
+DISCONNECT_SCRIPT = _ONLINE + """
+redis.call('SREM', KEYS[2], ARGV[2])
+if online(ARGV[1]) then
+  return 0
+end
+return 1
+"""
+
+
+def _ms(seconds: float) -> int:
+    return int(seconds * 1000)
+
+
+def claim(client, ride_id: int, candidates: Iterable[int], count: int = 1, ttl: float = BUSY_TTL) -> List[int]:
+    """Atomically book up to count drivers for a ride for ttl seconds, best candidates first; O(candidates)"""
+    candidates = list(candidates)
+    if not candidates:
+        return []
+    script = client.register_script(CLAIM_SCRIPT)
+    claimed = script(keys=[ONLINE_KEY, STATE_KEY], args=[ride_id, count, _ms(ttl), *candidates])
+    return [int(driver_id) for driver_id in claimed]
+
+
+def claim_pairs(client, assignments: Dict[int, int]) -> Dict[int, int]:
+    """Book each ride's chosen driver in one pipeline; returns the ride -> driver pairs that got booked"""
+    if not assignments:
+        return {}
+    script = client.register_script(CLAIM_SCRIPT)
+    pipe = client.pipeline(transaction=False)
+    for ride_id, driver_id in assignments.items():
+        script(keys=[ONLINE_KEY, STATE_KEY], args=[ride_id, 1, _ms(BUSY_TTL), driver_id], client=pipe)
+    return {ride_id: driver_id for (ride_id, driver_id), claimed in zip(assignments.items(), pipe.execute()) if claimed}
+
+
+def release(client, ride_id: int, driver_ids: Iterable[int]):
+    """Make drivers booked for ride_id available again; works with a client or a pipeline"""
+    driver_ids = list(driver_ids)
+    if not driver_ids:
+        return 0
+    script = client.register_script(RELEASE_SCRIPT)
+    return script(keys=[STATE_KEY], args=[ride_id, *driver_ids])
+
+
+def available(client, driver_ids: List[int]) -> List[bool]:
+    """Which of driver_ids could be claimed right now, in one round trip"""
+    if not driver_ids:
+        return []
+    script = client.register_script(AVAILABLE_SCRIPT)
+    return [bool(free) for free in script(keys=[ONLINE_KEY, STATE_KEY], args=driver_ids)]
+
+
+def online(client, driver_ids: List[int], chunk: int = 1000) -> List[bool]:
+    """Which of driver_ids have a live gateway, a chunk per script so Redis is never held long"""
+    if not driver_ids:
+        return []
+    script = client.register_script(ONLINE_SCRIPT)
+    pipe = client.pipeline(transaction=False)
+    for start in range(0, len(driver_ids), chunk):
+        script(keys=[ONLINE_KEY], args=driver_ids[start:start + chunk], client=pipe)
+    return [bool(flag) for flags in pipe.execute() for flag in flags]
+
+
+# --- Gateway side (redis.asyncio) ---
+async def connect(client, driver_id: int):
+    script = client.register_script(CONNECT_SCRIPT)
+    await script(keys=[user_nodes_key(driver_id), ONLINE_KEY], args=[NODE_ID, driver_id])
+
+
+async def disconnect(client, driver_id: int):
+    script = client.register_script(DISCONNECT_SCRIPT)
+    await script(keys=[ONLINE_KEY, user_nodes_key(driver_id)], args=[driver_id, NODE_ID])
+
+
+async def take_async(client, ride_id: int, driver_id: int) -> bool:
+    """
+    Book the driver accepting a ride, or raise TransitionFailed if they are on
+    another one. True if this call booked them, so a failed accept can undo it.
+    """
+    script = client.register_script(TAKE_SCRIPT)
+    try:
+        taken = await script(keys=[STATE_KEY], args=[ride_id, driver_id, _ms(BUSY_TTL)])
+    except RedisError as e:
+        # Availability only guards against double booking; MySQL still decides the ride
+        print(f"Availability check skipped for driver {driver_id}: {e}")
+        return False
+    if not taken:
+        raise TransitionFailed(409, DRIVER_BUSY)
+    return taken == 1
+
+
+async def release_async(client, ride_id: int, driver_ids: Iterable[int]):
+    """release for redis.asyncio clients; best effort"""
+    driver_ids = list(driver_ids)
+    if not driver_ids:
+        return
+    script = client.register_script(RELEASE_SCRIPT)
+    try:
+        await script(keys=[STATE_KEY], args=[ride_id, *driver_ids])
+    except RedisError as e:
+        print(f"Could not release drivers {driver_ids} from ride {ride_id}: {e}")
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+
+from . import metrics
+from .database import AsyncSessionLocal
+from .models import User
+
+# Live driver positions. Pings land in an in-memory map (latest per driver
+# wins) and a background task flushes it to a Redis GEO set in batches, so a
+# driver pinging every few seconds costs one dict write per ping. MySQL only
+# gets the latest position per driver every PERSIST_INTERVAL, in one batched
+# UPDATE, so users.last_lat/last_lng stay a usable last known position.
+GEO_KEY = "drivers:geo"
+# Last flush time per driver, so positions of drivers that went quiet expire
+SEEN_KEY = "drivers:geo:seen"
+
+FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", 1.0))
+FLUSH_CHUNK = int(os.getenv("LOCATION_FLUSH_CHUNK", 500))
+# Positions older than this are dropped from the GEO set and ignored by readers
+LOCATION_TTL = int(os.getenv("LOCATION_TTL", 120))
+PRUNE_INTERVAL = float(os.getenv("LOCATION_PRUNE_INTERVAL", 30))
+PERSIST_INTERVAL = float(os.getenv("LOCATION_PERSIST_INTERVAL", 60))
+MAX_GEO_LAT = 85.05112878
+
+# driver_id -> (lng, lat); one small tuple per driver that pinged since the last flush
+_pending: Dict[int, Tuple[float, float]] = {}
+# Flushed to Redis but not yet written to users; same shape as _pending
+_unsaved: Dict[int, Tuple[float, float]] = {}
+
+
+def record(driver_id: int, lat: float, lng: float):
+    """Buffer a ping; O(1) and never touches the network"""
+    if driver_id in _pending:
+        metrics.incr("locations.coalesced")
+    _pending[driver_id] = (lng, lat)
+    metrics.incr("locations.pings")
+
+
+def pending_count() -> int:
+    return len(_pending)
+
+
+metrics.register_gauge("locations.pending", pending_count)
+
+
+def _take() -> Dict[int, Tuple[float, float]]:
+    global _pending
+    batch, _pending = _pending, {}
+    return batch
+
+
+async def flush(client) -> int:
+    """Write every buffered position with one pipeline of chunked GEOADD/ZADD commands"""
+    batch = _take()
+    if not batch:
+        return 0
+    start = time.perf_counter()
+    now = time.time()
+    items = list(batch.items())
+    pipe = client.pipeline(transaction=False)
+    for offset in range(0, len(items), FLUSH_CHUNK):
+        chunk = items[offset:offset + FLUSH_CHUNK]
+        geo = []
+        for driver_id, (lng, lat) in chunk:
+            geo.extend((lng, lat, driver_id))
+        pipe.geoadd(GEO_KEY, geo)
+        pipe.zadd(SEEN_KEY, {driver_id: now for driver_id, _ in chunk})
+    try:
+        await pipe.execute()
+    except Exception:
+        # Put the positions back unless a newer ping arrived meanwhile
+        for driver_id, position in batch.items():
+            _pending.setdefault(driver_id, position)
+        raise
+    _unsaved.update(batch)
+    metrics.histogram("locations.flush_ms").observe((time.perf_counter() - start) * 1000)
+    metrics.incr("locations.flushed", len(batch))
+    return len(batch)
+
+
+async def persist() -> int:
+    """Write the latest flushed position of each driver to users in one executemany UPDATE"""
+    global _unsaved
+    batch, _unsaved = _unsaved, {}
+    if not batch:
+        return 0
+    rows = [{"id": driver_id, "last_lat": lat, "last_lng": lng} for driver_id, (lng, lat) in batch.items()]
+    try:
+        async with AsyncSessionLocal() as db:
+            # ORM bulk UPDATE by primary key: one statement, executemany
+            await db.execute(update(User), rows)
+            await db.commit()
+    except Exception:
+        for driver_id, position in batch.items():
+            _unsaved.setdefault(driver_id, position)
+        raise
+    metrics.incr("locations.persisted", len(batch))
+    return len(batch)
+
+
+async def prune(client) -> int:
+    """Drop drivers whose last position is older than LOCATION_TTL"""
+    cutoff = time.time() - LOCATION_TTL
+    stale = await client.zrangebyscore(SEEN_KEY, "-inf", cutoff)
+    if not stale:
+        return 0
+    pipe = client.pipeline(transaction=False)
+    pipe.zrem(GEO_KEY, *stale)
+    pipe.zrem(SEEN_KEY, *stale)
+    await pipe.execute()
+    return len(stale)
+
+
+async def flush_loop(client):
+    """
+    Gateway background task: flush every FLUSH_INTERVAL, prune every
+    PRUNE_INTERVAL, persist to MySQL every PERSIST_INTERVAL
+    """
+    last_prune = last_persist = time.monotonic()
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush(client)
+            if time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                last_prune = time.monotonic()
+                await prune(client)
+            if time.monotonic() - last_persist >= PERSIST_INTERVAL:
+                last_persist = time.monotonic()
+                await persist()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WS] Location flush failed: {e}")
+
+
+# --- Readers (sync client; used by the worker) ---
+def live_positions(client, chunk: int = 1000) -> List[Tuple[int, float, float]]:
+    """(driver_id, lat, lng) for every driver seen within LOCATION_TTL"""
+    cutoff = time.time() - LOCATION_TTL
+    driver_ids = client.zrangebyscore(SEEN_KEY, cutoff, "+inf")
+    positions = []
+    for offset in range(0, len(driver_ids), chunk):
+        ids = driver_ids[offset:offset + chunk]
+        for driver_id, pos in zip(ids, client.geopos(GEO_KEY, *ids)):
+            if pos:
+                positions.append((int(driver_id), pos[1], pos[0]))
+    return positions
+
+
+async def live_position_async(client, driver_id: int) -> Optional[Tuple[float, float, float]]:
+    """(lat, lng, seen_at) of a driver seen within LOCATION_TTL, or None"""
+    pipe = client.pipeline(transaction=False)
+    pipe.zscore(SEEN_KEY, driver_id)
+    pipe.geopos(GEO_KEY, driver_id)
+    seen_at, (pos,) = await pipe.execute()
+    if seen_at is None or pos is None or seen_at < time.time() - LOCATION_TTL:
+        return None
+    return pos[1], pos[0], seen_at
+
+
+def valid_position(lat, lng) -> bool:
+    """Numbers inside the range Redis GEO can index (it stops at +/-85.05 latitude)"""
+    return (type(lat) in (int, float) and type(lng) in (int, float)
+            and -MAX_GEO_LAT <= lat <= MAX_GEO_LAT and -180 <= lng <= 180)
+
@@ -0,0 +1,208 @@
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Mean earth radius and the length of one degree of latitude
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180.0
+
+# ~1.1 km cells: a city fits in a few thousand buckets
+DEFAULT_CELL_DEG = 0.01
+# Bulk loads resize cells so that a nearest lookup touches only a handful of drivers
+TARGET_PER_CELL = 4
+MIN_CELL_DEG = 0.0005
+MAX_CELL_DEG = 0.05
+# Nearest lookups give up beyond this unless told otherwise; a pickup far from
+# the fleet must not scan rings of empty cells all the way out to it
+DEFAULT_MAX_RADIUS_KM = 50.0
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class DriverGrid:
+    """
+    Uniform lat/lng grid of driver positions.
+    Each cell is a dict of driver_id -> (lat, lng), so moves and removals are O(1)
+    and a nearest lookup only touches the rings of cells around the query point.
+    """
+
+    def __init__(self, cell_deg: float = DEFAULT_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._cells: Dict[Tuple[int, int], Dict[int, Tuple[float, float]]] = {}
+        self._positions: Dict[int, Tuple[float, float, Tuple[int, int]]] = {}
+        # (min_i, max_i, min_j, max_j) of every cell ever occupied since the last
+        # clear; removals do not shrink it, which only makes it conservative
+        self._bounds: Optional[Tuple[int, int, int, int]] = None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, driver_id: int):
+        return driver_id in self._positions
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def upsert(self, driver_id: int, lat: float, lng: float):
+        """Insert a driver or move it to a new position"""
+        cell = self._cell(lat, lng)
+        old = self._positions.get(driver_id)
+        if old is not None and old[2] != cell:
+            self._discard(driver_id, old[2])
+        self._cells.setdefault(cell, {})[driver_id] = (lat, lng)
+        self._positions[driver_id] = (lat, lng, cell)
+        if self._bounds is None:
+            self._bounds = (cell[0], cell[0], cell[1], cell[1])
+        else:
+            min_i, max_i, min_j, max_j = self._bounds
+            if not (min_i <= cell[0] <= max_i and min_j <= cell[1] <= max_j):
+                self._bounds = (min(min_i, cell[0]), max(max_i, cell[0]), min(min_j, cell[1]), max(max_j, cell[1]))
+
+    def remove(self, driver_id: int):
+        old = self._positions.pop(driver_id, None)
+        if old is not None:
+            self._discard(driver_id, old[2])
+
+    def _discard(self, driver_id: int, cell: Tuple[int, int]):
+        bucket = self._cells.get(cell)
+        if bucket is None:
+            return
+        bucket.pop(driver_id, None)
+        if not bucket:
+            del self._cells[cell]
+
+    def position(self, driver_id: int) -> Optional[Tuple[float, float]]:
+        pos = self._positions.get(driver_id)
+        return (pos[0], pos[1]) if pos else None
+
+    def items(self) -> List[Tuple[int, float, float]]:
+        """Snapshot of (driver_id, lat, lng) for every indexed driver"""
+        return [(driver_id, pos[0], pos[1]) for driver_id, pos in self._positions.items()]
+
+    def clear(self):
+        self._cells.clear()
+        self._positions.clear()
+        self._bounds = None
+
+    def load(self, drivers: Iterable[Tuple[int, float, float]], adaptive: bool = True):
+        """
+        Replace the whole index with (driver_id, lat, lng) rows.
+        With adaptive set, the cell size is re-derived from fleet density so
+        lookup cost stays flat as the fleet grows.
+        """
+        rows = list(drivers)
+        self.clear()
+        if adaptive and rows:
+            self.cell_deg = self._tuned_cell_deg(rows)
+        for driver_id, lat, lng in rows:
+            self.upsert(driver_id, lat, lng)
+
+    @staticmethod
+    def _tuned_cell_deg(rows) -> float:
+        lats = [r[1] for r in rows]
+        lngs = [r[2] for r in rows]
+        area = max(max(lats) - min(lats), MIN_CELL_DEG) * max(max(lngs) - min(lngs), MIN_CELL_DEG)
+        cell = math.sqrt(area * TARGET_PER_CELL / len(rows))
+        return min(MAX_CELL_DEG, max(MIN_CELL_DEG, cell))
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield (ci, cj)
+            return
+        for dj in range(-r, r + 1):
+            yield (ci - r, cj + dj)
+            yield (ci + r, cj + dj)
+        for di in range(-r + 1, r):
+            yield (ci + di, cj - r)
+            yield (ci + di, cj + r)
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        k: int = 1,
+        max_radius_km: Optional[float] = DEFAULT_MAX_RADIUS_KM,
+        exclude: Optional[set] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Return up to k (driver_id, distance_km) pairs closest to (lat, lng) and
+        within max_radius_km (None for no limit). Rings of cells are scanned
+        outwards, starting at the first one that reaches an occupied cell, until
+        the k-th best candidate is closer than anything an unscanned ring could
+        contain, the radius is exceeded or every occupied cell has been covered.
+        """
+        if k <= 0 or not self._positions:
+            return []
+        ci, cj = self._cell(lat, lng)
+        min_i, max_i, min_j, max_j = self._bounds
+        # Rings closer than first_ring are empty; rings past last_ring hold nothing either
+        first_ring = max(0, min_i - ci, ci - max_i, min_j - cj, cj - max_j)
+        last_ring = max(ci - min_i, max_i - ci, cj - min_j, max_j - cj)
+
+        # Rank candidates on a local equirectangular projection, which is
+        # accurate at city scale and much cheaper than haversine per driver.
+        ky = KM_PER_DEG
+        kx = KM_PER_DEG * math.cos(math.radians(lat))
+        fi = lat / self.cell_deg - ci
+        fj = lng / self.cell_deg - cj
+        edge_i = min(fi, 1.0 - fi)
+        edge_j = min(fj, 1.0 - fj)
+        max_sq = max_radius_km * max_radius_km if max_radius_km is not None else None
+        if max_sq is not None and first_ring > 0:
+            # Everything in ring first_ring is at least first_ring - 1 whole cells away
+            near_km = min((first_ring - 1 + edge_i) * self.cell_deg * ky, (first_ring - 1 + edge_j) * self.cell_deg * kx)
+            if near_km * near_km > max_sq:
+                return []
+
+        found: List[Tuple[float, int]] = []
+        seen = 0
+        r = first_ring
+        while True:
+            if 8 * r > len(self._cells):
+                # The ring is bigger than the set of occupied cells: visit the occupied ones left instead
+                cells = [c for c in self._cells if max(abs(c[0] - ci), abs(c[1] - cj)) >= r]
+                r = max(r, last_ring)
+            else:
+                cells = self._ring(ci, cj, r)
+            for cell in cells:
+                bucket = self._cells.get(cell)
+                if not bucket:
+                    continue
+                seen += len(bucket)
+                for driver_id, (dlat, dlng) in bucket.items():
+                    if exclude and driver_id in exclude:
+                        continue
+                    dy = (dlat - lat) * ky
+                    dx = (dlng - lng) * kx
+                    found.append((dx * dx + dy * dy, driver_id))
+
+            # Anything outside rings 0..r is at least this far from the query point
+            bound_km = min((r + edge_i) * self.cell_deg * ky, (r + edge_j) * self.cell_deg * kx)
+            bound_sq = bound_km * bound_km
+            if len(found) >= k:
+                found.sort()
+                del found[k:]
+                if found[-1][0] <= bound_sq:
+                    break
+            if max_sq is not None and bound_sq > max_sq:
+                break
+            if seen >= len(self._positions) or r >= last_ring:
+                break
+            r += 1
+
+        found.sort()
+        result = []
+        for _, driver_id in found[:k]:
+            dlat, dlng, _cell = self._positions[driver_id]
+            dist = haversine_km(lat, lng, dlat, dlng)
+            if max_radius_km is None or dist <= max_radius_km:
+                result.append((driver_id, dist))
+        result.sort(key=lambda item: item[1])
+        return result
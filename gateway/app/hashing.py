@@ -0,0 +1,112 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+from . import metrics
+
+# bcrypt runs in a dedicated process pool so login bursts never occupy the
+# event loop or Starlette's threadpool. Requests beyond the pool plus
+# HASH_QUEUE_LIMIT waiting jobs are rejected instead of piling up.
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", os.cpu_count() or 2))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", 32))
+
+
+class HashPoolBusy(Exception):
+    """Raised when the hashing pool's admission queue is full"""
+
+
+# Initialize password context lazily to avoid import-time errors
+_pwd_context = None
+
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        try:
+            _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        except Exception:
+            # If bcrypt fails, use a simple hash
+            _pwd_context = None
+    return _pwd_context
+
+def hash_password(password: str):
+    # Ensure password is not longer than 72 bytes for bcrypt
+    if len(password.encode('utf-8')) > 72:
+        password = password[:72]
+    
+    pwd_context = get_pwd_context()
+    if pwd_context is not None:
+        try:
+            return pwd_context.hash(password)
+        except Exception:
+            pass
+    
+    # Fallback to SHA256 if bcrypt fails
+    import hashlib
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def verify_password(plain_password, hashed_password):
+    pwd_context = get_pwd_context()
+    if pwd_context is not None:
+        try:
+            return pwd_context.verify(plain_password, hashed_password)
+        except Exception:
+            pass
+    
+    # Fallback verification for SHA256
+    import hashlib
+    return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
+
+
+def _timed(fn, *args):
+    """Runs in a pool process: returns (result, wall-clock start, duration in ms)"""
+    started = time.time()
+    result = fn(*args)
+    return result, started, (time.time() - started) * 1000
+
+
+_executor = None
+_in_flight = 0
+
+
+def start():
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the gateway process has an event loop and threads running
+        _executor = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _submit(fn, *args):
+    global _in_flight
+    if _in_flight >= HASH_POOL_SIZE + HASH_QUEUE_LIMIT:
+        metrics.incr("auth.hash.rejected")
+        raise HashPoolBusy()
+    _in_flight += 1
+    submitted = time.time()
+    try:
+        result, started, duration_ms = await asyncio.get_running_loop().run_in_executor(start(), _timed, fn, *args)
+    finally:
+        _in_flight -= 1
+    metrics.histogram("auth.hash.queue_wait_ms").observe(max(0.0, (started - submitted) * 1000))
+    metrics.histogram("auth.hash.duration_ms").observe(duration_ms)
+    return result
+
+
+async def hash_password_async(password: str) -> str:
+    return await _submit(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _submit(verify_password, plain_password, hashed_password)
+
+
+metrics.register_gauge("auth.hash.in_flight", lambda: _in_flight)
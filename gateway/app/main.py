@@ -1,21 +1,20 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from dotenv import load_dotenv
-from . import models, database, schemas, auth
-from sqlalchemy.orm import Session
-import redis
+from . import models, database, schemas, auth, migrations, metrics, hashing, redis_pool, codec, driver_locations, driver_availability
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 import time
 from .routes import rides
 import asyncio
-import threading
 from .ws_forwarder import WsForwarder
-from .ws_manager import redis_listener
+from .ws_manager import redis_listener, async_redis_client
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from . import ws_routes
+from fastapi.responses import FileResponse, JSONResponse
+from . import ws_routes, ws_manager, ws_routing
 load_dotenv()
 
-app = FastAPI(title="RideNow API")
+app = FastAPI(title="RideNow API", default_response_class=codec.JSONResponse)
 app.include_router(rides.router)
 app.include_router(ws_routes.router)
 
@@ -25,13 +24,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-)
-
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT")),
-    password=os.getenv("REDIS_PASSWORD"),
-    ssl=os.getenv("REDIS_TLS") == "true",
+    expose_headers=["X-Next-Cursor"],
 )
 
 from fastapi.staticfiles import StaticFiles
@@ -45,6 +38,7 @@ def init_db():
     for attempt in range(max_retries):
         try:
             models.Base.metadata.create_all(bind=database.engine)
+            migrations.upgrade_schema(database.engine)
             print("Database tables created successfully")
             break
         except Exception as e:
@@ -61,27 +55,48 @@ def init_db():
 init_db()
 
 
+@app.exception_handler(hashing.HashPoolBusy)
+async def hash_pool_busy_handler(request: Request, exc: hashing.HashPoolBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many login attempts in progress, please retry"},
+        headers={"Retry-After": "1"},
+    )
+
+
 @app.post("/signup", response_model=schemas.UserOut)
-def signup(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    if db.query(models.User).filter(models.User.email == user.email).first():
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_async_db)):
+    existing = await db.execute(select(models.User.id).where(models.User.email == user.email))
+    if existing.first():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
-    hashed_password = auth.hash_password(user.password)
+    hashed_password = await hashing.hash_password_async(user.password)
     db_user = models.User(name=user.name, email=user.email, password_hash=hashed_password, is_driver=user.is_driver)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     return db_user
 
 
 @app.post("/login", response_model=schemas.LoginResponse)
-def login(login_data: schemas.LoginRequest, db: Session = Depends(database.get_db)):
-    db_user = db.query(models.User).filter(models.User.email == login_data.email).first()
-    if not db_user or not auth.verify_password(login_data.password, db_user.password_hash):
+async def login(login_data: schemas.LoginRequest, db: AsyncSession = Depends(database.get_async_db)):
+    result = await db.execute(select(models.User).where(models.User.email == login_data.email))
+    db_user = result.scalars().first()
+    if not db_user or not await hashing.verify_password_async(login_data.password, db_user.password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     token = auth.create_access_token({"sub": str(db_user.id)})
     return {"access_token": token, "token_type": "bearer", "is_driver": db_user.is_driver}
 
 
+@app.post("/drivers/location")
+async def update_driver_location(location: schemas.LocationUpdate, current_user: auth.Principal = Depends(auth.get_current_user)):
+    if not current_user.is_driver:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only drivers can report a location")
+    if not driver_locations.valid_position(location.lat, location.lng):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Location outside the indexable range")
+    # Buffered and flushed to the Redis GEO set with the WebSocket pings
+    driver_locations.record(current_user.id, location.lat, location.lng)
+    return {"status": "ok"}
+
+
 @app.get("/")
 def read_root():
     return FileResponse(os.path.join("gateway/app/static", "login.html"))
@@ -92,11 +107,45 @@ def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
+
 @app.on_event("startup")
 async def startup_event():
     loop = asyncio.get_event_loop()
     app.state.loop = loop
     app.state.ws_forwarder = WsForwarder(loop)
-
-    t = threading.Thread(target=redis_listener, args=(app,), daemon=True)
-    t.start()
+    hashing.start()
+    app.state.redis_listener = asyncio.create_task(redis_listener())
+    app.state.node_heartbeat = asyncio.create_task(ws_routing.heartbeat(async_redis_client))
+    app.state.location_flusher = asyncio.create_task(driver_locations.flush_loop(async_redis_client))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for name in ("redis_listener", "node_heartbeat", "location_flusher"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    try:
+        await ws_routing.shutdown(async_redis_client, list(ws_manager.connections))
+        for driver_id in list(ws_manager.driver_ids):
+            await driver_availability.disconnect(async_redis_client, driver_id)
+    except Exception as e:
+        print(f"[WS] Failed to withdraw node registrations: {e}")
+    try:
+        await driver_locations.flush(async_redis_client)
+    except Exception as e:
+        print(f"[WS] Failed to flush buffered locations: {e}")
+    try:
+        await driver_locations.persist()
+    except Exception as e:
+        print(f"[WS] Failed to persist driver locations: {e}")
+    await redis_pool.close()
+    hashing.shutdown()
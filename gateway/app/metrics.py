@@ -0,0 +1,89 @@
+import bisect
+import threading
+from typing import Callable, Dict, List
+
+# Upper bounds (ms) of the latency buckets; the last bucket is open-ended
+DEFAULT_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+_lock = threading.Lock()
+_histograms: Dict[str, "Histogram"] = {}
+_counters: Dict[str, int] = {}
+_gauges: Dict[str, Callable[[], object]] = {}
+
+
+class Histogram:
+    """Fixed-bucket latency histogram, cheap enough to observe on every request"""
+
+    def __init__(self, buckets: List[float] = None):
+        self.buckets = list(buckets or DEFAULT_BUCKETS_MS)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms: float):
+        idx = bisect.bisect_left(self.buckets, value_ms)
+        with _lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.total += value_ms
+            if value_ms > self.max:
+                self.max = value_ms
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[idx] if idx < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p90_ms": self.quantile(0.9),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max, 3),
+        }
+
+
+def histogram(name: str, buckets: List[float] = None) -> Histogram:
+    hist = _histograms.get(name)
+    if hist is None:
+        with _lock:
+            hist = _histograms.setdefault(name, Histogram(buckets))
+    return hist
+
+
+def incr(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def counter(name: str) -> int:
+    return _counters.get(name, 0)
+
+
+def register_gauge(name: str, fn: Callable[[], object]):
+    """Register a callable that is evaluated whenever metrics are read"""
+    _gauges[name] = fn
+
+
+def snapshot() -> dict:
+    gauges = {}
+    for name, fn in list(_gauges.items()):
+        try:
+            gauges[name] = fn()
+        except Exception as e:
+            gauges[name] = f"error: {e}"
+    return {
+        "counters": dict(_counters),
+        "gauges": gauges,
+        "histograms": {name: h.snapshot() for name, h in list(_histograms.items())},
+    }
@@ -0,0 +1,55 @@
+from sqlalchemy import inspect, text
+from .database import Base
+
+# Columns added after the first release. create_all() never alters an existing
+# table, so deployments that predate them get the columns added here.
+ADDED_COLUMNS = {
+    "users": ["last_lat", "last_lng"],
+    "rides": ["pickup_lat", "pickup_lng", "dropoff_lat", "dropoff_lng"],
+}
+
+
+def upgrade_schema(engine):
+    """Bring tables created by an older version up to date: missing columns, then missing indexes"""
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
+
+
+def add_missing_columns(engine):
+    """Add any missing nullable columns to tables created by an older version"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as conn:
+        for table_name, column_names in ADDED_COLUMNS.items():
+            if table_name not in existing_tables:
+                continue
+            table = Base.metadata.tables[table_name]
+            present = {c["name"] for c in inspector.get_columns(table_name)}
+            for name in column_names:
+                if name in present:
+                    continue
+                column = table.c[name]
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {col_type} NULL"))
+                print(f"Added column {table_name}.{name}")
+
+
+def add_missing_indexes(engine):
+    """
+    Create the indexes declared on the models that an existing table lacks.
+    InnoDB builds secondary indexes online, so writes continue meanwhile.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table_name, table in Base.metadata.tables.items():
+        if table_name not in existing_tables:
+            continue
+        present = {ix["name"] for ix in inspector.get_indexes(table_name)}
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name in present:
+                continue
+            with engine.begin() as conn:
+                index.create(conn)
+            print(f"Created index {table_name}.{index.name}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Float, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -10,7 +10,10 @@ class User(Base):
     name = Column(String(255), nullable=False)
     email = Column(String(255), unique=True, index=True, nullable=False)
     password_hash = Column(String(255), nullable=False)
-    is_driver = Column(Boolean, default=False)
+    is_driver = Column(Boolean, default=False, index=True)
+    # Last known driver position, used by the worker's matching index
+    last_lat = Column(Float, nullable=True)
+    last_lng = Column(Float, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -26,8 +29,21 @@ class Ride(Base):
     driver_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     pickup = Column(String(500), nullable=False)
     dropoff = Column(String(500), nullable=False)
+    pickup_lat = Column(Float, nullable=True)
+    pickup_lng = Column(Float, nullable=True)
+    dropoff_lat = Column(Float, nullable=True)
+    dropoff_lng = Column(Float, nullable=True)
     status = Column(String(50), default="requested")  # requested, assigned, completed
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="rides", foreign_keys=[user_id])
-    driver = relationship("User", back_populates="assigned_rides", foreign_keys=[driver_id])
\ No newline at end of file
+    driver = relationship("User", back_populates="assigned_rides", foreign_keys=[driver_id])
+
+    # Listings page newest first on (created_at, id); InnoDB appends the primary
+    # key to every secondary index, so these also cover the id tiebreak.
+    __table_args__ = (
+        Index("ix_rides_created_at", "created_at"),
+        Index("ix_rides_status_created_at", "status", "created_at"),
+        Index("ix_rides_user_id_created_at", "user_id", "created_at"),
+        Index("ix_rides_driver_id_status", "driver_id", "status"),
+    )
\ No newline at end of file
@@ -0,0 +1,130 @@
+import os
+import time
+
+import redis
+import redis.asyncio as aioredis
+from dotenv import load_dotenv
+from redis.client import Pipeline
+from redis.asyncio.client import Pipeline as AsyncPipeline
+
+from . import metrics
+
+load_dotenv()
+
+# One pool per process for each client flavour; every module that talks to
+# Redis imports redis_client / async_redis_client from here.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 100))
+# How long a caller waits for a free connection once the pool is exhausted
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+
+def _connection_options() -> dict:
+    options = {
+        "host": os.getenv("REDIS_HOST", "localhost"),
+        "port": int(os.getenv("REDIS_PORT", 6379)),
+        "password": os.getenv("REDIS_PASSWORD"),
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "timeout": REDIS_POOL_TIMEOUT,
+        "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+    }
+    if os.getenv("REDIS_TLS") == "true":
+        options["connection_class"] = redis.SSLConnection
+    return options
+
+
+def _observe(name: str, start: float):
+    metrics.histogram(name).observe((time.perf_counter() - start) * 1000)
+
+
+# --- Client-side latency: one histogram per command, one for whole pipelines ---
+class InstrumentedPipeline(Pipeline):
+    def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        except redis.RedisError:
+            metrics.incr("redis.errors")
+            raise
+        finally:
+            _observe("redis.pipeline_ms", start)
+
+
+class InstrumentedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        except redis.RedisError:
+            metrics.incr("redis.errors")
+            raise
+        finally:
+            _observe(f"redis.{str(args[0]).lower()}_ms", start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedAsyncPipeline(AsyncPipeline):
+    async def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        except redis.RedisError:
+            metrics.incr("redis.errors")
+            raise
+        finally:
+            _observe("redis.async_pipeline_ms", start)
+
+
+class InstrumentedAsyncRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        except redis.RedisError:
+            metrics.incr("redis.errors")
+            raise
+        finally:
+            _observe(f"redis.async.{str(args[0]).lower()}_ms", start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedAsyncPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def _async_connection_options() -> dict:
+    options = _connection_options()
+    if "connection_class" in options:
+        options["connection_class"] = aioredis.SSLConnection
+    return options
+
+
+# Blocking pools make callers wait for a connection instead of failing when all are in use
+pool = redis.BlockingConnectionPool(**_connection_options())
+async_pool = aioredis.BlockingConnectionPool(**_async_connection_options())
+
+redis_client = InstrumentedRedis(connection_pool=pool)
+async_redis_client = InstrumentedAsyncRedis(connection_pool=async_pool)
+
+
+def pool_stats() -> dict:
+    # The sync pool's queue holds idle connections plus None slots not yet connected
+    sync_idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+    return {
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "sync_open": len(pool._connections),
+        "sync_in_use": len(pool._connections) - sync_idle,
+        "async_in_use": len(async_pool._in_use_connections),
+    }
+
+
+metrics.register_gauge("redis.pool", pool_stats)
+
+
+async def close():
+    """Release both pools; called on gateway shutdown"""
+    await async_redis_client.aclose()
+    redis_client.close()
+    pool.disconnect()
@@ -0,0 +1,113 @@
+import os
+import time
+from typing import Callable, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from . import metrics
+
+# The per-user ride listings (/rides/my and /rides/assigned) as the exact
+# response bytes, so a poll that hits is one Redis round trip and no MySQL.
+# One hash per listing and user, rides:cache:<listing>:<user_id>, holds a
+# field per query (cursor, limit, filters) whose value is the next-page
+# cursor, a newline and the JSON body. Every ride transition deletes the
+# hashes of the rider and driver it touched; RIDE_CACHE_TTL only bounds
+# memory for queries nobody repeats.
+RIDE_CACHE_TTL = int(os.getenv("RIDE_CACHE_TTL", 300))
+KEY_PREFIX = "rides:cache:"
+MY = "my"
+ASSIGNED = "assigned"
+
+# Stores a freshly built page unless the listing was invalidated since the
+# reader missed, so a slow query can never put a stale page back.
+# KEYS[1]: listing hash, KEYS[2]: its generation; ARGV: generation seen, field, entry, ttl
+STORE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+  return 0
+end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+def _keys(listing: str, user_id: int) -> Tuple[str, str]:
+    key = f"{KEY_PREFIX}{listing}:{user_id}"
+    return key, f"{key}:gen"
+
+
+def variant(*params) -> str:
+    """Cache field for one query of a listing"""
+    return "|".join("" if p is None else p.isoformat() if hasattr(p, "isoformat") else str(p) for p in params)
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def read_through(client, listing: str, user_id: int, field: str,
+                 load: Callable[[], Tuple[bytes, Optional[str]]]) -> Tuple[bytes, Optional[str]]:
+    """
+    (body, next cursor) for a listing query: from Redis when cached,
+    otherwise from load(), which is then cached. Redis errors fall back to load().
+    """
+    start = time.perf_counter()
+    key, gen_key = _keys(listing, user_id)
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hget(key, field)
+        pipe.get(gen_key)
+        entry, generation = pipe.execute()
+    except RedisError as e:
+        print(f"Ride cache read failed for {key}: {e}")
+        metrics.incr("rides.cache.errors")
+        return load()
+    if entry is not None:
+        cursor, _, body = entry.partition(b"\n")
+        metrics.incr("rides.cache.hits")
+        metrics.histogram("rides.cache.hit_ms").observe((time.perf_counter() - start) * 1000)
+        return body, cursor.decode() or None
+
+    body, cursor = load()
+    try:
+        store = client.register_script(STORE_SCRIPT)
+        store(keys=[key, gen_key],
+              args=[_text(generation or 0), field, (cursor or "").encode() + b"\n" + body, RIDE_CACHE_TTL])
+    except RedisError as e:
+        print(f"Ride cache write failed for {key}: {e}")
+        metrics.incr("rides.cache.errors")
+    metrics.incr("rides.cache.misses")
+    metrics.histogram("rides.cache.miss_ms").observe((time.perf_counter() - start) * 1000)
+    return body, cursor
+
+
+def invalidate(client, user_id: Optional[int] = None, driver_id: Optional[int] = None):
+    """
+    Drop the rider's /rides/my and the driver's /rides/assigned pages after a
+    ride transition; queue it on the pipeline that publishes the transition.
+    """
+    for listing, owner in ((MY, user_id), (ASSIGNED, driver_id)):
+        if owner:
+            key, gen_key = _keys(listing, owner)
+            client.incr(gen_key)
+            client.expire(gen_key, RIDE_CACHE_TTL * 2)
+            client.delete(key)
+
+
+async def invalidate_async(client, user_id: Optional[int] = None, driver_id: Optional[int] = None):
+    """invalidate for redis.asyncio clients; best effort, entries expire within RIDE_CACHE_TTL"""
+    pipe = client.pipeline(transaction=False)
+    invalidate(pipe, user_id, driver_id)
+    try:
+        await pipe.execute()
+    except RedisError as e:
+        print(f"Ride cache invalidation failed for rider {user_id}, driver {driver_id}: {e}")
+
+
+def hit_ratio() -> float:
+    hits = metrics.counter("rides.cache.hits")
+    total = hits + metrics.counter("rides.cache.misses")
+    return round(hits / total, 4) if total else 0.0
+
+
+metrics.register_gauge("rides.cache.hit_ratio", hit_ratio)
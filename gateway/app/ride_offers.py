@@ -0,0 +1,64 @@
+import os
+from typing import Iterable
+
+from redis.exceptions import RedisError
+
+from .ride_state import TransitionFailed
+
+# While the worker offers a ride, ride_offer:<id> holds the drivers of the
+# current wave; only they can accept it. The worker replaces the set on each
+# wave and removes it when it gives up, after which any driver can take the
+# ride again. A ride with no offer key is open to everyone.
+OFFER_KEY_PREFIX = "ride_offer:"
+OFFER_CONFLICT = "Ride is currently offered to another driver"
+# Read from the worker's setting: its default single mode offers every queued
+# ride, so drivers hear about it through their offer, and a new-ride broadcast
+# would only invite the drivers outside the wave to accept and get a 409
+OFFERS_ENABLED = os.getenv("WORKER_MODE", "single") == "single"
+
+
+def offer_key(ride_id: int) -> str:
+    return f"{OFFER_KEY_PREFIX}{ride_id}"
+
+
+def hold(pipe, ride_id: int, driver_ids: Iterable[int], ttl: float):
+    """Queue the commands that hand the ride to a new wave; use a MULTI pipeline so the swap is atomic"""
+    key = offer_key(ride_id)
+    pipe.delete(key)
+    pipe.sadd(key, *driver_ids)
+    pipe.pexpire(key, int(ttl * 1000))
+
+
+def release(pipe, ride_id: int):
+    pipe.delete(offer_key(ride_id))
+
+
+def _holds(exists, member) -> bool:
+    return not exists or bool(member)
+
+
+def _skipped(ride_id: int, error: Exception):
+    # Offers only decide who goes first; a Redis outage must not stop rides being accepted
+    print(f"Offer check skipped for ride {ride_id}: {error}")
+
+
+async def check_async(client, ride_id: int, driver_id: int):
+    """Raise TransitionFailed unless driver_id may accept the ride"""
+    pipe = client.pipeline(transaction=False)
+    pipe.exists(offer_key(ride_id))
+    pipe.sismember(offer_key(ride_id), driver_id)
+    try:
+        held = _holds(*await pipe.execute())
+    except RedisError as e:
+        _skipped(ride_id, e)
+        return
+    if not held:
+        raise TransitionFailed(409, OFFER_CONFLICT)
+
+
+async def release_async(client, ride_id: int):
+    """Drop the offer once the ride is taken; best effort, the key expires on its own"""
+    try:
+        await client.delete(offer_key(ride_id))
+    except RedisError as e:
+        print(f"Could not release offer for ride {ride_id}: {e}")
@@ -0,0 +1,210 @@
+import json
+import os
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+# Rides waiting for a driver, as a Redis Stream read through one consumer
+# group. Each entry goes to exactly one worker and stays in the group's
+# pending list until that worker acks it; entries left pending longer than
+# CLAIM_IDLE_MS (the worker died) are claimed by another worker.
+STREAM_KEY = os.getenv("RIDE_STREAM", "ride_stream")
+GROUP = os.getenv("RIDE_STREAM_GROUP", "ride_workers")
+# Approximate cap on the stream length: the oldest entries are trimmed past it,
+# so keep it well above any backlog the workers could fall behind by
+STREAM_MAXLEN = int(os.getenv("RIDE_STREAM_MAXLEN", 100_000))
+CLAIM_IDLE_MS = int(os.getenv("RIDE_CLAIM_IDLE_MS", 60_000))
+FIELD = "ride"
+# Rides waiting to be retried, scored by the unix time they are due
+DELAY_KEY = f"{STREAM_KEY}:delayed"
+
+# Rides the workers are done with, for dropping duplicate entries. Marks go
+# into one set per DEDUPE_BUCKET seconds that expires once it falls out of
+# DEDUPE_WINDOW, so memory is bounded by the rides of one window however
+# long the system runs. Failed rides are kept the same way for inspection.
+PROCESSED_PREFIX = "ride_queue:processed:"
+FAILED_PREFIX = "ride_queue:failed:"
+DEDUPE_WINDOW = int(os.getenv("RIDE_DEDUPE_WINDOW", 86_400))
+DEDUPE_BUCKET = int(os.getenv("RIDE_DEDUPE_BUCKET", 10_800))
+
+# Moves due rides from the delay set onto the stream in one atomic step, so
+# any number of workers can run the promoter without double-queueing.
+# KEYS[1]: delay set, KEYS[2]: stream; ARGV: now, limit, maxlen, field
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+  redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', ARGV[4], member)
+  redis.call('ZREM', KEYS[1], member)
+end
+return #due
+"""
+
+# Reads new entries for a consumer and acks, instead of returning, those whose
+# ride is marked processed in any bucket: dequeue and dedupe in one round trip.
+# KEYS[1]: stream, KEYS[2..]: processed buckets; ARGV: group, consumer, count, field
+# Returns {entries read, last stream id or false, id1, payload1, id2, payload2, ...}
+DEQUEUE_SCRIPT = """
+local read = redis.call('XREADGROUP', 'GROUP', ARGV[1], ARGV[2], 'COUNT', ARGV[3], 'STREAMS', KEYS[1], '>')
+local out = {0, false}
+if not read or not read[1] then
+  local last = redis.call('XREVRANGE', KEYS[1], '+', '-', 'COUNT', 1)
+  if last[1] then out[2] = last[1][1] end
+  return out
+end
+local entries = read[1][2]
+out[1] = #entries
+for _, entry in ipairs(entries) do
+  local id, fields = entry[1], entry[2]
+  local payload = false
+  for i = 1, #fields, 2 do
+    if fields[i] == ARGV[4] then payload = fields[i + 1] end
+  end
+  local done = false
+  local ok, ride = pcall(cjson.decode, payload or '')
+  local ride_id = ok and type(ride) == 'table' and ride['ride_id']
+  if type(ride_id) == 'number' then
+    ride_id = string.format('%d', ride_id)
+  end
+  if type(ride_id) == 'string' then
+    for i = 2, #KEYS do
+      if redis.call('SISMEMBER', KEYS[i], ride_id) == 1 then
+        done = true
+        break
+      end
+    end
+  end
+  if done then
+    redis.call('XACK', KEYS[1], ARGV[1], id)
+  else
+    table.insert(out, id)
+    table.insert(out, payload)
+  end
+end
+return out
+"""
+
+Entry = Tuple[str, dict]
+
+
+def _bucket_key(prefix: str, now: float) -> str:
+    return f"{prefix}{int(now // DEDUPE_BUCKET)}"
+
+
+def processed_keys(now: Optional[float] = None) -> List[str]:
+    """Every bucket that can still hold marks from the last DEDUPE_WINDOW, newest first"""
+    current = int((time.time() if now is None else now) // DEDUPE_BUCKET)
+    return [f"{PROCESSED_PREFIX}{bucket}" for bucket in range(current, current - DEDUPE_WINDOW // DEDUPE_BUCKET - 1, -1)]
+
+
+def _mark(client, prefix: str, ride_id: int):
+    key = _bucket_key(prefix, time.time())
+    client.sadd(key, ride_id)
+    client.expire(key, DEDUPE_WINDOW + DEDUPE_BUCKET)
+
+
+def mark_processed(client, ride_id: int):
+    """Record that ride_id needs no more work; works with a client or a pipeline"""
+    _mark(client, PROCESSED_PREFIX, ride_id)
+
+
+def mark_failed(client, ride_id: int):
+    _mark(client, FAILED_PREFIX, ride_id)
+
+
+def processed(client, ride_ids: List[int]) -> List[bool]:
+    """Client-side check for entries that did not come through read(), e.g. reclaimed ones"""
+    if not ride_ids:
+        return []
+    pipe = client.pipeline(transaction=False)
+    for key in processed_keys():
+        pipe.smismember(key, ride_ids)
+    return [any(marks) for marks in zip(*pipe.execute())]
+
+
+def enqueue(client, *rides: dict):
+    """XADD one entry per ride payload; works with a client or a pipeline"""
+    for ride in rides:
+        client.xadd(STREAM_KEY, {FIELD: json.dumps(ride)}, maxlen=STREAM_MAXLEN, approximate=True)
+
+
+def defer(client, ride: dict, delay: float):
+    """Queue a ride again after delay seconds; works with a client or a pipeline"""
+    client.zadd(DELAY_KEY, {json.dumps(ride): time.time() + delay})
+
+
+def promote(client, limit: int = 500) -> int:
+    """Move up to limit due rides onto the stream; returns how many moved"""
+    script = client.register_script(PROMOTE_SCRIPT)
+    return script(keys=[DELAY_KEY, STREAM_KEY], args=[time.time(), limit, STREAM_MAXLEN, FIELD])
+
+
+def ensure_group(client):
+    """Create the consumer group (and the stream) if needed; new groups start at the oldest entry"""
+    try:
+        client.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _entries(raw) -> List[Entry]:
+    entries = []
+    for entry_id, fields in raw:
+        if not fields:
+            # Trimmed away while pending; there is nothing left to process
+            continue
+        payload = fields.get(FIELD) or fields.get(FIELD.encode())
+        try:
+            ride = json.loads(payload)
+        except (TypeError, ValueError):
+            # Handed on with no ride_id so the consumer acks it instead of retrying forever
+            print(f"Skipping malformed stream entry {_text(entry_id)}: {fields!r}")
+            ride = {}
+        entries.append((_text(entry_id), ride))
+    return entries
+
+
+def _dequeue(client, consumer: str, count: int):
+    script = client.register_script(DEQUEUE_SCRIPT)
+    result = script(keys=[STREAM_KEY, *processed_keys()], args=[GROUP, consumer, count, FIELD])
+    flat = result[2:]
+    raw = [(flat[i], {FIELD: flat[i + 1] or ""}) for i in range(0, len(flat), 2)]
+    return _entries(raw), result[0], result[1]
+
+
+def read(client, consumer: str, count: int, block_ms: int) -> List[Entry]:
+    """
+    Up to count new entries for this consumer whose ride is not processed yet.
+    When the stream is drained, waits up to block_ms for the next entry.
+    """
+    entries, read_count, last_id = _dequeue(client, consumer, count)
+    if entries or read_count or block_ms <= 0:
+        return entries
+    # Nothing newer than last_id was undelivered, so waking on it cannot miss an entry
+    if client.xread({STREAM_KEY: _text(last_id) if last_id else "0-0"}, count=1, block=block_ms):
+        entries, _, _ = _dequeue(client, consumer, count)
+    return entries
+
+
+def reclaim(client, consumer: str, count: int) -> List[Entry]:
+    """Take over entries another consumer left pending for more than CLAIM_IDLE_MS"""
+    result = client.xautoclaim(STREAM_KEY, GROUP, consumer, CLAIM_IDLE_MS, start_id="0-0", count=count)
+    return _entries(result[1])
+
+
+def touch(client, consumer: str, entry_ids: Iterable[str]):
+    """Reset the idle time of entries this consumer is still working on, so nobody reclaims them"""
+    entry_ids = list(entry_ids)
+    if entry_ids:
+        client.xclaim(STREAM_KEY, GROUP, consumer, 0, entry_ids, justid=True)
+
+
+def ack(client, entry_ids: Iterable[str]):
+    entry_ids = list(entry_ids)
+    if entry_ids:
+        client.xack(STREAM_KEY, GROUP, *entry_ids)
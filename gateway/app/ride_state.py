@@ -0,0 +1,92 @@
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import Ride
+
+# Ride lifecycle: requested -> assigned -> completed. Each transition is one
+# conditional UPDATE; the row count says whether this caller won, so racing
+# drivers settle inside a single statement instead of read-check-write.
+NOT_FOUND = "Ride not found"
+ASSIGN_CONFLICT = "Ride already assigned or completed"
+COMPLETE_CONFLICT = "Ride not assigned to driver"
+
+
+class TransitionFailed(Exception):
+    """A transition matched no row; status_code/detail are ready for an HTTP error"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def assign_stmt(ride_id: int, driver_id: int):
+    return (
+        update(Ride)
+        .where(Ride.id == ride_id, Ride.status == "requested")
+        .values(driver_id=driver_id, status="assigned")
+        .execution_options(synchronize_session=False)
+    )
+
+
+def complete_stmt(ride_id: int, driver_id: int):
+    return (
+        update(Ride)
+        .where(Ride.id == ride_id, Ride.status == "assigned", Ride.driver_id == driver_id)
+        .values(status="completed")
+        .execution_options(synchronize_session=False)
+    )
+
+
+def apply(db: Session, stmt) -> bool:
+    """Run a transition inside the caller's transaction; True if this call moved the ride"""
+    return db.execute(stmt).rowcount == 1
+
+
+async def apply_async(db: AsyncSession, stmt) -> bool:
+    return (await db.execute(stmt)).rowcount == 1
+
+
+def _failure(ride, conflict: str) -> TransitionFailed:
+    if ride is None:
+        return TransitionFailed(404, NOT_FOUND)
+    return TransitionFailed(400, conflict)
+
+
+def _run(db: Session, stmt, ride_id: int, conflict: str) -> Ride:
+    won = apply(db, stmt)
+    db.commit()
+    # Read back for the response; the losing path reads only to pick the error
+    ride = db.get(Ride, ride_id, populate_existing=True)
+    if not won:
+        raise _failure(ride, conflict)
+    return ride
+
+
+async def _run_async(db: AsyncSession, stmt, ride_id: int, conflict: str) -> Ride:
+    won = await apply_async(db, stmt)
+    # Read back before committing (async sessions do not expire on commit), so a
+    # winning call that returns has committed and one that raises has not
+    ride = await db.get(Ride, ride_id, populate_existing=True)
+    await db.commit()
+    if not won:
+        raise _failure(ride, conflict)
+    return ride
+
+
+def assign(db: Session, ride_id: int, driver_id: int) -> Ride:
+    """Give a requested ride to driver_id, or raise TransitionFailed"""
+    return _run(db, assign_stmt(ride_id, driver_id), ride_id, ASSIGN_CONFLICT)
+
+
+def complete(db: Session, ride_id: int, driver_id: int) -> Ride:
+    """Complete a ride assigned to driver_id, or raise TransitionFailed"""
+    return _run(db, complete_stmt(ride_id, driver_id), ride_id, COMPLETE_CONFLICT)
+
+
+async def assign_async(db: AsyncSession, ride_id: int, driver_id: int) -> Ride:
+    return await _run_async(db, assign_stmt(ride_id, driver_id), ride_id, ASSIGN_CONFLICT)
+
+
+async def complete_async(db: AsyncSession, ride_id: int, driver_id: int) -> Ride:
+    return await _run_async(db, complete_stmt(ride_id, driver_id), ride_id, COMPLETE_CONFLICT)
@@ -1,91 +1,297 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, Body
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from datetime import datetime
 from ..schemas import RideResponse, RideCreate
-from ..database import get_db
-from ..models import User, Ride
+from ..database import get_db, get_async_db, session_scope
+from ..models import Ride
+from .. import driver_availability, ride_cache, ride_offers, ride_queue, ride_state
+from sqlalchemy import and_, or_, insert, select
 from sqlalchemy.orm import Session
-from ..auth import get_current_user
-import redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import TypeAdapter
+from ..auth import get_current_user, Principal
+from ..ws_routing import publish_event, publish_event_async
+from ..redis_pool import redis_client, async_redis_client
 import os
-import json
+import base64
 
 router = APIRouter(prefix="/rides", tags=["Rides"])
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT")),
-    password=os.getenv("REDIS_PASSWORD"),
-    ssl=os.getenv("REDIS_TLS") == "true",
-)
+
+PAGE_SIZE = int(os.getenv("RIDES_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.getenv("RIDES_MAX_PAGE_SIZE", 500))
+EXPORT_CHUNK = int(os.getenv("RIDES_EXPORT_CHUNK", 1000))
+BULK_MAX_RIDES = int(os.getenv("RIDES_BULK_MAX", 500))
+CURSOR_HEADER = "X-Next-Cursor"
+rides_adapter = TypeAdapter(List[RideResponse])
+
+
+# --- Keyset pagination ---
+# Listings are ordered newest first on (created_at, id). The cursor is the
+# position of the last row served, so each page is an index range scan
+# instead of an OFFSET that re-reads everything before it.
+def encode_cursor(ride) -> str:
+    raw = f"{ride.created_at.isoformat()}|{ride.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, ride_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(ride_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class RideFilters:
+    """Query parameters shared by the ride listings"""
+
+    def __init__(
+        self,
+        status: Optional[str] = Query(None, description="Only rides in this status"),
+        created_after: Optional[datetime] = Query(None, description="Only rides created at or after this time"),
+        created_before: Optional[datetime] = Query(None, description="Only rides created before this time"),
+    ):
+        self.status = status
+        self.created_after = created_after
+        self.created_before = created_before
+
+    def apply(self, query):
+        if self.status:
+            query = query.filter(Ride.status == self.status)
+        if self.created_after:
+            query = query.filter(Ride.created_at >= self.created_after)
+        if self.created_before:
+            query = query.filter(Ride.created_at < self.created_before)
+        return query
+
+
+def after_cursor(query, position):
+    """Rows strictly older than position in (created_at, id) order"""
+    if position is None:
+        return query
+    created_at, ride_id = position
+    return query.filter(or_(
+        Ride.created_at < created_at,
+        and_(Ride.created_at == created_at, Ride.id < ride_id),
+    ))
+
+
+def newest_first(query):
+    return query.order_by(Ride.created_at.desc(), Ride.id.desc())
+
+
+def fetch_page(query, filters: RideFilters, cursor: Optional[str], limit: int):
+    """One page of rides and the cursor for the next one (None on the last page)"""
+    position = decode_cursor(cursor) if cursor else None
+    query = newest_first(after_cursor(filters.apply(query), position))
+    rides = query.limit(limit + 1).all()
+    if len(rides) > limit:
+        rides = rides[:limit]
+        return rides, encode_cursor(rides[-1])
+    return rides, None
+
+
+def paginate(query, filters: RideFilters, response: Response, cursor: Optional[str], limit: int):
+    """
+    Fetch one page and put the cursor for the next one in the X-Next-Cursor
+    header; the body stays a plain list so existing clients keep working.
+    """
+    rides, next_cursor = fetch_page(query, filters, cursor, limit)
+    if next_cursor:
+        response.headers[CURSOR_HEADER] = next_cursor
+    return rides
+
+
+def cached_page(listing: str, user_id: int, query, filters: RideFilters, cursor: Optional[str], limit: int):
+    """paginate through ride_cache: the page is served as the bytes cached for this exact query"""
+    def load():
+        rides, next_cursor = fetch_page(query, filters, cursor, limit)
+        page = rides_adapter.validate_python(rides, from_attributes=True)
+        return rides_adapter.dump_json(page), next_cursor
+
+    field = ride_cache.variant(cursor, limit, filters.status, filters.created_after, filters.created_before)
+    body, next_cursor = ride_cache.read_through(redis_client, listing, user_id, field, load)
+    headers = {CURSOR_HEADER: next_cursor} if next_cursor else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def page_limit(limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    return limit
 
 
 @router.post("/", response_model=RideResponse)
-def create_ride(ride: RideCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def create_ride(ride: RideCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if current_user.is_driver:
         raise HTTPException(status_code=403, detail="Driver cannot request a ride")
     db_ride = Ride(
         user_id=current_user.id,
         pickup=ride.pickup,
         dropoff=ride.dropoff,
+        pickup_lat=ride.pickup_lat,
+        pickup_lng=ride.pickup_lng,
+        dropoff_lat=ride.dropoff_lat,
+        dropoff_lng=ride.dropoff_lng,
         status="requested",
     )
     db.add(db_ride)
     db.commit()
     db.refresh(db_ride)
 
-    # Add ride to processing queue
+    # Queue the ride for the worker and tell the drivers in one MULTI round trip
     ride_payload = {"ride_id": db_ride.id}
-    redis_client.lpush("ride_queue", json.dumps(ride_payload))
-    
-    # Broadcast ride creation to all connected drivers via WebSocket
-    driver_notification = {
-        "type": "ride_created",
-        "event": "new_ride",
-        "ride_id": db_ride.id,
-        "user_id": current_user.id,
-        "pickup": db_ride.pickup,
-        "dropoff": db_ride.dropoff,
-        "status": db_ride.status,
-        "created_at": db_ride.created_at.isoformat() if db_ride.created_at else None,
-        "broadcast_to_drivers": True  # Flag to broadcast only to drivers
-    }
-    redis_client.publish("ride_updates", json.dumps(driver_notification))
-    
+    pipe = redis_client.pipeline(transaction=True)
+    ride_queue.enqueue(pipe, ride_payload)
+    ride_cache.invalidate(pipe, user_id=current_user.id)
+
+    # Notify drivers near the pickup (every driver if the ride has no coordinates),
+    # unless the worker's offer waves reach them instead
+    if not ride_offers.OFFERS_ENABLED:
+        driver_notification = {
+            "type": "ride_created",
+            "event": "new_ride",
+            "ride_id": db_ride.id,
+            "user_id": current_user.id,
+            "pickup": db_ride.pickup,
+            "dropoff": db_ride.dropoff,
+            "pickup_lat": db_ride.pickup_lat,
+            "pickup_lng": db_ride.pickup_lng,
+            "status": db_ride.status,
+            "created_at": db_ride.created_at.isoformat() if db_ride.created_at else None,
+            "broadcast_to_drivers": True  # Flag to broadcast only to drivers
+        }
+        publish_event(pipe, driver_notification)
+    pipe.execute()
+
     return db_ride
 
 
+@router.post("/bulk", response_model=List[RideResponse])
+def create_rides_bulk(
+    rides: List[RideCreate] = Body(...),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    Create many rides in one transaction: one multi-row INSERT, then an XADD
+    per ride and one batched driver notification, in a single Redis round trip.
+    """
+    if current_user.is_driver:
+        raise HTTPException(status_code=403, detail="Driver cannot request a ride")
+    if not rides:
+        raise HTTPException(status_code=400, detail="No rides given")
+    if len(rides) > BULK_MAX_RIDES:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_RIDES} rides per request")
+
+    # Whole seconds, as DATETIME stores them, so the read-back below can match on it
+    created_at = datetime.utcnow().replace(microsecond=0)
+    rows = [
+        {**ride.model_dump(), "user_id": current_user.id, "status": "requested", "created_at": created_at}
+        for ride in rides
+    ]
+    result = db.execute(insert(Ride).values(rows))
+    # The ids of a multi-row INSERT ascend in row order from the one MySQL reports,
+    # but need not be consecutive (auto_increment_increment > 1, or
+    # innodb_autoinc_lock_mode=2 with concurrent inserts), so read them back in
+    # the same transaction; ix_rides_user_id_created_at covers the lookup.
+    ids = db.scalars(
+        select(Ride.id)
+        .where(Ride.user_id == current_user.id, Ride.created_at == created_at, Ride.id >= result.lastrowid)
+        .order_by(Ride.id)
+        .limit(len(rows))
+    ).all()
+    if len(ids) != len(rows):
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Could not read back the created rides")
+    db.commit()
+    created = [RideResponse(id=ride_id, driver_id=None, **row) for ride_id, row in zip(ids, rows)]
+
+    pipe = redis_client.pipeline(transaction=True)
+    ride_queue.enqueue(pipe, *[{"ride_id": ride.id} for ride in created])
+    ride_cache.invalidate(pipe, user_id=current_user.id)
+    if not ride_offers.OFFERS_ENABLED:
+        publish_event(pipe, {
+            "type": "rides_created",
+            "event": "new_rides",
+            "user_id": current_user.id,
+            "rides": [
+                {
+                    "ride_id": ride.id,
+                    "pickup": ride.pickup,
+                    "dropoff": ride.dropoff,
+                    "pickup_lat": ride.pickup_lat,
+                    "pickup_lng": ride.pickup_lng,
+                }
+                for ride in created
+            ],
+            "status": "requested",
+            "created_at": created_at.isoformat(),
+            "broadcast_to_drivers": True,
+        })
+    pipe.execute()
+    return created
+
+
 @router.get('/', response_model=List[RideResponse])
-def get_all_rides(db: Session = Depends(get_db)):
-    rides = db.query(Ride).all()
-    return rides
+def get_all_rides(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    filters: RideFilters = Depends(),
+    db: Session = Depends(get_db),
+):
+    return paginate(db.query(Ride), filters, response, cursor, limit)
 
 
-@router.get("/{ride_id}/assign", response_model=RideResponse)
-def assign_ride(ride_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    if not current_user.is_driver:
-        raise HTTPException(status_code=403, detail="Only drivers can assign rides")
-    db_ride = db.query(Ride).filter(Ride.id == ride_id).first()
-    if not db_ride:
-        raise HTTPException(status_code=404, detail="Ride not found")
-    if db_ride.status != "requested":
-        raise HTTPException(status_code=400, detail="Ride already assigned or completed")
-    db_ride.driver_id = current_user.id
-    db_ride.status = "assigned"
-    db.commit()
-    db.refresh(db_ride)
-    return db_ride
+def export_rows(filters: RideFilters, fmt: str):
+    """
+    Yield the filtered rides as NDJSON lines or one JSON array, reading
+    EXPORT_CHUNK rows at a time by keyset so memory stays flat.
+    """
+    position = None
+    first = True
+    if fmt == "json":
+        yield "["
+    with session_scope() as db:
+        while True:
+            query = newest_first(after_cursor(filters.apply(db.query(Ride)), position))
+            rides = query.limit(EXPORT_CHUNK).all()
+            if not rides:
+                break
+            lines = [RideResponse.model_validate(ride).model_dump_json() for ride in rides]
+            position = (rides[-1].created_at, rides[-1].id)
+            # Drop the chunk from the identity map before fetching the next one
+            db.expunge_all()
+            if fmt == "json":
+                yield ("" if first else ",") + ",".join(lines)
+            else:
+                yield "\n".join(lines) + "\n"
+            first = False
+            if len(rides) < EXPORT_CHUNK:
+                break
+    if fmt == "json":
+        yield "]"
+
+
+@router.get("/export")
+def export_rides(
+    format: str = Query("ndjson", pattern="^(ndjson|json)$"),
+    filters: RideFilters = Depends(),
+    current_user: Principal = Depends(get_current_user),
+):
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(export_rows(filters, format), media_type=media_type)
 
 
 @router.post("/{ride_id}/complete", response_model=RideResponse)
-def complete_ride(ride_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def complete_ride(ride_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.is_driver:
         raise HTTPException(status_code=403, detail="Only drivers can complete rides")
-    db_ride = db.query(Ride).filter(Ride.id == ride_id).first()
-    if not db_ride:
-        raise HTTPException(status_code=404, detail="Ride not found")
-    if db_ride.status != "assigned":
-        raise HTTPException(status_code=400, detail="Ride not assigned to driver")
-    db_ride.status = "completed"
-    db.commit()
+    try:
+        db_ride = ride_state.complete(db, ride_id, current_user.id)
+    except ride_state.TransitionFailed as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     payload = {
         "type": "ride_completed",
         "ride_id": db_ride.id,
@@ -93,46 +299,66 @@ def complete_ride(ride_id: int, db: Session = Depends(get_db), current_user: Use
         "driver_id": db_ride.driver_id,
         "status": db_ride.status
     }
-    redis_client.publish("ride_updates", json.dumps(payload))
-    db.refresh(db_ride)
+    # Free the driver and tell both sides in one round trip
+    pipe = redis_client.pipeline(transaction=False)
+    driver_availability.release(pipe, db_ride.id, [current_user.id])
+    ride_cache.invalidate(pipe, user_id=db_ride.user_id, driver_id=current_user.id)
+    publish_event(pipe, payload)
+    pipe.execute()
     return db_ride
 
 
 @router.get("/my", response_model=List[RideResponse])
-def get_my_rides(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    rides = db.query(Ride).filter(Ride.user_id == current_user.id).all()
-    return rides
+def get_my_rides(
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    filters: RideFilters = Depends(),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    query = db.query(Ride).filter(Ride.user_id == current_user.id)
+    return cached_page(ride_cache.MY, current_user.id, query, filters, cursor, limit)
 
 
 @router.get("/assigned", response_model=List[RideResponse])
-def get_assigned_ride(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def get_assigned_ride(
+    cursor: Optional[str] = None,
+    limit: int = Depends(page_limit),
+    filters: RideFilters = Depends(),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
     if not current_user.is_driver:
         raise HTTPException(status_code=403, detail="Only drivers can view assigned rides")
-    rides = db.query(Ride).filter(Ride.driver_id == current_user.id).all()
-    return rides
+    query = db.query(Ride).filter(Ride.driver_id == current_user.id)
+    return cached_page(ride_cache.ASSIGNED, current_user.id, query, filters, cursor, limit)
 
 
 @router.get("/{ride_id}/assign", response_model=RideResponse)
-async def assign_ride(ride_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def assign_ride(ride_id: int, db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.is_driver:
         raise HTTPException(status_code=403, detail="Only drivers can assign rides")
     
-    db_ride = db.query(Ride).filter(Ride.id == ride_id).first()
-    if not db_ride:
-        raise HTTPException(status_code=404, detail="Ride not found")
-    if db_ride.status != "requested":
-        raise HTTPException(status_code=400, detail="Ride already assigned or completed")
-
-    db_ride.driver_id = current_user.id
-    db_ride.status = "assigned"
-    db.commit()
-    db.refresh(db_ride)
+    booked = assigned = False
+    try:
+        await ride_offers.check_async(async_redis_client, ride_id, current_user.id)
+        booked = await driver_availability.take_async(async_redis_client, ride_id, current_user.id)
+        db_ride = await ride_state.assign_async(db, ride_id, current_user.id)
+        assigned = True
+    except ride_state.TransitionFailed as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        # However the assignment failed (conflict, database error, cancelled
+        # request), the driver must not stay booked for it until BUSY_TTL
+        if booked and not assigned:
+            await driver_availability.release_async(async_redis_client, ride_id, [current_user.id])
+    await ride_offers.release_async(async_redis_client, ride_id)
+    await ride_cache.invalidate_async(async_redis_client, user_id=db_ride.user_id, driver_id=current_user.id)
 
-    from ..ws_manager import send_to_user
-    send_to_user(db_ride.user_id, {
-        "event": "ride_accept",
+    await publish_event_async(async_redis_client, {
+        "event": "ride_assigned",
         "ride_id": db_ride.id,
         "driver_id": current_user.id,
         "status": "assigned"
-    })
+    }, recipients=[db_ride.user_id])
     return db_ride
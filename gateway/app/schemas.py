@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime
 
@@ -26,10 +26,19 @@ class LoginResponse(BaseModel):
     access_token: str
     token_type: str
     is_driver: bool
+
+class LocationUpdate(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+
 # Ride Schemas
 class RideBase(BaseModel):
     pickup: str
     dropoff: str
+    pickup_lat: Optional[float] = Field(None, ge=-90, le=90)
+    pickup_lng: Optional[float] = Field(None, ge=-180, le=180)
+    dropoff_lat: Optional[float] = Field(None, ge=-90, le=90)
+    dropoff_lng: Optional[float] = Field(None, ge=-180, le=180)
 
 
 class RideCreate(RideBase):
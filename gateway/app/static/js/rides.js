@@ -193,14 +193,13 @@ async function loadRideRequests() {
   if (!token) return;
 
   try {
-    const res = await fetch(`${BASE_URL}/rides/`, {
+    const res = await fetch(`${BASE_URL}/rides/?status=requested`, {
       headers: { Authorization: `Bearer ${token}` },
     });
 
     if (!res.ok) return;
 
-    const rides = await res.json();
-    const requestedRides = rides.filter(r => r.status === "requested");
+    const requestedRides = await res.json();
     displayRideRequests(requestedRides);
   } catch (error) {
     console.error("Error loading ride requests:", error);
@@ -318,6 +317,30 @@ function handleWS(data) {
     }
   }
 
+  // Ride offered to this driver only, for a limited time
+  if (data.event === "ride_offer") {
+    showSuccess(`🚕 Ride offered to you: ${data.pickup} → ${data.dropoff} (accept within ${data.expires_in}s)`);
+    if (typeof playNotificationSound === "function") {
+      playNotificationSound();
+    }
+    if (typeof loadRideRequests === "function") {
+      loadRideRequests();
+    }
+  }
+
+  // Several rides requested at once (bulk booking)
+  if (data.event === "new_rides" && Array.isArray(data.rides)) {
+    showSuccess(`🚕 ${data.rides.length} new ride requests`);
+    if (typeof playNotificationSound === "function") {
+      playNotificationSound();
+    }
+    if (typeof loadRideRequests === "function") {
+      setTimeout(() => {
+        loadRideRequests();
+      }, 500);
+    }
+  }
+
   // Ride created confirmation for riders
   if (data.event === "ride_created") {
     showSuccess(`✅ Ride created successfully! Ride ID: ${data.ride_id}`);
@@ -0,0 +1,88 @@
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel keyed by timer id.
+    Level 0 has one slot per tick; each higher level's slot spans a whole
+    rotation of the level below and is cascaded down when its turn comes.
+    schedule and cancel are O(1), and advancing costs O(ticks elapsed + timers
+    fired), however many timers are pending.
+    """
+
+    def __init__(self, tick: float = 0.1, slots: int = 256, levels: int = 3, now: Optional[float] = None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._wheels: List[List[Dict[Hashable, int]]] = [[{} for _ in range(slots)] for _ in range(levels)]
+        # key -> (expiry tick, level, slot)
+        self._timers: Dict[Hashable, Tuple[int, int, int]] = {}
+        self._current = self._tick_of(time.monotonic() if now is None else now)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def _tick_of(self, now: float) -> int:
+        return int(now / self.tick)
+
+    def _place(self, key: Hashable, expires: int):
+        delta = expires - self._current
+        level = 0
+        span = 1
+        while level < self.levels - 1 and delta >= span * self.slots:
+            level += 1
+            span *= self.slots
+        slot = (expires // span) % self.slots
+        self._wheels[level][slot][key] = expires
+        self._timers[key] = (expires, level, slot)
+
+    def schedule(self, key: Hashable, delay: float):
+        """Fire key after delay seconds; rescheduling an existing key replaces its timer"""
+        self.cancel(key)
+        expires = self._current + max(1, -int(-delay // self.tick))
+        self._place(key, expires)
+
+    def cancel(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        _, level, slot = timer
+        del self._wheels[level][slot][key]
+        return True
+
+    def _cascade(self, level: int, slot: int):
+        bucket = self._wheels[level][slot]
+        if bucket:
+            self._wheels[level][slot] = {}
+            for key, expires in bucket.items():
+                self._place(key, expires)
+
+    def advance(self, now: Optional[float] = None) -> List[Hashable]:
+        """Move the wheel up to now (monotonic seconds) and return the keys that expired"""
+        target = self._tick_of(time.monotonic() if now is None else now)
+        expired = []
+        while self._current < target:
+            self._current += 1
+            t = self._current
+            span = self.slots ** (self.levels - 1)
+            for level in range(self.levels - 1, 0, -1):
+                if t % span == 0:
+                    self._cascade(level, (t // span) % self.slots)
+                span //= self.slots
+            index = t % self.slots
+            bucket = self._wheels[0][index]
+            if not bucket:
+                continue
+            self._wheels[0][index] = {}
+            for key, expires in bucket.items():
+                if expires <= t:
+                    del self._timers[key]
+                    expired.append(key)
+                else:
+                    # Wrapped round from beyond the top level's range
+                    self._place(key, expires)
+        return expired
@@ -1,147 +1,442 @@
 from fastapi import WebSocket
-from typing import List, Dict
+from typing import List, Dict, Set, Optional
 import threading
-import redis
 import os
 from dotenv import load_dotenv
-import json
 import time
 import asyncio
+import random
+from . import codec, driver_availability, metrics, redis_pool, ws_protocol, ws_routing
+from .geo import DriverGrid
 
 load_dotenv()
 
+# Outbound frames buffered per socket before a slow client starts losing frames
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+# A client that has dropped this many frames in a row is disconnected
+MAX_DROPPED_FRAMES = int(os.getenv("WS_MAX_DROPPED_FRAMES", 64))
+# Close code sent to evicted slow consumers ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# New rides with a pickup position go to at most NEW_RIDE_MAX_DRIVERS of this
+# gateway's drivers within NEW_RIDE_RADIUS_KM, nearest first
+NEW_RIDE_RADIUS_KM = float(os.getenv("NEW_RIDE_RADIUS_KM", 5))
+NEW_RIDE_MAX_DRIVERS = int(os.getenv("NEW_RIDE_MAX_DRIVERS", 20))
+# Only positions reported within this many seconds count for proximity
+DRIVER_POSITION_TTL = float(os.getenv("WS_DRIVER_POSITION_TTL", 120))
+# Drivers with no position at all (e.g. the web dashboard) get each new ride
+# only through a random sample of this size, so fan-out stays bounded
+NEW_RIDE_MAX_UNPLACED = int(os.getenv("NEW_RIDE_MAX_UNPLACED", 5))
+
+
+class FanoutTracker:
+    """Records how long one fan-out takes until every queued copy has been written"""
+
+    __slots__ = ("name", "started", "pending")
+
+    def __init__(self, name: str, pending: int):
+        self.name = name
+        self.started = time.perf_counter()
+        self.pending = pending
+        if pending == 0:
+            self._finish()
+
+    def done(self):
+        self.pending -= 1
+        if self.pending == 0:
+            self._finish()
+
+    def _finish(self):
+        metrics.histogram(f"ws.fanout.{self.name}_ms").observe((time.perf_counter() - self.started) * 1000)
+
+
+class ClientConnection:
+    """A registered socket with its own bounded outbound queue and writer task"""
+
+    def __init__(self, user_id: int, websocket: WebSocket, is_driver: bool = False):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.is_driver = is_driver
+        self.protocol = ws_protocol.protocol_of(websocket)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.dropped = 0
+        self.closed = False
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame, tracker: Optional[FanoutTracker] = None) -> bool:
+        """Queue an encoded frame without waiting; drops it if the client is too far behind"""
+        if self.closed:
+            if tracker:
+                tracker.done()
+            return False
+        try:
+            self.queue.put_nowait((frame, tracker))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.incr("ws.frames_dropped")
+            if tracker:
+                tracker.done()
+            if self.dropped >= MAX_DROPPED_FRAMES:
+                self.evict()
+            return False
+        self.dropped = 0
+        return True
+
+    async def _write_loop(self):
+        try:
+            while True:
+                frame, tracker = await self.queue.get()
+                try:
+                    if isinstance(frame, bytes):
+                        await self.websocket.send_bytes(frame)
+                    else:
+                        await self.websocket.send_text(frame)
+                finally:
+                    if tracker:
+                        tracker.done()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[WS] Error sending to user {self.user_id}: {e}")
+            self.close()
+            remove_connection(self.user_id, self.websocket)
+
+    def evict(self):
+        print(f"[WS] Evicting slow consumer: user {self.user_id} ({self.queue.qsize()} frames queued)")
+        metrics.incr("ws.slow_consumers_evicted")
+        remove_connection(self.user_id, self.websocket)
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Client too slow")
+        except Exception:
+            pass
+
+    def close(self):
+        """Stop the writer; any frames still queued are discarded"""
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.cancel()
+        while not self.queue.empty():
+            _, tracker = self.queue.get_nowait()
+            if tracker:
+                tracker.done()
+
+
+class SamplePool:
+    """Set with O(1) add and discard and O(k) random samples"""
+
+    __slots__ = ("items", "index")
+
+    def __init__(self):
+        self.items: List[int] = []
+        self.index: Dict[int, int] = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.index
+
+    def add(self, item: int):
+        if item not in self.index:
+            self.index[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item: int):
+        i = self.index.pop(item, None)
+        if i is None:
+            return
+        last = self.items.pop()
+        if i < len(self.items):
+            self.items[i] = last
+            self.index[last] = i
+
+    def sample(self, k: int) -> List[int]:
+        if len(self.items) <= k:
+            return list(self.items)
+        return random.sample(self.items, k)
+
+
+class StalePositions:
+    """Membership test for drivers whose last position is older than DRIVER_POSITION_TTL"""
+
+    __slots__ = ("cutoff",)
+
+    def __init__(self):
+        self.cutoff = time.time() - DRIVER_POSITION_TTL
+
+    def __contains__(self, driver_id):
+        return placed_at.get(driver_id, 0.0) < self.cutoff
+
+
 # --- Thread-safe in-memory connection mapping ---
-connections: Dict[int, List[WebSocket]] = {}
+connections: Dict[int, List[ClientConnection]] = {}
 conn_lock = threading.Lock()
 
+# Role index, filled at connect time so fan-out never has to ask the database
+driver_ids: Set[int] = set()
+rider_ids: Set[int] = set()
+# Last reported position of this gateway's connected drivers, for proximity fan-out
+driver_grid = DriverGrid(float(os.getenv("WS_DRIVER_CELL_DEG", 0.01)))
+# When each driver's position was reported (unix time)
+placed_at: Dict[int, float] = {}
+# Connected drivers with no known position yet; each new ride reaches a sample of them
+unplaced_drivers = SamplePool()
+
 # --- Redis Setup ---
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT")),
-    password=os.getenv("REDIS_PASSWORD"),
-    ssl=os.getenv("REDIS_TLS") == "true",
-)
+async_redis_client = redis_pool.async_redis_client
 
 CHANNEL = "ride_updates"
+# Upper bound on messages decoded and dispatched per listener wakeup
+LISTENER_BATCH_SIZE = int(os.getenv("WS_LISTENER_BATCH_SIZE", 256))
+
+
+# Strong references to fire-and-forget registry updates
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _run_in_background(coro, what: str):
+    async def runner():
+        try:
+            await coro
+        except Exception as e:
+            print(f"[WS] {what} failed: {e}")
+
+    task = asyncio.create_task(runner())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
 
 # --- Connection Management ---
-def add_connection(user_id: int, websocket: WebSocket):
+def add_connection(user_id: int, websocket: WebSocket, is_driver: bool = False,
+                   position: Optional[tuple] = None, position_at: Optional[float] = None):
+    """
+    Register a socket; must be called from the event loop that serves it.
+    position is the driver's (lat, lng) as of position_at (default now).
+    """
+    conn = ClientConnection(user_id, websocket, is_driver)
     with conn_lock:
         if user_id not in connections:
             connections[user_id] = []
-        connections[user_id].append(websocket)
+            # First socket for this user on this gateway: tell publishers where to find it
+            _run_in_background(ws_routing.register_user(async_redis_client, user_id), "Node registration")
+            if is_driver:
+                _run_in_background(driver_availability.connect(async_redis_client, user_id), "Driver availability")
+        connections[user_id].append(conn)
+        if is_driver:
+            driver_ids.add(user_id)
+            if position is not None:
+                driver_grid.upsert(user_id, *position)
+                placed_at[user_id] = position_at or time.time()
+                unplaced_drivers.discard(user_id)
+            elif driver_grid.position(user_id) is None:
+                unplaced_drivers.add(user_id)
+        else:
+            rider_ids.add(user_id)
     print(f"[WS] User {user_id} connected. Total connections: {len(connections[user_id])}")
 
 
 def remove_connection(user_id: int, websocket: WebSocket):
+    removed = None
     with conn_lock:
         lst = connections.get(user_id, [])
-        if websocket in lst:
-            lst.remove(websocket)
+        for conn in lst:
+            if conn.websocket is websocket:
+                removed = conn
+                break
+        if removed:
+            lst.remove(removed)
             print(f"[WS] User {user_id} disconnected.")
             if not lst:
                 del connections[user_id]
+                if user_id in driver_ids:
+                    # Offline once no other gateway holds them; a busy driver stays booked
+                    _run_in_background(driver_availability.disconnect(async_redis_client, user_id), "Driver availability")
+                driver_ids.discard(user_id)
+                rider_ids.discard(user_id)
+                driver_grid.remove(user_id)
+                placed_at.pop(user_id, None)
+                unplaced_drivers.discard(user_id)
+                _run_in_background(ws_routing.unregister_user(async_redis_client, user_id), "Node unregistration")
+    if removed:
+        removed.close()
+
+
+def is_connected_driver(user_id: int) -> bool:
+    return user_id in driver_ids
+
+
+def update_driver_position(user_id: int, lat: float, lng: float):
+    """Move a connected driver in the proximity index; ignored once they disconnect"""
+    with conn_lock:
+        if user_id in driver_ids:
+            driver_grid.upsert(user_id, lat, lng)
+            placed_at[user_id] = time.time()
+            unplaced_drivers.discard(user_id)
+
+
+def nearby_drivers(lat: float, lng: float) -> List[int]:
+    """
+    Up to NEW_RIDE_MAX_DRIVERS drivers with a fresh position within
+    NEW_RIDE_RADIUS_KM, plus up to NEW_RIDE_MAX_UNPLACED with no position
+    """
+    with conn_lock:
+        found = driver_grid.nearest(lat, lng, k=NEW_RIDE_MAX_DRIVERS, max_radius_km=NEW_RIDE_RADIUS_KM,
+                                    exclude=StalePositions())
+        return [driver_id for driver_id, _ in found] + unplaced_drivers.sample(NEW_RIDE_MAX_UNPLACED)
+
+
+def _queue_depths() -> dict:
+    with conn_lock:
+        depths = [conn.queue.qsize() for lst in connections.values() for conn in lst]
+    return {
+        "connections": len(depths),
+        "total": sum(depths),
+        "max": max(depths, default=0),
+    }
+
+
+metrics.register_gauge("ws.send_queue_depth", _queue_depths)
 
 
 # --- Message Sending ---
-async def send_to_user(user_id: int, message: dict):
+def _fanout(name: str, targets: List[ClientConnection], message: dict) -> int:
+    """Encode once per protocol and hand the frame to every target's queue; never waits on a socket"""
+    frames = {}
+    tracker = FanoutTracker(name, len(targets))
+    sent = 0
+    for conn in targets:
+        frame = frames.get(conn.protocol)
+        if frame is None:
+            frame = frames[conn.protocol] = ws_protocol.encode(conn.protocol, message)
+        sent += conn.enqueue(frame, tracker)
+    return sent
+
+
+async def send_to_user(user_id: int, message: dict) -> int:
     """Send a message to all WebSockets of a given user"""
-    websockets = []
     with conn_lock:
-        websockets = list(connections.get(user_id, []))
+        targets = list(connections.get(user_id, []))
+    return _fanout("user", targets, message)
 
-    for ws in websockets:
-        try:
-            await ws.send_text(json.dumps(message))
-        except Exception as e:
-            print(f"[WS] Error sending to user {user_id}: {e}")
 
-
-async def broadcast(message: dict):
+async def broadcast(message: dict) -> int:
     """Send a message to all connected users"""
     with conn_lock:
-        all_sockets = [ws for lst in connections.values() for ws in lst]
+        targets = [conn for lst in connections.values() for conn in lst]
 
-    print(f"[WS] Broadcasting to {len(all_sockets)} clients")
+    print(f"[WS] Broadcasting to {len(targets)} clients")
+    return _fanout("broadcast", targets, message)
 
-    for ws in all_sockets:
-        try:
-            await ws.send_text(json.dumps(message))
-        except Exception as e:
-            print(f"[WS] Broadcast error: {e}")
 
-
-async def broadcast_to_drivers(message: dict):
+async def broadcast_to_drivers(message: dict) -> int:
     """Send a message to all connected drivers only"""
-    from app.database import get_db
-    from app.models import User
-    
-    # Get all driver user IDs from database
-    db = next(get_db())
-    try:
-        drivers = db.query(User).filter(User.is_driver == True).all()
-        driver_ids = [driver.id for driver in drivers]
-        
+    with conn_lock:
+        targets = [conn for driver_id in driver_ids for conn in connections.get(driver_id, ())]
+
+    print(f"[WS] Broadcasting to {len(targets)} driver connections")
+    return _fanout("drivers", targets, message)
+
+
+def _has_pickup(ride: dict) -> bool:
+    return ride.get("pickup_lat") is not None and ride.get("pickup_lng") is not None
+
+
+async def broadcast_nearby(message: dict) -> int:
+    """Send a new-ride event only to drivers near its pickup; constant work per ride"""
+    driver_ids_near = nearby_drivers(message["pickup_lat"], message["pickup_lng"])
+    with conn_lock:
+        targets = [conn for driver_id in driver_ids_near for conn in connections.get(driver_id, ())]
+    metrics.incr("ws.new_ride.scoped")
+    metrics.incr("ws.new_ride.recipients", len(driver_ids_near))
+    return _fanout("drivers_nearby", targets, message)
+
+
+async def broadcast_batch_nearby(message: dict) -> int:
+    """Split a new_rides batch so each nearby driver hears only about the rides near them"""
+    per_driver: Dict[int, list] = {}
+    for ride in message["rides"]:
+        for driver_id in nearby_drivers(ride["pickup_lat"], ride["pickup_lng"]):
+            per_driver.setdefault(driver_id, []).append(ride)
+    sent = 0
+    for driver_id, rides in per_driver.items():
         with conn_lock:
-            driver_sockets = []
-            for driver_id in driver_ids:
-                if driver_id in connections:
-                    driver_sockets.extend(connections[driver_id])
-        
-        print(f"[WS] Broadcasting to {len(driver_sockets)} driver connections")
-        
-        for ws in driver_sockets:
-            try:
-                await ws.send_text(json.dumps(message))
-            except Exception as e:
-                print(f"[WS] Error sending to driver: {e}")
-    finally:
-        db.close()
+            targets = list(connections.get(driver_id, ()))
+        sent += _fanout("drivers_nearby", targets, {**message, "rides": rides})
+    metrics.incr("ws.new_ride.scoped", len(message["rides"]))
+    metrics.incr("ws.new_ride.recipients", sum(len(r) for r in per_driver.values()))
+    return sent
 
 
 # --- Redis Listener ---
-def redis_listener(app):
-    """Threaded Redis listener to push messages into event loop"""
-    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
-    pubsub.subscribe(CHANNEL)
+async def dispatch_update(data: dict):
+    """Route one ride_updates event to the sockets it concerns"""
+    recipients = data.pop("_to", None)
+    if recipients is not None:
+        for recipient in recipients:
+            await send_to_user(recipient, data)
+        return
+
+    # optional broadcast logic; user_id on a broadcast describes the ride, it is not an addressee
+    if data.get("broadcast"):
+        await broadcast(data)
+        return
+    # new rides go to the drivers near the pickup; without a position, to every driver
+    if data.get("broadcast_to_drivers"):
+        if _has_pickup(data):
+            await broadcast_nearby(data)
+        elif data.get("rides") and all(_has_pickup(ride) for ride in data["rides"]):
+            await broadcast_batch_nearby(data)
+        else:
+            await broadcast_to_drivers(data)
+        return
 
-    print("[WS] Redis listener started, waiting for ride updates...")
+    user_id = data.get("user_id")
+    driver_id = data.get("driver_id")
+    if user_id:
+        await send_to_user(user_id, data)
+    if driver_id:
+        await send_to_user(driver_id, data)
 
+
+async def redis_listener():
+    """
+    Subscribe to this gateway's node channel and the broadcast channel on the
+    gateway's own event loop. Blocks on the socket until a message arrives,
+    then drains whatever else is already buffered and dispatches the batch;
+    cancel the task to stop it.
+    """
     while True:
+        pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
         try:
-            message = pubsub.get_message(timeout=1.0)
-            if message and message.get('type') == 'message':
-                payload = message.get('data')
-                try:
-                    data = json.loads(payload)
-                except Exception:
-                    continue
-
-                user_id = data.get('user_id')
-                driver_id = data.get('driver_id')
-
-                loop = getattr(app, "loop", None)
-                if loop:
-                    # schedule sends asynchronously
-                    if user_id:
-                        loop.call_soon_threadsafe(
-                            lambda u=user_id, d=data: asyncio.create_task(send_to_user(u, d))
-                        )
-                    if driver_id:
-                        loop.call_soon_threadsafe(
-                            lambda u=driver_id, d=data: asyncio.create_task(send_to_user(u, d))
-                        )
-                    # optional broadcast logic
-                    if data.get("broadcast"):
-                        loop.call_soon_threadsafe(
-                            lambda d=data: asyncio.create_task(broadcast(d))
-                        )
-                    # broadcast to all drivers only
-                    if data.get("broadcast_to_drivers"):
-                        loop.call_soon_threadsafe(
-                            lambda d=data: asyncio.create_task(broadcast_to_drivers(d))
-                        )
+            # CHANNEL is still served for publishers that predate node routing
+            await pubsub.subscribe(ws_routing.node_channel(), ws_routing.BROADCAST_CHANNEL, CHANNEL)
+            print("[WS] Redis listener started, waiting for ride updates...")
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+                batch = []
+                while message is not None and len(batch) < LISTENER_BATCH_SIZE:
+                    if message.get("type") == "message":
+                        batch.append(message["data"])
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0)
+                if message is not None and message.get("type") == "message":
+                    batch.append(message["data"])
+
+                for payload in batch:
+                    try:
+                        data = codec.loads(payload)
+                    except Exception:
+                        continue
+                    await dispatch_update(data)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             print(f"[WS] Error in Redis listener: {e}")
-            time.sleep(2)
+            await asyncio.sleep(2)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
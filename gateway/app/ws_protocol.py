@@ -0,0 +1,155 @@
+from typing import Any, Dict, Optional
+
+from fastapi import WebSocket
+
+from . import codec
+
+# Optional binary encoding for bandwidth-constrained clients (driver apps on
+# cellular links). JSON text frames stay the default; a client opts in by
+# offering MSGPACK in Sec-WebSocket-Protocol.
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+JSON = "ridenow.json"
+MSGPACK = "ridenow.msgpack.v1"
+SCOPE_KEY = "ridenow.protocol"
+
+# MSGPACK frames are maps keyed by these integers instead of field names, and
+# the event/type/action values are replaced by their code. Both tables are
+# append-only: clients decode with the same numbers. Unknown fields and
+# values pass through unchanged.
+EVENT_CODES: Dict[str, int] = {
+    "connected": 1,
+    "pong": 2,
+    "error": 3,
+    "new_ride": 4,
+    "new_rides": 5,
+    "ride_created": 6,
+    "rides_created": 7,
+    "ride_assigned": 8,
+    "ride_assigned_success": 9,
+    "ride_completed": 10,
+    "ride_completed_success": 11,
+    "ping": 12,
+    "ride_request": 13,
+    "ride_accept": 14,
+    "ride_complete": 15,
+    "location_update": 16,
+    "ride_offer": 17,
+}
+FIELD_CODES: Dict[str, int] = {
+    "event": 0,
+    "type": 1,
+    "action": 2,
+    "ride_id": 3,
+    "user_id": 4,
+    "driver_id": 5,
+    "pickup": 6,
+    "dropoff": 7,
+    "pickup_lat": 8,
+    "pickup_lng": 9,
+    "dropoff_lat": 10,
+    "dropoff_lng": 11,
+    "status": 12,
+    "created_at": 13,
+    "message": 14,
+    "rides": 15,
+    "is_driver": 16,
+    "payload": 17,
+    "broadcast_to_drivers": 18,
+    "lat": 19,
+    "lng": 20,
+    "expires_in": 21,
+}
+CODED_VALUES = frozenset(("event", "type", "action"))
+_CONTAINERS = (dict, list)
+
+EVENT_NAMES = {code: name for name, code in EVENT_CODES.items()}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+
+def available() -> list:
+    return [JSON, MSGPACK] if msgpack else [JSON]
+
+
+def negotiate(websocket: WebSocket) -> Optional[str]:
+    """Pick the subprotocol to accept with; None means the client offered none (plain JSON)"""
+    offered = websocket.scope.get("subprotocols") or []
+    for proto in offered:
+        if proto in available():
+            return proto
+    return None
+
+
+def protocol_of(websocket: WebSocket) -> str:
+    return websocket.scope.get(SCOPE_KEY, JSON)
+
+
+async def accept(websocket: WebSocket) -> str:
+    """Accept the socket with the negotiated subprotocol and remember it on the scope"""
+    proto = negotiate(websocket)
+    await websocket.accept(subprotocol=proto)
+    websocket.scope[SCOPE_KEY] = proto or JSON
+    return proto or JSON
+
+
+# --- MessagePack mapping ---
+def _compact(obj: Any) -> Any:
+    if type(obj) is dict:
+        return {
+            FIELD_CODES.get(key, key): (
+                EVENT_CODES.get(value, value) if key in CODED_VALUES and type(value) is str
+                else _compact(value) if type(value) in _CONTAINERS
+                else value
+            )
+            for key, value in obj.items()
+        }
+    if type(obj) is list:
+        return [_compact(item) if type(item) in _CONTAINERS else item for item in obj]
+    return obj
+
+
+def _expand(obj: Any) -> Any:
+    if type(obj) is dict:
+        out = {}
+        for key, value in obj.items():
+            name = FIELD_NAMES.get(key, key)
+            if name in CODED_VALUES and type(value) is int:
+                value = EVENT_NAMES.get(value, value)
+            elif type(value) in _CONTAINERS:
+                value = _expand(value)
+            out[name] = value
+        return out
+    if type(obj) is list:
+        return [_expand(item) if type(item) in _CONTAINERS else item for item in obj]
+    return obj
+
+
+def encode(proto: str, message: Any):
+    """Frame payload for a protocol: str for JSON text frames, bytes for MSGPACK"""
+    if proto == MSGPACK:
+        return msgpack.packb(_compact(message), default=codec.encode_default)
+    return codec.dumps_str(message)
+
+
+def decode(proto: str, frame) -> Any:
+    if proto == MSGPACK:
+        return _expand(msgpack.unpackb(frame, strict_map_key=False))
+    return codec.loads(frame)
+
+
+async def send(websocket: WebSocket, message: Any):
+    frame = encode(protocol_of(websocket), message)
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
+
+async def receive(websocket: WebSocket) -> Any:
+    proto = protocol_of(websocket)
+    if proto == MSGPACK:
+        return decode(proto, await websocket.receive_bytes())
+    return decode(proto, await websocket.receive_text())
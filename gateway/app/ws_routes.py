@@ -1,22 +1,27 @@
 # ws_routes.py
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from typing import Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
 from .auth import decode_token_for_ws
-from .database import get_db
+from .database import AsyncSessionLocal
 from .models import Ride, User
+from .schemas import RideCreate
+from . import driver_availability, driver_locations, ws_manager, ws_protocol, ride_cache, ride_offers, ride_state
+from .redis_pool import async_redis_client
 from .ws_manager import add_connection, remove_connection
-from sqlalchemy.orm import Session
-import json
+from .ws_routing import publish_event_async
 
 router = APIRouter(prefix="/ws", tags=["WebSocket"])
 
 active_connections = {}  # user_id -> WebSocket object (kept for backward compatibility)
 
 
-async def connect_user(user_id: int, websocket: WebSocket):
-    await websocket.accept()
+async def connect_user(user_id: int, websocket: WebSocket, is_driver: bool = False,
+                       position: Optional[tuple] = None, position_at: Optional[float] = None):
+    await ws_protocol.accept(websocket)
     active_connections[user_id] = websocket
     # Also register in ws_manager for Redis pub/sub broadcasting
-    add_connection(user_id, websocket)
+    add_connection(user_id, websocket, is_driver=is_driver, position=position, position_at=position_at)
     print(f"User {user_id} connected")
 
 
@@ -29,40 +34,196 @@ async def disconnect_user(user_id: int):
 
 
 async def send_message(user_id: int, message: dict):
-    if user_id in active_connections:
-        await active_connections[user_id].send_json(message)
-
-
-async def broadcast_to_drivers(message: dict, db: Session):
-    """Broadcast message to all connected drivers"""
-    driver_connections = []
-    for conn_user_id, conn_ws in active_connections.items():
-        conn_user = db.query(User).filter(User.id == conn_user_id).first()
-        if conn_user and conn_user.is_driver:
-            driver_connections.append(conn_ws)
-    
-    print(f"[WS] Broadcasting to {len(driver_connections)} driver connections")
-    for ws in driver_connections:
-        try:
-            await ws.send_json(message)
-        except Exception as e:
-            print(f"[WS] Error sending to driver: {e}")
+    """Deliver to a user wherever they are connected, this gateway or another"""
+    await publish_event_async(ws_manager.async_redis_client, message, recipients=[user_id])
+
+
+async def broadcast_to_drivers(message: dict) -> int:
+    """Broadcast message to the connected drivers of every gateway"""
+    return await publish_event_async(ws_manager.async_redis_client, {**message, "broadcast_to_drivers": True})
+
+
+async def handle_location_update(websocket: WebSocket, user: User, data: dict):
+    """Buffer a driver's GPS ping; no reply unless it is rejected"""
+    if not user.is_driver:
+        await ws_protocol.send(websocket, {"event": "error", "message": "Only drivers can report a location"})
+        return
+    source = data.get("payload") or data
+    lat, lng = source.get("lat"), source.get("lng")
+    if not driver_locations.valid_position(lat, lng):
+        await ws_protocol.send(websocket, {"event": "error", "message": "Invalid location"})
+        return
+    driver_locations.record(user.id, lat, lng)
+    ws_manager.update_driver_position(user.id, lat, lng)
+
+
+async def handle_action(websocket: WebSocket, user: User, action: str, data: dict):
+    """Handle one client action on its own short-lived session"""
+    async with AsyncSessionLocal() as db:
+        # Handle ride_requested or ride_request (support both formats)
+        if action == "ride_requested" or action == "ride_request":
+            pickup = data.get("pickup") or (data.get("payload") and data["payload"].get("pickup"))
+            dropoff = data.get("dropoff") or (data.get("payload") and data["payload"].get("dropoff"))
+
+            if not pickup or not dropoff:
+                await ws_protocol.send(websocket, {
+                    "event": "error",
+                    "message": "Missing pickup or dropoff location"
+                })
+                return
+
+            # Same checks as POST /rides/: coordinates must be numbers within range
+            source = data.get("payload") or data
+            try:
+                ride = RideCreate(
+                    pickup=pickup,
+                    dropoff=dropoff,
+                    pickup_lat=source.get("pickup_lat"),
+                    pickup_lng=source.get("pickup_lng"),
+                    dropoff_lat=source.get("dropoff_lat"),
+                    dropoff_lng=source.get("dropoff_lng"),
+                )
+            except ValidationError as e:
+                await ws_protocol.send(websocket, {
+                    "event": "error",
+                    "message": f"Invalid ride request: {e.errors()[0]['msg']}"
+                })
+                return
+            print(f"Creating ride: {pickup} -> {dropoff}")
+            db_ride = Ride(user_id=user.id, status="requested", **ride.model_dump())
+            db.add(db_ride)
+            await db.commit()
+            print(f"Ride created: {db_ride.id}")
+            await ride_cache.invalidate_async(async_redis_client, user_id=user.id)
+
+            # Notify drivers near the pickup
+            await broadcast_to_drivers({
+                "event": "new_ride",
+                "ride_id": db_ride.id,
+                "pickup": pickup,
+                "dropoff": dropoff,
+                "pickup_lat": db_ride.pickup_lat,
+                "pickup_lng": db_ride.pickup_lng,
+                "user_id": user.id
+            })
+
+            await ws_protocol.send(websocket, {
+                "event": "ride_created",
+                "ride_id": db_ride.id,
+                "message": "Ride created and drivers notified"
+            })
+
+        # Driver accepts a ride
+        elif action == "ride_assigned" or action == "ride_accept":
+            if not user.is_driver:
+                await ws_protocol.send(websocket, {
+                    "event": "error",
+                    "message": "Only drivers can assign rides"
+                })
+                return
+            ride_id = data.get("ride_id") or (data.get("payload") and data["payload"].get("ride_id"))
+            if not ride_id:
+                await ws_protocol.send(websocket, {
+                    "event": "error",
+                    "message": "Missing ride_id"
+                })
+                return
+
+            booked = assigned = False
+            try:
+                await ride_offers.check_async(async_redis_client, ride_id, user.id)
+                booked = await driver_availability.take_async(async_redis_client, ride_id, user.id)
+                db_ride = await ride_state.assign_async(db, ride_id, user.id)
+                assigned = True
+            except ride_state.TransitionFailed as e:
+                await ws_protocol.send(websocket, {
+                    "event": "error",
+                    "message": e.detail
+                })
+                return
+            finally:
+                # Undo the booking whatever stopped the assignment, not just a conflict
+                if booked and not assigned:
+                    await driver_availability.release_async(async_redis_client, ride_id, [user.id])
+            await ride_offers.release_async(async_redis_client, ride_id)
+            await ride_cache.invalidate_async(async_redis_client, user_id=db_ride.user_id, driver_id=user.id)
+            await send_message(db_ride.user_id, {
+                "event": "ride_assigned",
+                "ride_id": db_ride.id,
+                "driver_id": user.id,
+            })
+            await ws_protocol.send(websocket, {
+                "event": "ride_assigned_success",
+                "ride_id": db_ride.id
+            })
+
+        # Driver completes ride
+        elif action == "ride_completed" or action == "ride_complete":
+            if not user.is_driver:
+                await ws_protocol.send(websocket, {
+                    "event": "error",
+                    "message": "Only drivers can assign rides"
+                })
+                return
+            ride_id = data.get("ride_id") or (data.get("payload") and data["payload"].get("ride_id"))
+            if not ride_id:
+                await ws_protocol.send(websocket, {
+                    "event": "error",
+                    "message": "Missing ride_id"
+                })
+                return
+
+            try:
+                db_ride = await ride_state.complete_async(db, ride_id, user.id)
+            except ride_state.TransitionFailed as e:
+                await ws_protocol.send(websocket, {
+                    "event": "error",
+                    "message": e.detail
+                })
+                return
+            await driver_availability.release_async(async_redis_client, ride_id, [user.id])
+            await ride_cache.invalidate_async(async_redis_client, user_id=db_ride.user_id, driver_id=user.id)
+            await send_message(db_ride.user_id, {
+                "event": "ride_completed",
+                "ride_id": db_ride.id,
+            })
+            await ws_protocol.send(websocket, {
+                "event": "ride_completed_success",
+                "ride_id": db_ride.id
+            })
+        else:
+            await ws_protocol.send(websocket, {
+                "event": "error",
+                "message": f"Unknown action: {action}"
+            })
 
 
 @router.websocket("")
-async def websocket_endpoint(websocket: WebSocket, token: str, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, token: str):
     try:
         user_data = decode_token_for_ws(token)
-        user = db.query(User).filter(User.id == int(user_data["sub"])).first()
+        async with AsyncSessionLocal() as db:
+            user = await db.get(User, int(user_data["sub"]))
 
         if not user:
             await websocket.close(code=1008, reason="User not found")
             return
 
-        await connect_user(user.id, websocket)
+        # Drivers start at their live position, if they reported one recently (e.g. before
+        # a reconnect), until their first location_update; users.last_lat/lng may be days old
+        position = position_at = None
+        if user.is_driver:
+            try:
+                live = await driver_locations.live_position_async(async_redis_client, user.id)
+            except Exception as e:
+                print(f"[WS] Could not read live position of driver {user.id}: {e}")
+                live = None
+            if live is not None:
+                position, position_at = live[:2], live[2]
+        await connect_user(user.id, websocket, is_driver=user.is_driver, position=position, position_at=position_at)
         
         # Send welcome message
-        await websocket.send_json({
+        await ws_protocol.send(websocket, {
             "event": "connected",
             "message": "WebSocket connection established",
             "user_id": user.id,
@@ -72,162 +233,24 @@ async def websocket_endpoint(websocket: WebSocket, token: str, db: Session = Dep
         while True:
             try:
                 # Wait for message with timeout handling
-                data = await websocket.receive_json()
+                data = await ws_protocol.receive(websocket)
                 action = data.get("action") or data.get("event")  # Support both formats
+                # GPS pings are the bulk of inbound traffic: no logging, no session
+                if action == "location_update":
+                    await handle_location_update(websocket, user, data)
+                    continue
                 print(f"Received action: {action}")
                 
                 # Handle empty messages or ping/pong
                 if not action or action == "ping":
-                    await websocket.send_json({"event": "pong"})
+                    await ws_protocol.send(websocket, {"event": "pong"})
                     continue
                 
-                # Handle ride_requested or ride_request (support both formats)
-                if action == "ride_requested" or action == "ride_request":
-                    pickup = data.get("pickup") or (data.get("payload") and data["payload"].get("pickup"))
-                    dropoff = data.get("dropoff") or (data.get("payload") and data["payload"].get("dropoff"))
-                    
-                    if not pickup or not dropoff:
-                        await websocket.send_json({
-                            "event": "error",
-                            "message": "Missing pickup or dropoff location"
-                        })
-                        continue
-                    
-                    print(f"Creating ride: {pickup} -> {dropoff}")
-                    db_ride = Ride(user_id=user.id, pickup=pickup, dropoff=dropoff, status="requested")
-                    db.add(db_ride)
-                    db.commit()
-                    db.refresh(db_ride)
-                    print(f"Ride created: {db_ride.id}")
-                    
-                    # Notify all drivers
-                    driver_count = 0
-                    for conn_user_id, conn_ws in active_connections.items():
-                        conn_user = db.query(User).filter(User.id == conn_user_id).first()
-                        if conn_user and conn_user.is_driver:
-                            try:
-                                await conn_ws.send_json({
-                                    "event": "new_ride",
-                                    "ride_id": db_ride.id,
-                                    "pickup": pickup,
-                                    "dropoff": dropoff,
-                                    "user_id": user.id
-                                })
-                                driver_count += 1
-                            except Exception as e:
-                                print(f"Error sending to driver {conn_user_id}: {e}")
-                    
-                    await websocket.send_json({
-                        "event": "ride_created",
-                        "ride_id": db_ride.id,
-                        "message": f"Ride created and notified {driver_count} drivers"
-                    })
-                    print(f'Notified {driver_count} driver connections')
-                
-                # Driver accepts a ride
-                elif action == "ride_assigned" or action == "ride_accept":
-                    if not user.is_driver:
-                        await websocket.send_json({
-                            "event": "error",
-                            "message": "Only drivers can assign rides"
-                        })
-                        continue
-                    ride_id = data.get("ride_id") or (data.get("payload") and data["payload"].get("ride_id"))
-                    if not ride_id:
-                        await websocket.send_json({
-                            "event": "error",
-                            "message": "Missing ride_id"
-                        })
-                        continue
-                    
-                    db_ride = db.query(Ride).filter(Ride.id == ride_id).first()
-                    if db_ride:
-                        if not db_ride:
-                            await websocket.send_json({
-                                "event": "error",
-                                "message": "Ride not found"
-                            })
-                            continue
-                        if db_ride.status != "requested":
-                            await websocket.send_json({
-                                "event": "error",
-                                "message": "Ride already assigned or completed"
-                            })
-                            continue
-                        db_ride.driver_id = user.id
-                        db_ride.status = "assigned"
-                        db.commit()
-                        db.refresh(db_ride)
-                        await send_message(db_ride.user_id, {
-                            "event": "ride_assigned",
-                            "ride_id": db_ride.id,
-                            "driver_id": user.id,
-                        })
-                        await websocket.send_json({
-                            "event": "ride_assigned_success",
-                            "ride_id": db_ride.id
-                        })
-                    else:
-                        await websocket.send_json({
-                            "event": "error",
-                            "message": "Ride not found"
-                        })
-
-                # Driver completes ride
-                elif action == "ride_completed" or action == "ride_complete":
-                    if not user.is_driver:
-                        await websocket.send_json({
-                            "event": "error",
-                            "message": "Only drivers can assign rides"
-                        })
-                        continue
-                    ride_id = data.get("ride_id") or (data.get("payload") and data["payload"].get("ride_id"))
-                    if not ride_id:
-                        await websocket.send_json({
-                            "event": "error",
-                            "message": "Missing ride_id"
-                        })
-                        continue
-                    
-                    db_ride = db.query(Ride).filter(Ride.id == ride_id).first()
-                    if db_ride:
-                        if not db_ride:
-                            await websocket.send_json({
-                                "event": "error",
-                                "message": "Ride not found"
-                            })
-                            continue
-
-                        if db_ride.status != "assigned":
-                            await websocket.send_json({
-                                "event": "error",
-                                "message": "Ride not assigned to driver"
-                            })
-                            continue
-                        db_ride.status = "completed"
-                        db.commit()
-                        await send_message(db_ride.user_id, {
-                            "event": "ride_completed",
-                            "ride_id": db_ride.id,
-                        })
-                        await websocket.send_json({
-                            "event": "ride_completed_success",
-                            "ride_id": db_ride.id
-                        })
-                    else:
-                        await websocket.send_json({
-                            "event": "error",
-                            "message": "Ride not found"
-                        })
-                else:
-                    await websocket.send_json({
-                        "event": "error",
-                        "message": f"Unknown action: {action}"
-                    })
-                    
+                await handle_action(websocket, user, action, data)
+
             except Exception as e:
                 print(f"Error processing message: {e}")
-                await websocket.send_json({
+                await ws_protocol.send(websocket, {
                     "event": "error",
                     "message": str(e)
                 })
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import socket
+import uuid
+from typing import Iterable, List, Optional
+
+from . import codec
+
+# Every gateway process gets its own channel; publishers look up which
+# gateways hold a user's sockets and publish only to those.
+NODE_ID = os.getenv("GATEWAY_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+NODE_TTL = int(os.getenv("GATEWAY_NODE_TTL", 30))
+
+CHANNEL_PREFIX = "ride_updates:node:"
+BROADCAST_CHANNEL = "ride_updates:broadcast"
+USER_NODES_PREFIX = "ws:user_nodes:"
+NODE_ALIVE_PREFIX = "ws:node_alive:"
+
+# Publishes the payload once to each live gateway holding any of the users in
+# KEYS, pruning registrations left behind by gateways that died.
+# KEYS: user node sets; ARGV[1]: payload, ARGV[2]: alive key prefix, ARGV[3]: channel prefix
+#
+# Requires a single Redis instance (or a primary with replicas), not Redis
+# Cluster: the node-alive keys it checks are built from ARGV[2] and the set
+# members, so they are not declared in KEYS, and the user node sets of one
+# event may hash to different slots anyway. Resolving the nodes first would
+# take a round trip, which publish_event cannot make when it is queued on a
+# caller's pipeline.
+ROUTE_SCRIPT = """
+local sent = {}
+local count = 0
+for _, key in ipairs(KEYS) do
+  for _, node in ipairs(redis.call('SMEMBERS', key)) do
+    if not sent[node] then
+      if redis.call('EXISTS', ARGV[2] .. node) == 1 then
+        sent[node] = true
+        redis.call('PUBLISH', ARGV[3] .. node, ARGV[1])
+        count = count + 1
+      else
+        redis.call('SREM', key, node)
+      end
+    end
+  end
+end
+return count
+"""
+
+
+def node_channel(node_id: str = NODE_ID) -> str:
+    return CHANNEL_PREFIX + node_id
+
+
+def user_nodes_key(user_id: int) -> str:
+    return f"{USER_NODES_PREFIX}{user_id}"
+
+
+def _route(data: dict, recipients: Optional[Iterable[int]]):
+    """Work out (channel, keys, payload) for an event; channel is set for broadcasts"""
+    if recipients is not None:
+        recipients = [int(r) for r in recipients if r]
+        data = {**data, "_to": recipients}
+    payload = codec.dumps(data)
+    if recipients is None and (data.get("broadcast") or data.get("broadcast_to_drivers")):
+        return BROADCAST_CHANNEL, [], payload
+    if recipients is None:
+        recipients = [r for r in (data.get("user_id"), data.get("driver_id")) if r]
+    keys = [user_nodes_key(r) for r in dict.fromkeys(recipients)]
+    return None, keys, payload
+
+
+def publish_event(client, data: dict, recipients: Optional[List[int]] = None):
+    """
+    Publish a ride update to the gateways that hold its recipients.
+    By default the recipients are the event's user_id and driver_id; pass
+    recipients to address specific users only. Works with a sync client or pipeline.
+    Needs a non-cluster Redis; see ROUTE_SCRIPT.
+    """
+    channel, keys, payload = _route(data, recipients)
+    if channel:
+        return client.publish(channel, payload)
+    if not keys:
+        return 0
+    # register_script goes through EVALSHA and preloads the script for pipelines
+    route = client.register_script(ROUTE_SCRIPT)
+    return route(keys=keys, args=[payload, NODE_ALIVE_PREFIX, CHANNEL_PREFIX])
+
+
+async def publish_event_async(client, data: dict, recipients: Optional[List[int]] = None):
+    """publish_event for redis.asyncio clients"""
+    channel, keys, payload = _route(data, recipients)
+    if channel:
+        return await client.publish(channel, payload)
+    if not keys:
+        return 0
+    route = client.register_script(ROUTE_SCRIPT)
+    return await route(keys=keys, args=[payload, NODE_ALIVE_PREFIX, CHANNEL_PREFIX])
+
+
+# --- Gateway side (redis.asyncio) ---
+async def register_user(client, user_id: int):
+    await client.sadd(user_nodes_key(user_id), NODE_ID)
+
+
+async def unregister_user(client, user_id: int):
+    await client.srem(user_nodes_key(user_id), NODE_ID)
+
+
+async def heartbeat(client):
+    """Keep this gateway's liveness key alive; publishers skip nodes whose key expired"""
+    while True:
+        try:
+            await client.set(NODE_ALIVE_PREFIX + NODE_ID, 1, ex=NODE_TTL)
+        except Exception as e:
+            print(f"[WS] Node heartbeat failed: {e}")
+        await asyncio.sleep(NODE_TTL / 3)
+
+
+async def shutdown(client, user_ids: Iterable[int]):
+    """Withdraw this gateway's liveness key and user registrations"""
+    pipe = client.pipeline(transaction=False)
+    pipe.delete(NODE_ALIVE_PREFIX + NODE_ID)
+    for user_id in user_ids:
+        pipe.srem(user_nodes_key(user_id), NODE_ID)
+    await pipe.execute()
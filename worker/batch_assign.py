@@ -0,0 +1,60 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy is optional, greedy matching needs only numpy
+    linear_sum_assignment = None
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def distance_matrix(ride_points: np.ndarray, driver_points: np.ndarray) -> np.ndarray:
+    """Haversine distances (km) between every ride (rows) and driver (columns)"""
+    r = np.radians(ride_points)
+    d = np.radians(driver_points)
+    dlat = d[None, :, 0] - r[:, None, 0]
+    dlng = d[None, :, 1] - r[:, None, 1]
+    a = np.sin(dlat / 2) ** 2 + np.cos(r[:, None, 0]) * np.cos(d[None, :, 0]) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def greedy_assignment(cost: np.ndarray):
+    """Repeatedly take the cheapest remaining (ride, driver) pair"""
+    n_rides, n_drivers = cost.shape
+    order = np.argsort(cost, axis=None, kind="stable")
+    rows, cols = np.unravel_index(order, cost.shape)
+    ride_taken = np.zeros(n_rides, dtype=bool)
+    driver_taken = np.zeros(n_drivers, dtype=bool)
+    pairs = []
+    limit = min(n_rides, n_drivers)
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        if ride_taken[i] or driver_taken[j] or not np.isfinite(cost[i, j]):
+            continue
+        ride_taken[i] = driver_taken[j] = True
+        pairs.append((i, j))
+        if len(pairs) == limit:
+            break
+    return pairs
+
+
+def solve_batch(ride_points, driver_points, solver: str = "greedy", max_distance_km: float = None):
+    """
+    Assign rides to drivers minimising total pickup distance.
+    Returns (ride_index, driver_index, distance_km) triples; rides left out had
+    no driver within max_distance_km or there were fewer drivers than rides.
+    """
+    if len(ride_points) == 0 or len(driver_points) == 0:
+        return []
+    cost = distance_matrix(np.asarray(ride_points, dtype=float), np.asarray(driver_points, dtype=float))
+    if max_distance_km is not None:
+        cost = np.where(cost <= max_distance_km, cost, np.inf)
+
+    if solver == "hungarian" and linear_sum_assignment is not None:
+        # linear_sum_assignment rejects inf, so out-of-range pairs get a prohibitive cost
+        finite = np.where(np.isfinite(cost), cost, 1e9)
+        rows, cols = linear_sum_assignment(finite)
+        pairs = [(i, j) for i, j in zip(rows.tolist(), cols.tolist()) if np.isfinite(cost[i, j])]
+    else:
+        pairs = greedy_assignment(cost)
+
+    return [(i, j, float(cost[i, j])) for i, j in pairs]
@@ -5,92 +5,503 @@ import os
 sys.path.append("/app/gateway")
 
 from dotenv import load_dotenv
-import redis
 import os
 from sqlalchemy.orm import Session
-from app import models, database
-import json
+from app import models, database, driver_availability, ride_cache, ride_offers, ride_queue, ride_state, driver_locations
+from app.geo import DriverGrid
+from app.timing_wheel import TimingWheel
+from app.redis_pool import redis_client
+from app.ws_routing import publish_event
+from batch_assign import solve_batch
+import random
+import socket
 import time
+from typing import Dict, List, Optional
 
 load_dotenv()
 
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT")),
-    password=os.getenv("REDIS_PASSWORD"),
-    ssl=os.getenv("REDIS_TLS") == "true",
-)
-
 
 MAX_RETRIES = 5
-RETRY_DELAY = 5
-PROCESSED_KEY = "ride_queue:processed"
-FAILED_KEY = "ride_queue:failed"
+# Rides with no driver free are retried after RETRY_DELAY * 2^(attempt-1)
+# seconds, capped at RETRY_MAX_DELAY, with jitter so retries do not bunch up
+RETRY_DELAY = float(os.getenv("RETRY_DELAY", 5))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 60))
+DRIVER_INDEX_REFRESH = float(os.getenv("DRIVER_INDEX_REFRESH", 30))
+# Stream consumer name; must be unique per worker process
+CONSUMER = os.getenv("WORKER_NAME") or f"{socket.gethostname()}-{os.getpid()}"
+READ_COUNT = int(os.getenv("STREAM_READ_COUNT", 50))
+# How often to take over rides left pending by workers that died; see ride_queue.CLAIM_IDLE_MS
+RECLAIM_INTERVAL = float(os.getenv("STREAM_RECLAIM_INTERVAL", 15))
+# How often to move due retries from the delay set back onto the stream
+PROMOTE_INTERVAL = float(os.getenv("RETRY_PROMOTE_INTERVAL", 1))
+
+# WORKER_MODE=batch drains up to BATCH_SIZE rides (or waits BATCH_WAIT_MS) and solves them together
+WORKER_MODE = os.getenv("WORKER_MODE", "single")
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 100))
+BATCH_WAIT_MS = int(os.getenv("BATCH_WAIT_MS", 200))
+BATCH_SOLVER = os.getenv("BATCH_SOLVER", "greedy")  # greedy | hungarian (needs scipy)
+BATCH_CANDIDATES = int(os.getenv("BATCH_CANDIDATES", 10))
+# Drivers further than this from a pickup are never matched to it
+DRIVER_SEARCH_RADIUS_KM = float(os.getenv("DRIVER_SEARCH_RADIUS_KM", 50))
+
+# WORKER_MODE=single offers each ride to OFFER_WAVE drivers at a time, nearest
+# first, and moves on to the next wave when nobody accepts within OFFER_TIMEOUT
+OFFER_TIMEOUT = float(os.getenv("OFFER_TIMEOUT", 15))
+OFFER_WAVE = int(os.getenv("OFFER_WAVE", 1))
+OFFER_MAX_WAVES = int(os.getenv("OFFER_MAX_WAVES", 5))
+OFFER_TICK = float(os.getenv("OFFER_TICK", 0.1))
+OFFER_GRACE = 2.0
+# Nearest drivers tried per wave; the first OFFER_WAVE still available get booked
+OFFER_CANDIDATES = int(os.getenv("OFFER_CANDIDATES", 10))
+
+# In-memory spatial index of online drivers not on a ride, rebuilt every DRIVER_INDEX_REFRESH seconds
+driver_index = DriverGrid()
+_driver_index_loaded_at = 0.0
+# The same drivers in random order, for rides without coordinates: each call
+# to spare_drivers carries on where the last one stopped, so the first few
+# drivers of the index are not the ones always asked
+_spare_order: List[int] = []
+_spare_cursor = 0
+
+# Rides being offered and their expiry timers. Drivers holding an offer are
+# booked in app.driver_availability, so no other worker offers them a ride.
+offers: Dict[int, "Offer"] = {}
+offer_timers = TimingWheel(tick=OFFER_TICK)
+_reclaimed_at = 0.0
+_promoted_at = 0.0
+
+
+def busy_drivers_query(db: Session):
+    return db.query(models.Ride.driver_id).filter(
+        models.Ride.status == "assigned", models.Ride.driver_id.isnot(None)
+    )
+
+
+def available_drivers_query(db: Session):
+    """Stored positions of drivers that are not on an active ride"""
+    return db.query(models.User.id, models.User.last_lat, models.User.last_lng).filter(
+        models.User.is_driver == True,
+        models.User.last_lat.isnot(None),
+        models.User.last_lng.isnot(None),
+        models.User.id.notin_(busy_drivers_query(db)),
+    )
 
 
-def assign_driver(db: Session, ride_id: int):
+def refresh_driver_index(db: Session, force: bool = False):
+    """Reload positions of drivers that are online and not on an active ride"""
+    global _driver_index_loaded_at
+    now = time.monotonic()
+    if not force and now - _driver_index_loaded_at < DRIVER_INDEX_REFRESH:
+        return
+    # Stored positions first, then live GPS positions from the gateways on top
+    positions = {row.id: (row.last_lat, row.last_lng) for row in available_drivers_query(db)}
     try:
-        driver = db.query(models.User).filter(models.User.is_driver == True).first()
-        if not driver:
-            print("No driver available")
+        live = driver_locations.live_positions(redis_client)
+    except Exception as e:
+        print(f"Could not read live driver positions: {e}")
+        live = []
+    if live:
+        busy = {row.driver_id for row in busy_drivers_query(db)}
+        for driver_id, lat, lng in live:
+            if driver_id not in busy:
+                positions[driver_id] = (lat, lng)
+    # Stored positions cover every driver who ever reported one; offline ones
+    # would crowd the online ones out of the nearest few a wave tries
+    driver_ids = list(positions)
+    try:
+        for driver_id, is_online in zip(driver_ids, driver_availability.online(redis_client, driver_ids)):
+            if not is_online:
+                del positions[driver_id]
+    except Exception as e:
+        # Keep the old index rather than loading one full of offline drivers
+        print(f"Could not check which drivers are online: {e}")
+        return
+    driver_index.load((driver_id, lat, lng) for driver_id, (lat, lng) in positions.items())
+    _spare_order[:] = positions
+    random.shuffle(_spare_order)
+    _driver_index_loaded_at = now
+    print(f"Driver index refreshed: {len(driver_index)} available drivers")
+
+
+def spare_drivers(k: int, exclude=()) -> List[int]:
+    """Up to k indexed drivers not in exclude, taking turns through the whole index"""
+    global _spare_cursor
+    picked = []
+    total = len(_spare_order)
+    steps = 0
+    while steps < total and len(picked) < k:
+        driver_id = _spare_order[(_spare_cursor + steps) % total]
+        steps += 1
+        # Drivers assigned since the refresh have left the index
+        if driver_id in driver_index and driver_id not in exclude:
+            picked.append(driver_id)
+    if total:
+        _spare_cursor = (_spare_cursor + steps) % total
+    return picked
+
+
+class Offer:
+    """A ride being offered to drivers wave by wave"""
+    __slots__ = ("ride_id", "entry_id", "user_id", "pickup", "dropoff", "pickup_lat", "pickup_lng",
+                 "offered", "holders", "waves", "misses")
+
+    def __init__(self, ride: models.Ride, entry_id: str, attempts: int = 0):
+        self.ride_id = ride.id
+        self.entry_id = entry_id  # acked once the offer ends
+        self.user_id = ride.user_id
+        self.pickup = ride.pickup
+        self.dropoff = ride.dropoff
+        self.pickup_lat = ride.pickup_lat
+        self.pickup_lng = ride.pickup_lng
+        self.offered = set()  # every driver offered so far; never asked twice
+        self.holders = ()  # drivers of the current wave
+        self.waves = 0
+        self.misses = attempts  # earlier rounds that found nobody free
+
+
+def offer_candidates(db: Session, offer: Offer) -> list:
+    """
+    Book the next OFFER_WAVE drivers: the nearest OFFER_CANDIDATES not yet
+    offered this ride, claimed in one script so only online, free ones count.
+    """
+    refresh_driver_index(db)
+    if offer.pickup_lat is not None and offer.pickup_lng is not None:
+        nearest = driver_index.nearest(offer.pickup_lat, offer.pickup_lng, k=OFFER_CANDIDATES,
+                                       max_radius_km=DRIVER_SEARCH_RADIUS_KM, exclude=offer.offered)
+        candidates = [driver_id for driver_id, _ in nearest]
+    else:
+        candidates = spare_drivers(OFFER_CANDIDATES, exclude=offer.offered)
+    # Booked as long as the offer holds; a worker dying mid-offer cannot strand them
+    return driver_availability.claim(redis_client, offer.ride_id, candidates, OFFER_WAVE, OFFER_TIMEOUT + OFFER_GRACE)
+
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter: between half and all of the capped delay"""
+    delay = min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** (attempt - 1))
+    return delay / 2 + random.random() * delay / 2
+
+
+def end_offer(pipe, offer: Offer, failed: bool = False, retry_in: Optional[float] = None,
+              winner: Optional[int] = None):
+    """Stop offering the ride; with retry_in it goes back on the queue through the delay set"""
+    offers.pop(offer.ride_id, None)
+    offer_timers.cancel(offer.ride_id)
+    ride_offers.release(pipe, offer.ride_id)
+    # The driver who took the ride stays busy until they complete it
+    driver_availability.release(pipe, offer.ride_id, [d for d in offer.holders if d != winner])
+    offer.holders = ()
+    if retry_in is not None:
+        ride_queue.defer(pipe, {"ride_id": offer.ride_id, "attempts": offer.misses}, retry_in)
+    elif failed:
+        ride_queue.mark_failed(pipe, offer.ride_id)
+    else:
+        ride_queue.mark_processed(pipe, offer.ride_id)
+    ride_queue.ack(pipe, [offer.entry_id])
+
+
+def abandon_offers(ride_ids):
+    """
+    Forget offers whose pipeline never ran. Their stream entries stay pending,
+    so they are reclaimed after ride_queue.CLAIM_IDLE_MS and start afresh;
+    drivers booked for them lapse with the offer.
+    """
+    for ride_id in ride_ids:
+        offers.pop(ride_id, None)
+        offer_timers.cancel(ride_id)
+
+
+def send_wave(db: Session, pipe, offer: Offer):
+    """Offer the ride to the next wave, or retry later if nobody is free; queues Redis commands on pipe"""
+    # Right away rather than on pipe, so they count as free for the claims that follow
+    driver_availability.release(redis_client, offer.ride_id, offer.holders)
+    offer.holders = ()
+    if offer.waves >= OFFER_MAX_WAVES:
+        print(f"Ride {offer.ride_id} declined by {len(offer.offered)} drivers, leaving it open to all")
+        end_offer(pipe, offer, failed=True)
+        return
+    drivers = offer_candidates(db, offer)
+    if not drivers:
+        offer.misses += 1
+        if offer.misses >= MAX_RETRIES:
+            print(f"Failed to assign driver to ride {offer.ride_id} after {MAX_RETRIES} attempts")
+            end_offer(pipe, offer, failed=True)
             return
-        
-        db_ride = db.query(models.Ride).filter(models.Ride.id == ride_id).first()
-        db_ride.driver_id = driver.id
-        db_ride.status = "assigned"
-        db.commit()
-        payload = {
-            "type": "ride_assigned",
-            "ride_id": db_ride.id,
-            "user_id": db_ride.user_id,
-            "driver_id": db_ride.driver_id,
-            "status": db_ride.status
-        }
-        redis_client.publish("ride_updates", json.dumps(payload))
-        print(f"Driver {driver.id} assigned to ride {ride_id}")
-        return driver
-    except Exception:
-        db.rollback()
-        print(f"Error assigning driver to ride {ride_id}")
-        return False
+        # Off this worker's hands until then; the worker carries on with other rides
+        delay = retry_delay(offer.misses)
+        print(f"No driver available for ride {offer.ride_id}, retrying in {delay:.1f}s")
+        end_offer(pipe, offer, retry_in=delay)
+        return
+
+    offer.waves += 1
+    offer.offered.update(drivers)
+    offer.holders = drivers
+    # The hold outlives the timer slightly so the next wave replaces it before it lapses
+    ride_offers.hold(pipe, offer.ride_id, drivers, OFFER_TIMEOUT + OFFER_GRACE)
+    publish_event(pipe, {
+        "type": "ride_offer",
+        "event": "ride_offer",
+        "ride_id": offer.ride_id,
+        "pickup": offer.pickup,
+        "dropoff": offer.dropoff,
+        "pickup_lat": offer.pickup_lat,
+        "pickup_lng": offer.pickup_lng,
+        "expires_in": OFFER_TIMEOUT,
+    }, recipients=drivers)
+    offer_timers.schedule(offer.ride_id, OFFER_TIMEOUT)
+    # Still ours: keep the stream entry from looking abandoned to other workers
+    ride_queue.touch(pipe, CONSUMER, [offer.entry_id])
+    print(f"Ride {offer.ride_id} offered to drivers {drivers} (wave {offer.waves})")
+
 
-def process_ride(ride_data: dict):
-    ride_id = ride_data["ride_id"]
+def process_ride(entry_id: str, ride_data: dict):
+    """Start offering a ride; returns at once, expiries are handled by expire_offers"""
+    ride_id = ride_data.get("ride_id")
+    pipe = redis_client.pipeline(transaction=True)
     if not ride_id:
         print("No ride ID found")
+        ride_queue.ack(pipe, [entry_id])
+        pipe.execute()
         return False
-    db = next(database.get_db())
-    success = False
-    for attempt in range(1, MAX_RETRIES + 1):
-        success = assign_driver(db, ride_id)
-        if success:
-            redis_client.sadd(PROCESSED_KEY, ride_id)
-            break
+    offer = offers.get(ride_id)
+    if offer is not None:
+        # Queued twice; the offer in flight owns the ride
+        if offer.entry_id != entry_id:
+            ride_queue.ack(pipe, [entry_id])
+            pipe.execute()
+        return True
+    with database.session_scope() as db:
+        db_ride = db.get(models.Ride, ride_id)
+        if db_ride is None or db_ride.status != "requested":
+            print(f"Ride {ride_id} is no longer waiting for a driver")
+            ride_queue.mark_processed(pipe, ride_id)
+            ride_queue.ack(pipe, [entry_id])
         else:
-            redis_client.sadd(FAILED_KEY, ride_id)
-            time.sleep(RETRY_DELAY)
-    if not success:
-        print(f"Failed to assign driver to ride {ride_id} after {MAX_RETRIES} attempts")
-        return False
+            offer = offers[ride_id] = Offer(db_ride, entry_id, ride_data.get("attempts", 0))
+            try:
+                send_wave(db, pipe, offer)
+                pipe.execute()
+            except Exception:
+                abandon_offers([ride_id])
+                raise
+            return True
+    pipe.execute()
     return True
 
 
-if __name__ == "__main__":
-    db = next(database.get_db())
-    print("Worker started, listening for ride requests...")
+def expire_offers(now: Optional[float] = None) -> int:
+    """Escalate every offer whose timer fired: one query to see which rides are still open, one pipeline"""
+    expired = [ride_id for ride_id in offer_timers.advance(now) if ride_id in offers]
+    if not expired:
+        return 0
+    pipe = redis_client.pipeline(transaction=True)
+    try:
+        with database.session_scope() as db:
+            rows = {
+                row.id: row for row in db.query(models.Ride.id, models.Ride.status, models.Ride.driver_id)
+                .filter(models.Ride.id.in_(expired))
+            }
+            for ride_id in expired:
+                offer = offers[ride_id]
+                row = rows.get(ride_id)
+                if row is not None and row.status == "requested":
+                    send_wave(db, pipe, offer)
+                    continue
+                # Taken by one of the drivers (or cancelled) since the offer went out
+                winner = row.driver_id if row is not None else None
+                if winner:
+                    driver_index.remove(winner)
+                end_offer(pipe, offer, winner=winner)
+        pipe.execute()
+    except Exception:
+        # Their timers have fired, so left in offers they would never be looked at again
+        abandon_offers(expired)
+        raise
+    return len(expired)
+
+
+def drop_processed(entries: list) -> list:
+    """Ack entries whose ride is already processed and return the rest"""
+    ride_ids = [ride_data.get("ride_id") or 0 for _, ride_data in entries]
+    done = ride_queue.processed(redis_client, ride_ids)
+    stale = [entry_id for (entry_id, _), is_done in zip(entries, done) if is_done]
+    if stale:
+        print(f"Dropping {len(stale)} entries for rides already processed")
+        ride_queue.ack(redis_client, stale)
+    return [entry for entry, is_done in zip(entries, done) if not is_done]
+
+
+def read_entries(block_ms: int) -> list:
+    """New unprocessed stream entries for this worker, plus abandoned ones every RECLAIM_INTERVAL"""
+    global _reclaimed_at, _promoted_at
+    if time.monotonic() - _promoted_at >= PROMOTE_INTERVAL:
+        _promoted_at = time.monotonic()
+        ride_queue.promote(redis_client)
+    entries = ride_queue.read(redis_client, CONSUMER, READ_COUNT, block_ms)
+    if time.monotonic() - _reclaimed_at >= RECLAIM_INTERVAL:
+        _reclaimed_at = time.monotonic()
+        claimed = ride_queue.reclaim(redis_client, CONSUMER, READ_COUNT)
+        if claimed:
+            print(f"Reclaimed {len(claimed)} rides left pending by other workers")
+            # These skipped the dedupe in ride_queue.read
+            entries.extend(drop_processed(claimed))
+    return entries
+
+
+def drain_batch(max_size: int = BATCH_SIZE, max_wait_ms: int = BATCH_WAIT_MS):
+    """Wait for the first rides, then keep reading until the batch is full or the window closes"""
+    entries = read_entries(int(PROMOTE_INTERVAL * 1000))
+    if not entries:
+        return []
+    deadline = time.monotonic() + max_wait_ms / 1000.0
+    while len(entries) < max_size:
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            break
+        more = ride_queue.read(redis_client, CONSUMER, max_size - len(entries), remaining_ms)
+        if not more:
+            break
+        entries.extend(more)
+    return entries
+
+
+def process_batch(entries: list):
+    """Assign a whole batch of rides at once: one query, one solve, one commit, one pipeline"""
+    entry_ids = [entry_id for entry_id, _ in entries]
+    attempts = {d["ride_id"]: d.get("attempts", 0) for _, d in entries if d.get("ride_id")}
+    if not attempts:
+        ride_queue.ack(redis_client, entry_ids)
+        return 0
+    assignments = {}
+    lost = {}
+    with database.session_scope() as db:
+        try:
+            rides = db.query(models.Ride).filter(
+                models.Ride.id.in_(list(attempts)), models.Ride.status == "requested"
+            ).all()
+            refresh_driver_index(db)
+
+            # Only the few nearest drivers per ride enter the cost matrix,
+            # and only those online and free right now
+            located = [r for r in rides if r.pickup_lat is not None and r.pickup_lng is not None]
+            located_ids = {r.id for r in located}
+            unlocated = [r for r in rides if r.id not in located_ids]
+            candidate_ids = []
+            seen = set()
+            for ride in located:
+                for driver_id, _ in driver_index.nearest(ride.pickup_lat, ride.pickup_lng, k=BATCH_CANDIDATES,
+                                                     max_radius_km=DRIVER_SEARCH_RADIUS_KM):
+                    if driver_id not in seen:
+                        seen.add(driver_id)
+                        candidate_ids.append(driver_id)
+            # Rides without coordinates draw from the rest of the index, checked the same way
+            spare_ids = spare_drivers(len(unlocated) * BATCH_CANDIDATES, exclude=seen) if unlocated else []
+            free = driver_availability.available(redis_client, candidate_ids + spare_ids)
+            free_ids = {driver_id for driver_id, is_free in zip(candidate_ids + spare_ids, free) if is_free}
+            candidate_ids = [driver_id for driver_id in candidate_ids if driver_id in free_ids]
+            driver_points = [driver_index.position(driver_id) for driver_id in candidate_ids]
+            ride_points = [(r.pickup_lat, r.pickup_lng) for r in located]
+
+            for i, j, _ in solve_batch(ride_points, driver_points, solver=BATCH_SOLVER):
+                assignments[located[i].id] = candidate_ids[j]
+
+            # Rides without coordinates take the free spare drivers in turn
+            spare = (driver_id for driver_id in spare_ids if driver_id in free_ids)
+            for ride in unlocated:
+                driver_id = next(spare, None)
+                if driver_id is None:
+                    break
+                assignments[ride.id] = driver_id
+
+            # Book the drivers first; one booked elsewhere since the check loses its ride for
+            # this round. Every matched driver was free at the check, so losing it is a race.
+            matched = set(assignments)
+            assignments = driver_availability.claim_pairs(redis_client, assignments)
+            contended = matched - set(assignments)
+            # Captured before commit, which expires the ORM instances
+            open_rides = {ride.id: ride.user_id for ride in rides}
+            for ride_id, driver_id in list(assignments.items()):
+                if not ride_state.apply(db, ride_state.assign_stmt(ride_id, driver_id)):
+                    # Accepted by a driver since the SELECT; nothing left to do for it
+                    lost[ride_id] = assignments.pop(ride_id)
+                    open_rides.pop(ride_id)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            # Nothing was assigned, so free whoever got booked for it, lost rides' drivers included
+            pipe = redis_client.pipeline(transaction=False)
+            for ride_id, driver_id in [*assignments.items(), *lost.items()]:
+                driver_availability.release(pipe, ride_id, [driver_id])
+            pipe.execute()
+            # Left unacked: the entries are reclaimed after ride_queue.CLAIM_IDLE_MS
+            print(f"Error assigning batch of {len(attempts)} rides: {e}")
+            return 0
+
+    pipe = redis_client.pipeline(transaction=False)
+    for ride_id, driver_id in lost.items():
+        driver_availability.release(pipe, ride_id, [driver_id])
+    for ride_id, driver_id in assignments.items():
+        driver_index.remove(driver_id)
+        ride_cache.invalidate(pipe, user_id=open_rides[ride_id], driver_id=driver_id)
+        publish_event(pipe, {
+            "type": "ride_assigned",
+            "ride_id": ride_id,
+            "user_id": open_rides[ride_id],
+            "driver_id": driver_id,
+            "status": "assigned"
+        })
+        ride_queue.mark_processed(pipe, ride_id)
+    for ride_id, tries in attempts.items():
+        if ride_id in assignments:
+            continue
+        if ride_id not in open_rides:
+            # Already assigned, completed or deleted elsewhere
+            ride_queue.mark_processed(pipe, ride_id)
+        elif ride_id in contended:
+            # A driver was free for it but went to another worker first: retry after
+            # the base delay without spending one of the ride's attempts
+            ride_queue.defer(pipe, {"ride_id": ride_id, "attempts": tries}, retry_delay(1))
+        elif tries + 1 >= MAX_RETRIES:
+            ride_queue.mark_failed(pipe, ride_id)
+            print(f"Failed to assign driver to ride {ride_id} after {MAX_RETRIES} attempts")
+        else:
+            ride_queue.defer(pipe, {"ride_id": ride_id, "attempts": tries + 1}, retry_delay(tries + 1))
+    ride_queue.ack(pipe, entry_ids)
+    pipe.execute()
+
+    print(f"Batch: {len(assignments)}/{len(attempts)} rides assigned")
+    return len(assignments)
+
+
+def run_single():
+    ride_queue.ensure_group(redis_client)
     while True:
         try:
-            ride = redis_client.blpop("ride_queue", timeout=5)
-            if ride:
-                ride_data = json.loads(ride[1])
-                ride_id = ride_data["ride_id"]
-                if redis_client.sismember(PROCESSED_KEY, ride_id):
-                    print(f"Ride {ride_id} already processed")
-                    continue
-                process_ride(ride_data)
-            else:
-                time.sleep(1)
+            # Wake at least once per tick while offers are out, so timeouts fire on time,
+            # and once per PROMOTE_INTERVAL otherwise so due retries move
+            entries = read_entries(int((OFFER_TICK if offers else PROMOTE_INTERVAL) * 1000))
+            for entry_id, ride_data in entries:
+                process_ride(entry_id, ride_data)
+            expire_offers()
         except Exception as e:
             print(f"Error processing ride: {e}")
             time.sleep(5)
-            
+
+
+def run_batch():
+    ride_queue.ensure_group(redis_client)
+    while True:
+        try:
+            batch = drain_batch()
+            if batch:
+                process_batch(batch)
+        except Exception as e:
+            print(f"Error processing batch: {e}")
+            time.sleep(5)
+
+
+if __name__ == "__main__":
+    print(f"Worker {CONSUMER} started in {WORKER_MODE} mode, reading {ride_queue.STREAM_KEY}...")
+    if WORKER_MODE == "batch":
+        run_batch()
+    else:
+        run_single()